@@ -0,0 +1,500 @@
+"""
+Description:
+Generates synthetic photo libraries and times the scripts on them, so the effect of a change can
+be measured and regressions show up from run to run.
+
+The library consists of:
+* JPEGs with smooth random content (decoding them costs about as much as a photo of the same
+  size), most of them with an EXIF DateTimeOriginal,
+* RAW-like DNG files: a minimal TIFF with one strip of random sensor data and an Exif IFD, which
+  rawHash and exifReader read like a real DNG,
+* byte copies of earlier files, and copies that only differ in their metadata (same pixels or
+  RAW data, another DateTimeOriginal),
+spread over a directory tree of the given depth. File names contain the date, like
+'IMG_20170312_000042.jpg'. The library is generated from a seed, so the same options always give
+the same files; an existing library with the same options is reused.
+
+Timed are:
+* imageDuplicatesFinder, stage by stage in this process (walk, content, pixels, exif, winners),
+  and as a whole from the command line,
+* movePicsIntoDirs_ExifMethod_NEW and the writeDateTimeOriginal scripts, from the command line on
+  a fresh flat copy of the library (they only work on the current directory and change the
+  files). The writeDateTimeOriginal scripts need exiftool and are skipped without it.
+
+Every run appends one JSON line to the results file, with the options, the commit and the
+seconds per script and stage (the fastest of --repeat runs), and is compared with the last run
+with the same options.
+
+Usage:
+    python benchmark.py [--files 1000] [--size-kb 500] [--duplicates 0.2] [--raw 0.1] [-j 4]
+
+Requirements:
+* Python 3.9 or higher
+* Pillow library (`pip install pillow`)
+* exiftool (only for the writeDateTimeOriginal scripts)
+"""
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import random
+import struct
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+from pathlib import Path
+from datetime import datetime, timedelta
+from PIL import Image
+
+import fileWalker
+import rawHash
+
+SCRIPT_DIRECTORY = Path(__file__).resolve().parent
+MANIFEST = "benchmark_library.json"
+LIBRARY_VERSION = 2  # bump when the generated files change
+JPEG_QUALITY = 90
+BLOCK = 8  # the random content is generated at 1/BLOCK scale and enlarged, like a smooth photo
+FIRST_DATE = datetime(2005, 1, 1)
+DATE_RANGE = 20 * 365 * 86400  # seconds
+
+SCRIPTS = ["imageDuplicatesFinder", "movePicsIntoDirs_ExifMethod_NEW", "writeDateTimeOriginalFromFileName",
+           "writeDateTimeOriginalFromModifyDate", "writeSpecificDateTimeOriginal"]
+SCRIPT_ARGUMENTS = {"writeSpecificDateTimeOriginal": ["2011:04:24 16:45:00"]}
+EXIFTOOL_SCRIPTS = {"writeDateTimeOriginalFromFileName", "writeDateTimeOriginalFromModifyDate",
+                    "writeSpecificDateTimeOriginal"}
+
+
+def parse_args():
+    """
+    Parses command line arguments for the script.
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Generate a synthetic photo library and time the scripts on it.")
+    parser.add_argument("--library", type=Path,
+                        help="Directory of the library, empty or new; reused if it was generated with the same "
+                             "options (default: a temporary directory, deleted afterwards)")
+    parser.add_argument("--files", type=int, default=1000, help="Number of files (default: 1000)")
+    parser.add_argument("--size-kb", type=int, default=500,
+                        help="Average file size in KB, sizes vary by +-50%% (default: 500)")
+    parser.add_argument("--duplicates", type=float, default=0.2,
+                        help="Share of files that are byte copies of another file (default: 0.2)")
+    parser.add_argument("--metadata-copies", type=float, default=0.05,
+                        help="Share of files that are copies with another DateTimeOriginal (default: 0.05)")
+    parser.add_argument("--exif", type=float, default=0.8,
+                        help="Share of files with a DateTimeOriginal (default: 0.8)")
+    parser.add_argument("--raw", type=float, default=0.1, help="Share of RAW-like DNG files (default: 0.1)")
+    parser.add_argument("--depth", type=int, default=2, help="Depth of the directory tree (default: 2)")
+    parser.add_argument("--per-directory", type=int, default=100,
+                        help="Files per directory (default: 100)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator (default: 0)")
+    parser.add_argument("--scripts", nargs="+", choices=SCRIPTS, default=SCRIPTS,
+                        help="Scripts to time (default: all)")
+    parser.add_argument("--compare", choices=["pixels", "bytes"], default="pixels",
+                        help="--compare of imageDuplicatesFinder (default: pixels)")
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+                        help="--jobs of imageDuplicatesFinder (default: 4)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Runs per script, the fastest one counts (default: 1)")
+    parser.add_argument("--results", type=Path, default=Path("benchmark_results.jsonl"),
+                        help="JSON lines file the results are appended to (default: benchmark_results.jsonl)")
+    args = parser.parse_args()
+
+    for name in ["duplicates", "metadata_copies", "exif", "raw"]:
+        if not 0 <= getattr(args, name) <= 1:
+            print(f"[ERROR] --{name.replace('_', '-')} must be between 0 and 1. Aborting.")
+            sys.exit(1)
+    if args.duplicates + args.metadata_copies > 1:
+        print(f"[ERROR] --duplicates and --metadata-copies must not add up to more than 1. Aborting.")
+        sys.exit(1)
+    if args.files < 1 or args.size_kb < 1 or args.depth < 0 or args.per_directory < 1 or args.repeat < 1:
+        print(f"[ERROR] --files, --size-kb, --per-directory and --repeat must be positive. Aborting.")
+        sys.exit(1)
+    return args
+
+
+# --- library
+
+def random_date(rng: random.Random) -> datetime:
+    return FIRST_DATE + timedelta(seconds=rng.randrange(DATE_RANGE))
+
+
+def get_directory(number: int, directories: int, depth: int) -> Path:
+    """
+    Returns:
+        Path: The relative directory of the `number`th of `directories` directories, in a tree
+              that is `depth` levels deep and about equally wide on every level.
+    """
+    if depth == 0:
+        return Path()
+    fanout = max(2, math.ceil(directories ** (1 / depth)))
+    parts = []
+    for _ in range(depth):
+        number, digit = divmod(number, fanout)
+        parts.append(f"dir{digit:03d}")
+    return Path(*reversed(parts))
+
+
+def get_jpeg_bytes_per_pixel() -> float:
+    """
+    Returns:
+        float: The size of a generated JPEG per pixel, to choose dimensions for a file size.
+    """
+    size = 512
+    return len(make_jpeg(random.Random(0), size, size, None)) / (size * size)
+
+
+def make_jpeg(rng: random.Random, width: int, height: int, date: str | None) -> bytes:
+    small = (max(1, width // BLOCK), max(1, height // BLOCK))
+    image = Image.frombytes("RGB", small, rng.randbytes(small[0] * small[1] * 3))
+    image = image.resize((width, height), Image.BILINEAR)
+    exif = Image.Exif()
+    if date is not None:
+        exif.get_ifd(0x8769)[0x9003] = date
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=JPEG_QUALITY, exif=exif)
+    return output.getvalue()
+
+
+def make_dng(rng: random.Random, width: int, height: int, date: str | None) -> bytes:
+    """
+    Returns:
+        bytes: A little endian TIFF with IFD0 (dimensions, one strip of 16 bit sensor data and,
+               with a `date`, the Exif IFD pointer) and an Exif IFD holding DateTimeOriginal.
+    """
+    data = rng.randbytes(width * height * 2)
+    ifd0_entries = 5 + (1 if date is not None else 0)
+    ifd0 = 8
+    exif_ifd = ifd0 + 2 + 12 * ifd0_entries + 4
+    if date is not None:
+        date_offset = exif_ifd + 2 + 12 + 4
+        strip = date_offset + 20
+    else:
+        strip = exif_ifd  # no Exif IFD, the sensor data follows IFD0
+
+    entries = [(0x0100, 4, 1, width), (0x0101, 4, 1, height), (0x0102, 3, 1, 16),
+               (0x0111, 4, 1, strip), (0x0117, 4, 1, len(data))]
+    if date is not None:
+        entries.append((0x8769, 4, 1, exif_ifd))
+    header = b"II" + struct.pack("<HL", 42, ifd0)
+    header += struct.pack("<H", len(entries))
+    header += b"".join(struct.pack("<HHLL", *entry) for entry in entries) + struct.pack("<L", 0)
+    if date is not None:
+        header += struct.pack("<H", 1) + struct.pack("<HHLL", 0x9003, 2, 20, date_offset) + struct.pack("<L", 0)
+        header += date.encode("ascii") + b"\0"
+    content = header + data
+    # A DNG rawHash can't read would time its error path instead of the hashing
+    try:
+        readable = rawHash.get_image_data_ranges(content) == (f"{width}x{height}", [(strip, len(data))])
+    except ValueError:
+        readable = False
+    if not readable:
+        raise RuntimeError(f"generated DNG of {width}x{height} isn't read back by rawHash")
+    return content
+
+
+def generate_library(directory: Path, files: int = 1000, size_kb: int = 500, duplicates: float = 0.2,
+                     metadata_copies: float = 0.05, exif: float = 0.8, raw: float = 0.1, depth: int = 2,
+                     per_directory: int = 100, seed: int = 0) -> dict:
+    """
+    Writes a library as described in the module description to `directory`, or reuses the one
+    that is there if it was generated with the same options. A library generated with other
+    options is deleted; any other content of `directory` is never touched.
+
+    Returns:
+        dict: The manifest of the library: the options and the number of files of every kind.
+
+    Raises:
+        ValueError: If `directory` is neither empty, new nor a generated library.
+    """
+    options = {"version": LIBRARY_VERSION, "files": files, "size_kb": size_kb, "duplicates": duplicates,
+               "metadata_copies": metadata_copies, "exif": exif, "raw": raw, "depth": depth,
+               "per_directory": per_directory, "seed": seed}
+    manifest_file = directory / MANIFEST
+    if manifest_file.is_file():
+        manifest = json.loads(manifest_file.read_text())
+        if manifest["options"] == options:
+            print(f"[INFO] Reusing library: {directory.resolve()}")
+            return manifest
+        print(f"[INFO] Library was generated with other options, generating it again")
+        shutil.rmtree(directory)
+    elif directory.exists() and (not directory.is_dir() or any(directory.iterdir())):
+        # Only a directory with the manifest is a generated library that may be deleted
+        raise ValueError(f"{directory} exists and isn't a benchmark library, "
+                         f"pass an empty or new directory as --library")
+    directory.mkdir(parents=True, exist_ok=True)
+
+    print(f"[INFO] Generating {files} files in {directory.resolve()}")
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    bytes_per_pixel = get_jpeg_bytes_per_pixel()
+    directories = math.ceil(files / per_directory)
+    originals = []  # (path, kind, seed, width, height) of the files that aren't copies
+    counts = {"jpeg": 0, "raw": 0, "exif": 0, "duplicates": 0, "metadata_copies": 0, "bytes": 0}
+
+    for number in range(files):
+        draw = rng.random()
+        date = random_date(rng)
+        has_date = rng.random() < exif
+        subdirectory = directory / get_directory(number // per_directory, directories, depth)
+        subdirectory.mkdir(parents=True, exist_ok=True)
+
+        if originals and draw < duplicates:
+            source, kind = rng.choice(originals)[:2]
+            path = subdirectory / f"IMG_{date:%Y%m%d}_{number:06d}{source.suffix}"
+            shutil.copyfile(source, path)
+            counts["duplicates"] += 1
+        elif originals and draw < duplicates + metadata_copies:
+            _, kind, file_seed, width, height = rng.choice(originals)
+            make = make_dng if kind == "raw" else make_jpeg
+            content = make(random.Random(file_seed), width, height, f"{date:%Y:%m:%d %H:%M:%S}")
+            path = subdirectory / f"IMG_{date:%Y%m%d}_{number:06d}.{'dng' if kind == 'raw' else 'jpg'}"
+            path.write_bytes(content)
+            counts["metadata_copies"] += 1
+        else:
+            kind = "raw" if rng.random() < raw else "jpeg"
+            size = size_kb * 1024 * rng.uniform(0.5, 1.5)
+            if kind == "raw":
+                width = max(BLOCK, int(math.sqrt(size / 2 * 3 / 2)))
+                height = max(1, int(size / 2 / width))
+            else:
+                height = max(BLOCK, int(math.sqrt(size / bytes_per_pixel * 2 / 3)))
+                width = max(BLOCK, int(height * 3 / 2))
+            file_seed = rng.getrandbits(64)
+            make = make_dng if kind == "raw" else make_jpeg
+            content = make(random.Random(file_seed), width, height,
+                           f"{date:%Y:%m:%d %H:%M:%S}" if has_date else None)
+            path = subdirectory / f"IMG_{date:%Y%m%d}_{number:06d}.{'dng' if kind == 'raw' else 'jpg'}"
+            path.write_bytes(content)
+            originals.append((path, kind, file_seed, width, height))
+            counts["exif"] += has_date
+        counts[kind] += 1
+        counts["bytes"] += path.stat().st_size
+
+    manifest = {"options": options, "counts": counts, "generated": datetime.now().isoformat(timespec="seconds")}
+    manifest_file.write_text(json.dumps(manifest, indent=2))
+    print(f"[INFO] Generated {counts['jpeg']} JPEGs and {counts['raw']} DNGs, {counts['bytes'] / 1e6:.1f} MB, "
+          f"in {time.perf_counter() - start:.1f} s")
+    return manifest
+
+
+def copy_flat(library: Path, destination: Path) -> int:
+    """
+    Copies all images of the library into one directory, for the scripts that only work on the
+    current directory. Real copies, since the scripts change the files.
+
+    Returns:
+        int: The number of files copied.
+    """
+    destination.mkdir(parents=True)
+    count = 0
+    for file in fileWalker.get_files(library, extensions={"jpg", "dng"}):
+        shutil.copy2(file, destination / file.name)
+        count += 1
+    return count
+
+
+# --- timing
+
+def time_duplicates_finder_stages(library: Path, compare: str, jobs: int) -> dict:
+    """
+    Runs the stages of imageDuplicatesFinder one after the other, like `get_file_hashmap` and
+    `find_duplicates` do, without a cache.
+
+    Returns:
+        dict: stage -> seconds
+    """
+    import imageDuplicatesFinder as finder
+    from fileIndex import FileIndex
+
+    timings = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        finder.args = finder.parse_args(["--path", str(library), "--recursive", "-ext", "jpg", "dng",
+                                         "--compare", compare, "-j", str(jobs)])
+        finder.cache = None
+
+        start = time.perf_counter()
+        entries = list(fileWalker.walk(library, extensions=finder.args.extensions, stat=True))
+        timings["walk"] = time.perf_counter() - start
+
+        index = FileIndex()
+        infos = {} if compare == "pixels" else None
+        with finder.HashPool(jobs) as pool:
+            start = time.perf_counter()
+            content_groups = finder.get_content_groups(iter(entries), index, pool, finder.args.hash, infos)
+            timings["content"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if compare == "pixels":
+                hash_map = finder.get_pixel_groups(content_groups, index, pool, infos=infos)
+            else:
+                hash_map = dict(content_groups)
+            groups = sorted(hash_map.items(), key=lambda item: min(item[1]))
+            index.set_groups((key, sorted(files)) for key, files in groups)
+            timings["pixels"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tags_by_path = finder.prefetch_exif_tags(finder.get_duplicate_paths(index))
+        timings["exif"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        finder.determine_winners(index, tags_by_path)
+        timings["winners"] = time.perf_counter() - start
+    return timings
+
+
+def time_command(command: list[str], cwd: Path, stdin: str = "") -> float:
+    """
+    Returns:
+        float: Seconds the command ran. Its output is discarded.
+
+    Raises:
+        RuntimeError: If the command failed, with the end of its error output.
+    """
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=cwd, input=stdin, text=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        raise RuntimeError(f"exit code {result.returncode}: {lines[-1] if lines else ''}")
+    return elapsed
+
+
+def run_script(name: str, library: Path, args) -> dict:
+    """
+    Times one script once.
+
+    Returns:
+        dict: stage -> seconds; "total" is the run from the command line.
+    """
+    script = str(SCRIPT_DIRECTORY / f"{name}.py")
+    if name == "imageDuplicatesFinder":
+        timings = time_duplicates_finder_stages(library, args.compare, args.jobs)
+        timings["total"] = time_command([sys.executable, script, "--path", str(library), "--recursive",
+                                         "-ext", "jpg", "dng", "--compare", args.compare, "-j", str(args.jobs)],
+                                        SCRIPT_DIRECTORY)
+        return timings
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as temporary:
+        work = Path(temporary) / "flat"
+        start = time.perf_counter()
+        copy_flat(library, work)
+        copy_time = time.perf_counter() - start
+        stdin = "\n" if name == "movePicsIntoDirs_ExifMethod_NEW" else ""
+        command = [sys.executable, script, *SCRIPT_ARGUMENTS.get(name, [])]
+        return {"copy": copy_time, "total": time_command(command, work, stdin)}
+
+
+def get_commit() -> str | None:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIRECTORY,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=SCRIPT_DIRECTORY,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+
+
+def find_previous(results_file: Path, options: dict, settings: dict) -> dict | None:
+    """
+    Returns:
+        dict: The last record of `results_file` with the same library options and settings.
+    """
+    if not results_file.is_file():
+        return None
+    previous = None
+    with open(results_file, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("library") == options and record.get("settings") == settings:
+                previous = record
+    return previous
+
+
+def print_results(results: dict, previous: dict | None) -> None:
+    print()
+    print(f"{'script':36} {'stage':10} {'seconds':>10} {'previous':>10} {'change':>8}")
+    for name, timings in results.items():
+        if not isinstance(timings, dict):
+            print(f"{name:36} {timings}")
+            continue
+        old_timings = (previous or {}).get("results", {}).get(name, {})
+        for stage, seconds in timings.items():
+            old = old_timings.get(stage) if isinstance(old_timings, dict) else None
+            change = f"{(seconds - old) / old * 100:+7.1f}%" if old else ""
+            old_text = f"{old:10.3f}" if old is not None else ""
+            print(f"{name:36} {stage:10} {seconds:10.3f} {old_text:>10} {change:>8}")
+
+
+def main():
+    args = parse_args()
+
+    temporary = None
+    if args.library is None:
+        temporary = tempfile.TemporaryDirectory(prefix="benchmark_library_")
+        args.library = Path(temporary.name) / "library"
+    try:
+        try:
+            manifest = generate_library(args.library, args.files, args.size_kb, args.duplicates,
+                                        args.metadata_copies, args.exif, args.raw, args.depth,
+                                        args.per_directory, args.seed)
+        except ValueError as e:
+            print(f"[ERROR] {e}. Aborting.")
+            sys.exit(1)
+
+        has_exiftool = shutil.which("exiftool") is not None
+        results = {}
+        for name in args.scripts:
+            if name in EXIFTOOL_SCRIPTS and not has_exiftool:
+                print(f"[WARNING] exiftool not found, skipping {name}")
+                results[name] = "skipped: exiftool not found"
+                continue
+            print(f"[INFO] Timing {name} ({args.repeat} run{'s' if args.repeat > 1 else ''})")
+            try:
+                runs = [run_script(name, args.library, args) for _ in range(args.repeat)]
+            except RuntimeError as e:
+                print(f"[WARNING] {name} failed: {e}")
+                results[name] = f"failed: {e}"
+                continue
+            results[name] = {stage: min(run[stage] for run in runs) for stage in runs[0]}
+
+        settings = {"scripts": args.scripts, "compare": args.compare, "jobs": args.jobs}
+        previous = find_previous(args.results, manifest["options"], settings)
+        record = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "commit": get_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "library": manifest["options"],
+            "counts": manifest["counts"],
+            "settings": settings,
+            "repeat": args.repeat,
+            "results": results,
+        }
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+        print_results(results, previous)
+        print(f"\n[INFO] Results appended to {args.results.resolve()}"
+              + (f", compared with the run of {previous['time']} ({previous['commit']})" if previous else ""))
+    finally:
+        if temporary is not None:
+            temporary.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Description:
+Checks that a hash cache filled with one --hash algorithm gives the same duplicate groups when
+it is reused with another one.
+
+For every pair of algorithms, two copies of a file are hashed with the first algorithm into a
+new cache, a third copy is added and the directory is hashed again with the second algorithm on
+the same cache. All three copies must end up in one group, keyed by a hash of the second
+algorithm. Small files (compared by their sample hash) and large ones (sample and content hash)
+are checked. Files are compared by bytes, so nothing is decoded.
+
+Usage:
+    python checkHashCache.py
+        Exits with status 1 if any pair of algorithms differs.
+
+Requirements:
+* Python 3.9 or higher
+* Pillow library (`pip install pillow`, imported by imageDuplicatesFinder)
+"""
+
+import io
+import os
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from itertools import permutations
+from pathlib import Path
+
+import fileHash
+import imageDuplicatesFinder
+from hashCache import HashCache
+
+SIZES = [1000, 3 * imageDuplicatesFinder.SAMPLE_SIZE]
+
+
+def find_groups(directory: Path, cache_path: Path, algorithm: str) -> list[tuple[str, list[Path]]]:
+    imageDuplicatesFinder.cache = HashCache(cache_path)
+    try:
+        with redirect_stdout(io.StringIO()):  # the stage statistics
+            index = imageDuplicatesFinder.get_file_hashmap(directory, extensions={"jpg"}, compare="bytes",
+                                                           algorithm=algorithm)
+        return [(key, [index.path(file) for file in files]) for key, files in index.groups()]
+    finally:
+        imageDuplicatesFinder.cache.close()
+        imageDuplicatesFinder.cache = None
+
+
+def check(first: str, second: str, size: int) -> bool:
+    """
+    Returns:
+        bool: True if the rerun with `second` grouped all copies under a `second` hash.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        images = directory / "images"
+        images.mkdir()
+        content = os.urandom(size)
+        for name in ["a.jpg", "b.jpg"]:
+            (images / name).write_bytes(content)
+        find_groups(images, directory / "cache.sqlite", first)
+        (images / "c.jpg").write_bytes(content)
+        groups = find_groups(images, directory / "cache.sqlite", second)
+
+    algorithms = {fileHash.digest_algorithm(key.rpartition("sample:")[2]) for key, _ in groups}
+    if len(groups) != 1 or algorithms != {second}:
+        print(f"[ERROR] {first} then {second}, {size} bytes: "
+              f"{len(groups)} groups of {[len(paths) for _, paths in groups]} files, keys by {sorted(algorithms)}")
+        return False
+    return True
+
+
+def main():
+    failed = 0
+    for first, second in permutations(fileHash.ALGORITHMS, 2):
+        for size in SIZES:
+            failed += not check(first, second, size)
+    print(f"[INFO] {len(fileHash.ALGORITHMS)} algorithms, {failed} failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Description:
+Checks that the bulk winner selection of imageDuplicatesFinder (`determine_winners`, one fold
+over a `WinnerTable`) picks the same winners, and the same losers in the same order, as
+`determine_winner` run group by group.
+
+Randomized groups of empty files are generated in a temporary directory: mixed RAW and JPEG
+extensions, files without an EXIF date or with an invalid one, equal dates, equal modification
+times and equal tag scores, so every rule of `compare_candidates` and its ties are exercised.
+The tags are passed in like the prefetched tags of a real run, so exiftool isn't needed.
+
+Usage:
+    python checkWinners.py [--groups 2000] [--seed 1] [--runs 5]
+        Exits with status 1 if any group differs.
+
+Requirements:
+* Python 3.9 or higher
+* Pillow library (`pip install pillow`, imported by imageDuplicatesFinder)
+"""
+
+import os
+import sys
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+import imageDuplicatesFinder
+from fileIndex import FileIndex
+
+EXTENSIONS = ["jpg", "jpeg", "arw", "cr2", "dng"]
+BASE_MTIME_NS = 1_500_000_000 * 10**9
+# Few distinct values, so equal dates and modification times are common within a group
+DATES = ["2017:03:12 10:00:00", "2017:03:12 10:00:01", "2018:01:01 00:00:00", "2019:07:30 23:59:59"]
+INVALID_DATES = ["", "0000:00:00 00:00:00", "2017:13:45 99:99:99"]
+
+
+def random_tags(rng: random.Random) -> dict:
+    tags = {tag: "x" for tag in imageDuplicatesFinder.SCORE_TAGS if rng.random() < 0.4}
+    roll = rng.random()
+    if roll < 0.5:
+        tags["DateTimeOriginal"] = rng.choice(DATES)
+    elif roll < 0.65:
+        tags["DateTimeOriginal"] = rng.choice(INVALID_DATES)
+    return tags  # else: no date at all
+
+
+def build_groups(directory: Path, groups: int, rng: random.Random) -> tuple[FileIndex, dict]:
+    """
+    Creates the files of `groups` random groups of 1 to 8 files.
+
+    Returns:
+        tuple: The index with one group per generated group, and the tags by path.
+    """
+    index = FileIndex()
+    tags_by_path = {}
+    index_groups = []
+    for group in range(groups):
+        files = []
+        for number in range(rng.randint(1, 8)):
+            path = directory / f"g{group:05d}_{number}.{rng.choice(EXTENSIONS)}"
+            path.touch()
+            # Whole seconds or not, often the same for several files
+            mtime_ns = BASE_MTIME_NS + rng.randint(0, 3) * 10**9 + rng.choice([0, 0, 500_000_000, 123])
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+            files.append(index.add(path, path.stat()))
+            tags_by_path[path] = random_tags(rng)
+        index_groups.append((f"group:{group}", files))
+    index.set_groups(index_groups)
+    return index, tags_by_path
+
+
+def check(index: FileIndex, tags_by_path: dict) -> int:
+    """
+    Returns:
+        int: The number of groups where both paths disagree.
+    """
+    winners = imageDuplicatesFinder.determine_winners(index, tags_by_path)
+    mismatches = 0
+    for number, (key, files) in enumerate(index.groups()):
+        if len(files) < 2:
+            assert number not in winners, f"{key}: single file group has a winner"
+            continue
+        expected = imageDuplicatesFinder.determine_winner([index.path(file) for file in files], tags_by_path)
+        if winners.get(number) != expected:
+            mismatches += 1
+            print(f"[ERROR] {key}: bulk {winners.get(number)}, serial {expected}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the bulk and the serial winner selection.")
+    parser.add_argument("--groups", type=int, default=2000, help="Groups per run (default: 2000)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the first run (default: 1)")
+    parser.add_argument("--runs", type=int, default=5, help="Runs with consecutive seeds (default: 5)")
+    args = parser.parse_args()
+
+    failed = 0
+    for seed in range(args.seed, args.seed + args.runs):
+        with tempfile.TemporaryDirectory() as directory:
+            index, tags_by_path = build_groups(Path(directory), args.groups, random.Random(seed))
+            mismatches = check(index, tags_by_path)
+        print(f"[INFO] Seed {seed}: {index.group_count()} groups, {len(index)} files, {mismatches} mismatches")
+        failed += mismatches
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Description:
+Minimal in-process EXIF reader for JPEG and TIFF based RAW files (DNG, ARW, CR2, NEF, TIFF).
+
+Only the few tags the scripts need are read: DateTimeOriginal, Model, LensModel, FNumber and ISO.
+The file is memory mapped and only the JPEG markers, the TIFF header and the IFD entries are
+touched, which is usually just the first few KB of a file.
+Formats that aren't understood fall back to exiftool (see exiftoolPool), and so do files with
+an XMP packet that lack a wanted tag in their EXIF data, since exiftool reads it from the XMP.
+
+Tag names and value types match the output of `exiftool -j`, so results can be mixed.
+
+Usage:
+    python exifReader.py [FILE_OR_DIRECTORY ...] [--runs N]
+        Benchmarks the reader against one exiftool process per file.
+
+Requirements:
+* Python 3.6 or higher
+* exiftool (only for the fallback and the benchmark)
+"""
+
+import sys
+import mmap
+import json
+import time
+import struct
+import argparse
+import subprocess
+from pathlib import Path
+
+import exiftoolPool
+import fileWalker
+import metrics
+
+TAGS = ["DateTimeOriginal", "Model", "LensModel", "FNumber", "ISO"]
+
+# (IFD, tag id) -> tag name; IFD 0 is the first image directory, "exif" the Exif sub-IFD
+TAG_IDS = {
+    (0, 0x0110): "Model",
+    ("exif", 0x9003): "DateTimeOriginal",
+    ("exif", 0xA434): "LensModel",
+    ("exif", 0x829D): "FNumber",
+    ("exif", 0x8827): "ISO",
+}
+EXIF_IFD_POINTER = 0x8769
+XMP_TAG = 0x02BC
+XMP_SIGNATURE = b"http://ns.adobe.com/xap/1.0/\x00"
+
+# TIFF field type -> (struct format, size in bytes)
+TYPE_FORMATS = {
+    1: ("B", 1),   # BYTE
+    2: ("s", 1),   # ASCII
+    3: ("H", 2),   # SHORT
+    4: ("L", 4),   # LONG
+    5: ("LL", 8),  # RATIONAL
+    7: ("B", 1),   # UNDEFINED
+    9: ("l", 4),   # SLONG
+    10: ("ll", 8),  # SRATIONAL
+}
+
+
+class UnsupportedFormat(Exception):
+    """
+    Raised by the parser for files it can't read; `get_tags` then asks exiftool.
+    """
+
+
+def _jpeg_segments(data):
+    """
+    Yields (marker, offset of the segment data) of the segments of a JPEG before the image data.
+    """
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            raise UnsupportedFormat("broken JPEG marker")
+        marker = data[position + 1]
+        if marker == 0xFF:  # padding
+            position += 1
+            continue
+        if marker in (0xD9, 0xDA):  # end of image / start of scan
+            return
+        yield marker, position + 4
+        position += 2 + struct.unpack(">H", data[position + 2:position + 4])[0]
+
+
+def _find_tiff_header(data) -> int:
+    """
+    Returns the offset of the TIFF header: 0 for TIFF based files, behind "Exif\\0\\0" in the
+    APP1 segment of a JPEG, -1 for a JPEG without one.
+    """
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return 0
+    if data[:2] != b"\xff\xd8":
+        raise UnsupportedFormat("neither JPEG nor TIFF")
+    for marker, start in _jpeg_segments(data):
+        if marker == 0xE1 and data[start:start + 6] == b"Exif\x00\x00":
+            return start + 6
+    return -1
+
+
+def _has_xmp(data) -> bool:
+    """
+    Returns True if the file has an XMP packet (an APP1 segment of a JPEG, tag 700 in IFD0 of a
+    TIFF), where exiftool finds tags missing from the EXIF data.
+    """
+    if data[:2] == b"\xff\xd8":
+        return any(marker == 0xE1 and data[start:start + len(XMP_SIGNATURE)] == XMP_SIGNATURE
+                   for marker, start in _jpeg_segments(data))
+    byte_order = "<" if data[:2] == b"II" else ">"
+    start = struct.unpack(byte_order + "L", data[4:8])[0]
+    count = struct.unpack(byte_order + "H", data[start:start + 2])[0]
+    return any(struct.unpack(byte_order + "H", data[entry:entry + 2])[0] == XMP_TAG
+               for entry in range(start + 2, start + 2 + 12 * count, 12))
+
+
+def _read_value(data, byte_order: str, base: int, entry: int):
+    field_type, count = struct.unpack(byte_order + "HL", data[entry + 2:entry + 8])
+    if field_type not in TYPE_FORMATS:
+        return None
+    fmt, size = TYPE_FORMATS[field_type]
+    total = size * count
+    if total <= 4:
+        start = entry + 8
+    else:
+        start = base + struct.unpack(byte_order + "L", data[entry + 8:entry + 12])[0]
+    if start + total > len(data):
+        raise UnsupportedFormat("value outside of file")
+    raw = data[start:start + total]
+
+    if field_type == 2:
+        return raw.split(b"\x00", 1)[0].decode("latin-1").strip()
+    if field_type in (5, 10):
+        numerator, denominator = struct.unpack(byte_order + fmt, raw[:8])
+        return numerator / denominator if denominator else None
+    return struct.unpack(byte_order + fmt, raw[:size])[0]
+
+
+def _read_ifd(data, byte_order: str, base: int, offset: int, ifd, result: dict) -> int:
+    """
+    Reads the wanted tags of one IFD into `result`.
+
+    Returns:
+        int: Offset of the Exif sub-IFD, or 0 if there is none.
+    """
+    start = base + offset
+    if offset == 0 or start + 2 > len(data):
+        raise UnsupportedFormat("IFD outside of file")
+    count = struct.unpack(byte_order + "H", data[start:start + 2])[0]
+    if start + 2 + 12 * count > len(data):
+        raise UnsupportedFormat("IFD outside of file")
+
+    exif_offset = 0
+    for index in range(count):
+        entry = start + 2 + 12 * index
+        tag = struct.unpack(byte_order + "H", data[entry:entry + 2])[0]
+        if ifd == 0 and tag == EXIF_IFD_POINTER:
+            exif_offset = _read_value(data, byte_order, base, entry)
+        elif (ifd, tag) in TAG_IDS:
+            value = _read_value(data, byte_order, base, entry)
+            if value not in (None, ""):
+                result[TAG_IDS[(ifd, tag)]] = value
+    return exif_offset
+
+
+def parse_exif(data) -> dict:
+    """
+    Parses the wanted tags out of the bytes (or mmap) of a file.
+
+    Returns:
+        dict: Tag name -> value. Empty if the file has no EXIF data.
+
+    Raises:
+        UnsupportedFormat: If the file isn't a JPEG or TIFF, or its structure is broken.
+    """
+    base = _find_tiff_header(data)
+    if base < 0:
+        return {}
+    byte_order = {b"II": "<", b"MM": ">"}.get(bytes(data[base:base + 2]))
+    if byte_order is None or struct.unpack(byte_order + "H", data[base + 2:base + 4])[0] != 42:
+        raise UnsupportedFormat("broken TIFF header")
+
+    result = {}
+    ifd0_offset = struct.unpack(byte_order + "L", data[base + 4:base + 8])[0]
+    exif_offset = _read_ifd(data, byte_order, base, ifd0_offset, 0, result)
+    if exif_offset:
+        _read_ifd(data, byte_order, base, exif_offset, "exif", result)
+    return result
+
+
+def find_tag_value(data, ifd, tag_id: int) -> tuple[int, int, int] | None:
+    """
+    Locates the value of one tag of IFD 0 or the Exif sub-IFD, e.g. for patching it in place.
+
+    Returns:
+        tuple: (offset of the value in `data`, field type, count), or None if the file has no
+               EXIF data or the tag is missing.
+
+    Raises:
+        UnsupportedFormat: If the file isn't a JPEG or TIFF, or its structure is broken.
+    """
+    base = _find_tiff_header(data)
+    if base < 0:
+        return None
+    byte_order = {b"II": "<", b"MM": ">"}.get(bytes(data[base:base + 2]))
+    if byte_order is None or struct.unpack(byte_order + "H", data[base + 2:base + 4])[0] != 42:
+        raise UnsupportedFormat("broken TIFF header")
+
+    offset = struct.unpack(byte_order + "L", data[base + 4:base + 8])[0]
+    for current in (0, "exif"):
+        start = base + offset
+        if offset == 0 or start + 2 > len(data):
+            raise UnsupportedFormat("IFD outside of file")
+        count = struct.unpack(byte_order + "H", data[start:start + 2])[0]
+        if start + 2 + 12 * count > len(data):
+            raise UnsupportedFormat("IFD outside of file")
+        next_offset = 0
+        for index in range(count):
+            entry = start + 2 + 12 * index
+            tag = struct.unpack(byte_order + "H", data[entry:entry + 2])[0]
+            if current == ifd and tag == tag_id:
+                field_type, value_count = struct.unpack(byte_order + "HL", data[entry + 2:entry + 8])
+                size = TYPE_FORMATS.get(field_type, ("", 1))[1] * value_count
+                if size <= 4:
+                    return entry + 8, field_type, value_count
+                value_offset = base + struct.unpack(byte_order + "L", data[entry + 8:entry + 12])[0]
+                if value_offset + size > len(data):
+                    raise UnsupportedFormat("value outside of file")
+                return value_offset, field_type, value_count
+            if current == 0 and tag == EXIF_IFD_POINTER:
+                next_offset = _read_value(data, byte_order, base, entry)
+        if current == ifd or not next_offset:
+            return None
+        offset = next_offset
+    return None
+
+
+@metrics.timed("exif.read")
+def read_exif(filepath, tags: list[str] = TAGS) -> dict:
+    """
+    Reads the wanted tags of a file in-process.
+
+    Args:
+        filepath (str | Path): The file.
+        tags (list): The tags needed; if one of them is missing and the file has XMP, exiftool
+                     has to be asked.
+
+    Returns:
+        dict: Tag name -> value, or None if exiftool has to be asked: the format isn't supported,
+              the file can't be read, or a missing tag may be in its XMP.
+    """
+    try:
+        with open(filepath, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                result = parse_exif(data)
+                if any(tag not in result for tag in tags) and _has_xmp(data):
+                    return None
+                return result
+    except (UnsupportedFormat, OSError, ValueError, struct.error):
+        # OSError: exiftool reports it per file; ValueError: mmap of an empty file
+        return None
+
+
+def get_tags(filepath, tags: list[str] = TAGS) -> dict:
+    """
+    Returns the requested tags of a file, read in-process if possible, otherwise with exiftool.
+
+    Args:
+        filepath (str | Path): The file.
+        tags (list): Tag names. Tags outside of `TAGS` always need exiftool.
+
+    Returns:
+        dict: Tag name -> value for the tags found.
+
+    Raises:
+        ExifToolError: If the fallback to exiftool fails.
+    """
+    if set(tags) <= set(TAGS):
+        result = read_exif(filepath, tags)
+        if result is not None:
+            return {tag: result[tag] for tag in tags if tag in result}
+
+    data = json.loads(exiftoolPool.execute("-j", *[f"-{tag}" for tag in tags], str(filepath)))
+    entry = data[0] if data else {}
+    entry.pop("SourceFile", None)
+    return entry
+
+
+def get_tags_bulk(paths: list, tags: list[str] = TAGS) -> dict:
+    """
+    Same as `get_tags` for many files. Files the reader can't handle are read with bulk
+    exiftool requests (see exiftoolPool.read_tags).
+
+    Returns:
+        dict: path -> tags, keyed by the objects given in `paths`.
+    """
+    result = {}
+    fallback = []
+    native = set(tags) <= set(TAGS)
+    for path in paths:
+        found = read_exif(path, tags) if native else None
+        if found is None:
+            fallback.append(path)
+        else:
+            result[path] = {tag: found[tag] for tag in tags if tag in found}
+    if fallback:
+        result.update(exiftoolPool.read_tags(fallback, tags))
+    return result
+
+
+def benchmark(paths: list[Path], runs: int) -> None:
+    """
+    Prints the time per file of `read_exif` and of one `exiftool` process per file.
+    """
+    start = time.perf_counter()
+    for _ in range(runs):
+        for path in paths:
+            read_exif(path)
+    native = (time.perf_counter() - start) / (runs * len(paths))
+    print(f"[INFO] exifReader: {native * 1e6:10.1f} µs per file")
+
+    try:
+        start = time.perf_counter()
+        for path in paths:
+            subprocess.run(["exiftool", "-j", *[f"-{tag}" for tag in TAGS], str(path)],
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+        forked = (time.perf_counter() - start) / len(paths)
+    except FileNotFoundError:
+        print("[WARNING] exiftool not found, skipping the comparison")
+        return
+    print(f"[INFO] exiftool:   {forked * 1e6:10.1f} µs per file")
+    print(f"[INFO] Speedup:    {forked / native:10.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Read DateTimeOriginal, Model, LensModel, FNumber and ISO and benchmark the reader.")
+    parser.add_argument("paths", nargs="*", type=Path, default=[Path.cwd()],
+                        help="Files or directories (searched recursively)")
+    parser.add_argument("--runs", type=int, default=10,
+                        help="Repetitions of the in-process reader (default: 10)")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        if path.is_dir():
+            files.extend(sorted(fileWalker.get_files(path)))
+        else:
+            files.append(path)
+    if not files:
+        print("[ERROR] No files found. Aborting.")
+        sys.exit(1)
+
+    for file in files:
+        tags = read_exif(file)
+        print(f"{file}: {tags if tags is not None else 'unsupported, exiftool needed'}")
+    print()
+    benchmark(files, args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Description:
+Writes EXIF DateTimeOriginal, in place where possible.
+
+exiftool rewrites every file in full (a temporary copy, then a rename) to change the 19
+characters of a date. When the file already has a DateTimeOriginal in its Exif sub-IFD with the
+standard layout (ASCII, 20 bytes including the NUL), the new value has exactly the same size, so
+it is written over the old one at its offset with a single `pwrite` and an `fsync`.
+The offset is found by the in-process parser of exifReader. Afterwards the tag is read back; if
+it doesn't match, the old bytes are restored.
+
+Everything else goes to exiftool (see exiftoolPool.write_tags): files without the tag, other
+layouts, and formats exifReader doesn't understand. The file modification date is kept in both
+cases, like `exiftool -P`.
+
+The file is changed in place, so other hard links to it see the new date as well, while exiftool
+would have replaced only the one name.
+
+Usage:
+    import exifWriter
+    errors = exifWriter.write_date_time_original({path: "2011:04:24 16:45:00"})
+
+Requirements:
+* Python 3.6 or higher
+* exiftool (only for the fallback)
+"""
+
+import os
+import re
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+
+import exifReader
+import exiftoolPool
+import metrics
+
+DATE_TIME_ORIGINAL = 0x9003
+DATE_SIZE = 20  # "YYYY:MM:DD HH:MM:SS" and the NUL
+DATE_REGEX = re.compile(r"\d{4}:\d{2}:\d{2} \d{2}:\d{2}:\d{2}")
+DEFAULT_JOBS = 8  # the patches mostly wait for fsync
+
+
+def _pread(fd: int, size: int, offset: int) -> bytes:
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)  # Windows
+    return os.read(fd, size)
+
+
+def _pwrite(fd: int, data: bytes, offset: int) -> None:
+    if hasattr(os, "pwrite"):
+        written = os.pwrite(fd, data, offset)
+    else:  # Windows
+        os.lseek(fd, offset, os.SEEK_SET)
+        written = os.write(fd, data)
+    if written != len(data):
+        raise OSError(f"short write: {written} of {len(data)} bytes")
+
+
+def _locate(fd: int) -> int | None:
+    """
+    Returns:
+        int: The offset of a DateTimeOriginal that can be patched, or None.
+    """
+    try:
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as data:
+            location = exifReader.find_tag_value(data, "exif", DATE_TIME_ORIGINAL)
+            if location is None:
+                return None
+            offset, field_type, count = location
+            if field_type != 2 or count != DATE_SIZE or data[offset + DATE_SIZE - 1] != 0:
+                return None
+            return offset
+    except (exifReader.UnsupportedFormat, ValueError, IndexError):
+        # ValueError: empty file, it can't be mapped
+        return None
+
+
+def _read_back(fd: int) -> str | None:
+    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as data:
+        try:
+            return exifReader.parse_exif(data).get("DateTimeOriginal")
+        except exifReader.UnsupportedFormat:
+            return None
+
+
+@metrics.timed("exif.patch")
+def patch_date_time_original(filepath, value: str) -> bool:
+    """
+    Writes `value` over the existing DateTimeOriginal of the file, see the module description.
+
+    Returns:
+        bool: True if the file has the new date; False if it can't be patched in place and was
+              left unchanged.
+
+    Raises:
+        OSError: If the file can't be opened or written.
+    """
+    if not DATE_REGEX.fullmatch(value):
+        return False
+    new = value.encode("ascii") + b"\x00"
+
+    fd = os.open(filepath, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        stat_result = os.fstat(fd)
+        offset = _locate(fd)
+        if offset is None:
+            return False
+        old = _pread(fd, DATE_SIZE, offset)
+        if old == new:
+            return True
+        try:
+            _pwrite(fd, new, offset)
+            os.fsync(fd)
+            if _read_back(fd) != value:
+                _pwrite(fd, old, offset)
+                os.fsync(fd)
+                return False
+        finally:
+            os.utime(filepath, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns))
+    finally:
+        os.close(fd)
+    return True
+
+
+def write_date_time_original(dates: dict, jobs: int = DEFAULT_JOBS) -> dict:
+    """
+    Sets DateTimeOriginal of many files: patched in place where possible, the rest with a few
+    bulk exiftool requests.
+
+    Args:
+        dates (dict): path -> new value like "2011:04:24 16:45:00", paths as str or Path.
+        jobs (int): Number of files patched in parallel.
+
+    Returns:
+        dict: path -> None if the file was written, else the error message; keyed by the objects
+              given in `dates`, in the same order.
+    """
+    def patch(item: tuple):
+        filepath, value = item
+        try:
+            return patch_date_time_original(filepath, value)
+        except OSError as e:
+            return str(e)
+
+    results = {}
+    fallback = {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for (filepath, value), patched in zip(dates.items(), executor.map(patch, dates.items())):
+            if patched is True:
+                results[filepath] = None
+            elif patched is False:
+                fallback[filepath] = {"DateTimeOriginal": value}
+            else:
+                results[filepath] = patched
+    metrics.count("exif.patched", len(results) - sum(error is not None for error in results.values()))
+    metrics.count("exif.patch_fallback", len(fallback))
+
+    results.update(exiftoolPool.write_tags(fallback))
+    return {filepath: results[filepath] for filepath in dates}
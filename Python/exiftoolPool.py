@@ -0,0 +1,341 @@
+"""
+Description:
+Pool of long-lived exiftool processes (`exiftool -stay_open True -@ -`).
+
+Starting exiftool costs about 150 ms per call, most of it Perl startup.
+The workers of this pool are started once and then receive one request after another on stdin.
+A request is the list of command line arguments followed by `-execute<N>`;
+exiftool answers with the normal output followed by `{ready<N>}`.
+`-echo4` writes the same marker to stderr, so both streams can be read to the end of a request.
+
+Usage:
+    import exiftoolPool
+    output = exiftoolPool.execute("-s", "-s", "-s", "-DateTimeOriginal", "image.jpg")
+    tags = exiftoolPool.read_tags(paths, ["DateTimeOriginal", "Model"])
+    errors = exiftoolPool.write_tags({path: {"DateTimeOriginal": "2011:04:24 16:45:00"}})
+
+A worker that dies is restarted and the request is sent once more.
+All workers are stopped when the interpreter exits.
+
+Requirements:
+* exiftool (must be in PATH)
+"""
+
+import os
+import json
+import queue
+import atexit
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+EXIFTOOL = "exiftool"
+SHUTDOWN_TIMEOUT = 5  # seconds to wait for a worker to exit before killing it
+BULK_CHUNK_SIZE = 500  # files per request in read_tags
+WRITE_CHUNK_SIZE = 100  # files per request in write_tags; writing takes much longer than reading
+WRITE_OPTIONS = ("-P", "-overwrite_original")  # keep the file modification date, no *_original backups
+
+
+class ExifToolError(Exception):
+    """
+    Raised when exiftool reports an error for a request.
+    The `stderr` attribute holds what exiftool wrote to stderr, like CalledProcessError.stderr.
+    """
+
+    def __init__(self, message: str, stdout: str = "", stderr: str = ""):
+        super().__init__(message)
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class ExifToolWorker:
+    """
+    One `exiftool -stay_open` process.
+    Not thread-safe, the pool hands every worker to one thread at a time.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.stderr_lines = None
+        self.request_number = 0
+        self.start()
+
+    def start(self) -> None:
+        """
+        Raises:
+            ExifToolError: If exiftool can't be started, e.g. because it isn't in PATH.
+        """
+        try:
+            self.process = subprocess.Popen(
+                [EXIFTOOL, "-stay_open", "True", "-@", "-",
+                 "-common_args", "-charset", "filename=utf8"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                encoding="utf-8",
+                errors="replace"
+            )
+        except OSError as e:
+            self.process = None
+            raise ExifToolError(f"can't start exiftool: {e}", stderr=f"can't start exiftool: {e}") from e
+        # stderr is drained by a thread, so a chatty request can't block on a full pipe
+        self.stderr_lines = queue.Queue()
+        threading.Thread(target=self._drain_stderr, args=(self.process.stderr, self.stderr_lines),
+                         daemon=True).start()
+
+    @staticmethod
+    def _drain_stderr(stream, lines: queue.Queue) -> None:
+        for line in stream:
+            lines.put(line)
+        lines.put(None)
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def execute(self, *args: str) -> tuple[str, str]:
+        """
+        Runs one request.
+
+        Returns:
+            tuple: (stdout, stderr) of the request.
+
+        Raises:
+            BrokenPipeError: If the process died before or during the request.
+        """
+        if not self.is_alive():
+            raise BrokenPipeError("exiftool isn't running")
+        self.request_number += 1
+        marker = f"{{ready{self.request_number}}}"
+        request = "\n".join(str(arg) for arg in args)
+        self.process.stdin.write(f"{request}\n-echo4\n{marker}\n-execute{self.request_number}\n")
+        self.process.stdin.flush()
+
+        stdout = []
+        for line in self.process.stdout:
+            if line.rstrip("\r\n") == marker:
+                break
+            stdout.append(line)
+        else:
+            raise BrokenPipeError("exiftool exited during a request")
+
+        stderr = []
+        while True:
+            line = self.stderr_lines.get()
+            if line is None:
+                raise BrokenPipeError("exiftool exited during a request")
+            if line.rstrip("\r\n") == marker:
+                break
+            stderr.append(line)
+
+        return "".join(stdout), "".join(stderr)
+
+    def stop(self) -> None:
+        if not self.is_alive():
+            return
+        try:
+            self.process.stdin.write("-stay_open\nFalse\n")
+            self.process.stdin.flush()
+            self.process.wait(timeout=SHUTDOWN_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+class ExifToolPool:
+    """
+    Up to `size` exiftool workers, started on demand and shared between threads.
+    """
+
+    def __init__(self, size: int = None):
+        self.size = size or os.cpu_count() or 1
+        self.idle = queue.LifoQueue()
+        self.workers = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def _acquire(self) -> ExifToolWorker:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("exiftool pool is shut down")
+            if len(self.workers) < self.size:
+                worker = ExifToolWorker()
+                self.workers.append(worker)
+                return worker
+        return self.idle.get()
+
+    @metrics.timed("exiftool.request")
+    def execute(self, *args: str) -> str:
+        """
+        Runs exiftool with the given arguments on an idle worker and returns its stdout.
+
+        Raises:
+            ExifToolError: If exiftool printed an error, the worker died twice in a row, or
+                           exiftool can't be started.
+        """
+        worker = self._acquire()
+        try:
+            try:
+                stdout, stderr = worker.execute(*args)
+            except (BrokenPipeError, OSError):
+                # The worker crashed; start a fresh one and try once more
+                worker.stop()
+                worker.start()
+                try:
+                    stdout, stderr = worker.execute(*args)
+                except (BrokenPipeError, OSError) as e:
+                    worker.stop()
+                    worker.start()
+                    raise ExifToolError(f"exiftool worker failed: {e}", stderr=str(e))
+        finally:
+            self.idle.put(worker)
+
+        if any(line.startswith("Error") for line in stderr.splitlines()):
+            raise ExifToolError(stderr.strip(), stdout=stdout, stderr=stderr)
+        return stdout
+
+    def shutdown(self) -> None:
+        with self.lock:
+            self.closed = True
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ExifToolPool:
+    """
+    Returns the pool shared by all scripts of this process, creating it on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExifToolPool()
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def execute(*args: str) -> str:
+    """
+    Shortcut for `get_pool().execute(*args)`.
+    """
+    return get_pool().execute(*args)
+
+
+def read_tags(paths: list, tags: list[str] = None, chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+    """
+    Reads the given tags of many files with a few `exiftool -j` requests instead of one per file.
+
+    The files are split into chunks which run in parallel on the workers of the shared pool.
+    Arguments are passed on stdin, so the chunk size isn't limited by the command line length;
+    it only bounds the size of a single JSON answer.
+
+    Args:
+        paths (list): Files to read (str or Path).
+        tags (list): Tag names, e.g. ["DateTimeOriginal"]. None reads all tags.
+        chunk_size (int): Maximum number of files per request.
+
+    Returns:
+        dict: path -> {tag: value}, keyed by the objects given in `paths`.
+              Files exiftool couldn't read are missing, all of them if it can't be started.
+    """
+    if not paths:
+        return {}
+
+    metrics.count("exiftool.files", len(paths))
+    pool = get_pool()
+    by_name = {os.path.normpath(str(path)): path for path in paths}
+    names = list(by_name)
+    tag_args = [f"-{tag}" for tag in tags] if tags else []
+    # Small lists are still spread over all workers
+    chunk_size = max(1, min(chunk_size, -(-len(names) // pool.size)))
+    chunks = [names[i:i + chunk_size] for i in range(0, len(names), chunk_size)]
+
+    def read_chunk(chunk: list[str]) -> list[dict]:
+        try:
+            output = pool.execute("-j", *tag_args, *chunk)
+        except ExifToolError as e:
+            # Errors of single files (e.g. not found) must not lose the rest of the chunk
+            output = e.stdout
+            if not output.strip():
+                print(f"[WARNING] exiftool couldn't read {len(chunk)} files: {e}")
+        return json.loads(output) if output.strip() else []
+
+    result = {}
+    with ThreadPoolExecutor(max_workers=min(pool.size, len(chunks))) as executor:
+        for entries in executor.map(read_chunk, chunks):
+            for entry in entries:
+                name = os.path.normpath(entry.pop("SourceFile", ""))
+                if name in by_name:
+                    result[by_name[name]] = entry
+    return result
+
+
+def write_tags(assignments: dict, options: list[str] = WRITE_OPTIONS,
+               chunk_size: int = WRITE_CHUNK_SIZE) -> dict:
+    """
+    Writes tags to many files with a few exiftool requests instead of one process per file.
+
+    Files that get the same values are written by one request (`exiftool -TAG=VALUE ... FILE
+    FILE ...`); the requests run in parallel on the workers of the shared pool.
+    exiftool reports failures of single files as "Error: <message> - <file>" and goes on with the
+    other files, so the result is known per file.
+
+    Args:
+        assignments (dict): path -> {tag: value}, paths as str or Path.
+        options (list): Further exiftool options of every request.
+        chunk_size (int): Maximum number of files per request.
+
+    Returns:
+        dict: path -> None if the file was written, else the error message; keyed by the objects
+              given in `assignments`.
+    """
+    if not assignments:
+        return {}
+
+    pool = get_pool()
+    by_values = {}
+    for path, tags in assignments.items():
+        key = tuple(f"-{tag}={value}" for tag, value in tags.items())
+        by_values.setdefault(key, []).append(path)
+    chunks = []
+    for tag_args, paths in by_values.items():
+        # Small groups are still spread over all workers
+        size = max(1, min(chunk_size, -(-len(paths) // pool.size)))
+        chunks.extend((tag_args, paths[i:i + size]) for i in range(0, len(paths), size))
+    metrics.count("exiftool.files_written", len(assignments))
+
+    def write_chunk(chunk: tuple) -> dict:
+        tag_args, paths = chunk
+        names = {os.path.normpath(str(path)): path for path in paths}
+        try:
+            pool.execute(*options, *tag_args, *names)
+            return dict.fromkeys(paths)
+        except ExifToolError as e:
+            stderr = e.stderr
+        results = dict.fromkeys(paths)
+        errors = [line for line in stderr.splitlines() if line.startswith("Error")]
+        for line in errors:
+            message, _, name = line.rpartition(" - ")
+            if name in names:
+                results[names[name]] = message.removeprefix("Error: ")
+        if not any(results.values()):
+            # An error that doesn't name a file, e.g. an invalid tag or exiftool couldn't be
+            # started; nothing was written
+            for path in paths:
+                results[path] = stderr.strip() or "exiftool failed"
+        return results
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(pool.size, len(chunks))) as executor:
+        for chunk_results in executor.map(write_chunk, chunks):
+            results.update(chunk_results)
+    return results
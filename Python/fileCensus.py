@@ -0,0 +1,238 @@
+"""
+Description:
+Persistent, incremental census of a directory tree: number of files and bytes per extension
+and directory, backed by SQLite.
+
+Adding, removing or renaming an entry changes the modification time of its directory. The
+census stores the mtime of every directory together with its counts and the names of its
+subdirectories; on the next run a directory whose mtime is unchanged is neither listed nor are
+its files stat'ed, only the directory itself is. Directories are stat'ed and listed on a thread
+pool, like in fileWalker.
+
+Every run records what changed (files and bytes per directory and extension, negative for
+files that are gone), so `changes(since)` reports what arrived since an earlier run.
+
+A file rewritten in place doesn't change the mtime of its directory, so its new size is only
+counted once something else in the directory changes; `rebuild=True` lists every directory.
+
+Usage:
+    census = FileCensus(Path("census.sqlite"))
+    totals = census.update(Path("/archive"), recursive=True)
+    delta = census.changes(since=census.last_run)
+    census.close()
+
+Requirements:
+* Python 3.9 or higher (sqlite3 is part of the standard library)
+"""
+
+import os
+import json
+import time
+import sqlite3
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+DEFAULT_JOBS = 8  # threads stat'ing and listing directories; the work is waiting for I/O
+# A directory changed this shortly before it was listed may change again within the same mtime
+# tick (2 s on FAT); it isn't trusted and is listed again on the next run
+RACY_NS = 2_000_000_000
+
+
+def _scan_directory(directory: str, cached_mtime_ns: int | None, excluded: frozenset = frozenset()):
+    """
+    Stats one directory and lists it unless its mtime is `cached_mtime_ns`.
+    Files whose path is in `excluded` aren't counted.
+
+    Returns:
+        tuple: (mtime_ns, {extension: [files, bytes]} or None if unchanged,
+                [subdirectory name, ...] or None if unchanged), or None if it can't be read.
+    """
+    try:
+        mtime_ns = os.stat(directory).st_mtime_ns
+        if mtime_ns == cached_mtime_ns:
+            return mtime_ns, None, None
+        counts, subdirectories = {}, []
+        with metrics.timer("census.list"), os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.name)
+                    elif entry.is_file() and entry.path not in excluded:
+                        count = counts.setdefault(os.path.splitext(entry.name)[1][1:].lower(), [0, 0])
+                        count[0] += 1
+                        count[1] += entry.stat().st_size
+                except OSError as e:
+                    print(f"Error processing {entry.path}: {e}")
+        if time.time_ns() - mtime_ns < RACY_NS:
+            mtime_ns = 0
+        return mtime_ns, counts, subdirectories
+    except OSError as e:
+        print(f"[WARNING] Can't read directory {directory}: {e}")
+        return None
+
+
+def _below(root: str) -> tuple[str, str]:
+    """
+    Returns:
+        tuple: Bounds of the paths below `root`: "root/" <= path < "root0" ("0" follows "/" and "\\").
+    """
+    prefix = os.path.join(root, "")
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _add(totals: dict, counts: dict, sign: int = 1) -> None:
+    for extension, (files, size) in counts.items():
+        total = totals.setdefault(extension, [0, 0])
+        total[0] += sign * files
+        total[1] += sign * size
+
+
+class FileCensus:
+    """
+    Census of files per directory and extension, see the module description.
+    """
+
+    def __init__(self, db_path: Path, rebuild: bool = False):
+        self.db_path = Path(db_path)
+        self.connection = sqlite3.connect(str(self.db_path))
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS directories ("
+            " path TEXT PRIMARY KEY,"
+            " mtime_ns INTEGER NOT NULL,"
+            " counts TEXT NOT NULL,"  # JSON {extension: [files, bytes]} of the files directly in it
+            " subdirectories TEXT NOT NULL)"  # JSON list of names
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, time REAL NOT NULL, root TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS changes ("
+            " run INTEGER NOT NULL, directory TEXT NOT NULL, extension TEXT NOT NULL,"
+            " files INTEGER NOT NULL, bytes INTEGER NOT NULL)"
+        )
+        self.connection.commit()
+        # The database itself isn't counted if it lies in the scanned tree
+        self.excluded = frozenset(os.path.abspath(self.db_path) + suffix
+                                  for suffix in ("", "-wal", "-shm", "-journal"))
+        self.rebuild = rebuild  # list every directory, the stored counts are only used for the changes
+        self.last_run = None
+        self.scanned = 0
+        self.skipped = 0
+        self.removed = 0
+
+    def _cached(self, directory: str):
+        row = self.connection.execute(
+            "SELECT mtime_ns, counts, subdirectories FROM directories WHERE path = ?", (directory,)
+        ).fetchone()
+        return None if row is None else (row[0], json.loads(row[1]), json.loads(row[2]))
+
+    def _record(self, run: int, directory: str, old: dict, new: dict) -> None:
+        delta = {}
+        _add(delta, new)
+        _add(delta, old, -1)
+        self.connection.executemany(
+            "INSERT INTO changes (run, directory, extension, files, bytes) VALUES (?, ?, ?, ?, ?)",
+            [(run, directory, extension, files, size) for extension, (files, size) in delta.items()
+             if files or size]
+        )
+
+    def update(self, root: Path, recursive: bool = True, jobs: int = DEFAULT_JOBS) -> dict:
+        """
+        Brings the census of `root` up to date; unchanged directories are skipped.
+        Subdirectories that are gone are removed from the census (with `recursive`).
+
+        Returns:
+            dict: extension -> [files, bytes] of all files in `root` (and below with `recursive`).
+        """
+        root = os.path.abspath(root)
+        run = self.connection.execute(
+            "INSERT INTO runs (time, root) VALUES (?, ?)", (time.time(), root)
+        ).lastrowid
+        self.last_run = run
+        totals = {}
+        visited = set()
+
+        pool = ThreadPoolExecutor(max_workers=jobs)
+        try:
+            def submit(directory: str):
+                cached = self._cached(directory)
+                future = pool.submit(_scan_directory, directory,
+                                     cached[0] if cached and not self.rebuild else None, self.excluded)
+                return directory, cached, future
+
+            pending = [submit(root)]
+            while pending:
+                directory, cached, future = pending.pop()
+                result = future.result()
+                if result is None:
+                    continue
+                visited.add(directory)
+                mtime_ns, counts, subdirectories = result
+                if counts is None:
+                    self.skipped += 1
+                    counts, subdirectories = cached[1], cached[2]
+                else:
+                    self.scanned += 1
+                    self._record(run, directory, cached[1] if cached else {}, counts)
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO directories (path, mtime_ns, counts, subdirectories) "
+                        "VALUES (?, ?, ?, ?)",
+                        (directory, mtime_ns, json.dumps(counts), json.dumps(subdirectories))
+                    )
+                _add(totals, counts)
+                if recursive:
+                    pending.extend(submit(os.path.join(directory, name)) for name in reversed(subdirectories))
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        if recursive:
+            self._remove_missing(run, root, visited)
+        self.connection.commit()
+        metrics.count("census.scanned", self.scanned)
+        metrics.count("census.skipped", self.skipped)
+        return totals
+
+    def _remove_missing(self, run: int, root: str, visited: set) -> None:
+        below = self.connection.execute(
+            "SELECT path, counts FROM directories WHERE path >= ? AND path < ?", _below(root)
+        ).fetchall()
+        for path, counts in below:
+            if path not in visited:
+                self._record(run, path, json.loads(counts), {})
+                self.connection.execute("DELETE FROM directories WHERE path = ?", (path,))
+                self.removed += 1
+
+    def changes(self, since=None, root: Path = None) -> dict:
+        """
+        Sums up what changed.
+
+        Args:
+            since: A run id (e.g. `last_run`) for the changes of that run and later ones, or a
+                   `datetime` for the runs since then. None for all runs.
+            root (Path): Only directories in and below `root`.
+
+        Returns:
+            dict: extension -> [files, bytes], negative for files that are gone.
+        """
+        query = "SELECT extension, SUM(files), SUM(bytes) FROM changes JOIN runs ON runs.id = changes.run WHERE 1"
+        parameters = []
+        if isinstance(since, int):
+            query += " AND runs.id >= ?"
+            parameters.append(since)
+        elif since is not None:
+            query += " AND runs.time >= ?"
+            parameters.append(since.timestamp())
+        if root is not None:
+            root = os.path.abspath(root)
+            query += " AND (directory = ? OR (directory >= ? AND directory < ?))"
+            parameters += [root, *_below(root)]
+        rows = self.connection.execute(query + " GROUP BY extension", parameters).fetchall()
+        return {extension: [files, size] for extension, files, size in rows if files or size}
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,183 @@
+"""
+Description:
+Streaming file hashing with a choice of hash algorithms.
+
+Files are read in BUFFER_SIZE blocks into one reusable bytearray (`readinto`), so hashing a
+100 MB RAW file needs 1 MB of memory instead of 100 MB. Files of at least MMAP_THRESHOLD bytes
+are memory mapped and handed to the hasher as a whole, which saves the copy into the buffer.
+
+Algorithms:
+* sha256  - cryptographic, the default and what older caches contain
+* blake2b - cryptographic as well; faster than SHA256 on CPUs without SHA extensions,
+            slower on those with them (run the benchmark)
+* xxh3    - non-cryptographic and the fastest, only if the `xxhash` package is installed;
+            fine to find duplicates, where nobody crafts collisions on purpose
+
+Digests of other algorithms than sha256 are prefixed with the algorithm name ("blake2b:..."),
+so values of different algorithms never compare equal.
+
+Usage:
+    python fileHash.py [FILE_OR_DIRECTORY ...]
+        Benchmarks the throughput of the old whole-file read against the streaming and
+        mmap variants for all available algorithms.
+
+Requirements:
+* Python 3.6 or higher
+* Optional: xxhash (`pip install xxhash`)
+"""
+
+import os
+import sys
+import mmap
+import time
+import hashlib
+import argparse
+from pathlib import Path
+
+import fileWalker
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+BUFFER_SIZE = 1024 * 1024  # bytes per readinto()
+MMAP_THRESHOLD = 64 * 1024 * 1024  # files at least this large are memory mapped
+
+ALGORITHMS = ["sha256", "blake2b"] + (["xxh3"] if xxhash is not None else [])
+PREFIXED_ALGORITHMS = ("blake2b", "xxh3")  # all algorithms `digest` prefixes, available or not
+
+
+def new_hasher(algorithm: str = "sha256"):
+    """
+    Returns a new hash object with the hashlib interface (update, hexdigest).
+    """
+    if algorithm == "sha256":
+        return hashlib.sha256()
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=32)
+    if algorithm == "xxh3":
+        if xxhash is None:
+            raise ValueError("xxh3 needs the xxhash package (`pip install xxhash`)")
+        return xxhash.xxh3_128()
+    raise ValueError(f"Unknown hash algorithm: {algorithm}")
+
+
+def digest(hasher, algorithm: str = "sha256") -> str:
+    """
+    Returns the hex digest, prefixed with the algorithm unless it is sha256.
+    """
+    if algorithm == "sha256":
+        return hasher.hexdigest()
+    return f"{algorithm}:{hasher.hexdigest()}"
+
+
+def digest_algorithm(value: str) -> str:
+    """
+    Returns the algorithm of a value returned by `digest`, also behind a prefix like "raw:".
+    """
+    prefix = value.rpartition(":")[0].rpartition(":")[2]
+    return prefix if prefix in PREFIXED_ALGORITHMS else "sha256"
+
+
+def update_from_file(hasher, f, size: int = None) -> None:
+    """
+    Feeds the rest of the open binary file `f` into `hasher`, block by block.
+    `size` (the file size) enables memory mapping for large files.
+    """
+    if size is not None and size >= MMAP_THRESHOLD and f.tell() == 0:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            hasher.update(data)
+        return
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    while True:
+        length = f.readinto(buffer)
+        if not length:
+            break
+        hasher.update(view[:length])
+
+
+def hash_file(filepath, algorithm: str = "sha256") -> str:
+    """
+    Hashes the whole content of a file without loading it into memory.
+
+    Args:
+        filepath (Path): The path to the file.
+        algorithm (str): One of ALGORITHMS.
+
+    Returns:
+        str: The digest, see `digest`.
+    """
+    hasher = new_hasher(algorithm)
+    with open(filepath, "rb") as f:
+        update_from_file(hasher, f, os.fstat(f.fileno()).st_size)
+    return digest(hasher, algorithm)
+
+
+def _hash_file_read_all(filepath, algorithm: str) -> str:
+    # The original implementation, kept for the benchmark
+    hasher = new_hasher(algorithm)
+    with open(filepath, "rb") as f:
+        hasher.update(f.read())
+    return digest(hasher, algorithm)
+
+
+def _hash_file_stream(filepath, algorithm: str) -> str:
+    hasher = new_hasher(algorithm)
+    with open(filepath, "rb") as f:
+        update_from_file(hasher, f)
+    return digest(hasher, algorithm)
+
+
+def _hash_file_mmap(filepath, algorithm: str) -> str:
+    hasher = new_hasher(algorithm)
+    with open(filepath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest(hasher, algorithm)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            hasher.update(data)
+    return digest(hasher, algorithm)
+
+
+def benchmark(files: list[Path]) -> None:
+    """
+    Prints MB/s of every read method and algorithm over `files`.
+    The first pass warms the page cache, so all methods read from memory and only
+    CPU and copying are compared; on a cold network share I/O dominates all of them.
+    """
+    total = sum(f.stat().st_size for f in files)
+    print(f"[INFO] {len(files)} files, {total / 1e6:.1f} MB")
+    for file in files:
+        _hash_file_stream(file, "sha256")
+
+    methods = [("read()", _hash_file_read_all), ("readinto", _hash_file_stream), ("mmap", _hash_file_mmap)]
+    for algorithm in ALGORITHMS:
+        for name, method in methods:
+            start = time.perf_counter()
+            for file in files:
+                method(file, algorithm)
+            elapsed = time.perf_counter() - start
+            print(f"{algorithm:8} {name:9} {total / 1e6 / elapsed:10.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark file hashing throughput.")
+    parser.add_argument("paths", nargs="*", type=Path, default=[Path.cwd()],
+                        help="Files or directories (searched recursively)")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        if path.is_dir():
+            files.extend(sorted(fileWalker.get_files(path)))
+        else:
+            files.append(path)
+    if not files:
+        print("[ERROR] No files found. Aborting.")
+        sys.exit(1)
+    benchmark(files)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Description:
+Compact in-memory index of the files found by a scan and of their groups of duplicates.
+
+A `pathlib.Path` plus an `os.stat_result` per file, in dicts keyed by the path, and a dict of
+lists keyed by 64 character hex strings take well over a kilobyte per file. Here a file is an
+integer id into flat columns instead:
+* directories are interned, a file stores the id of its directory and its name,
+* size, mtime and inode are stored in `array` columns,
+* groups are stored as ranges of one array of file ids, and their keys as 32 byte digests with
+  an interned prefix ("raw:", "sample:", ...), or just the file size for "size:N" keys.
+`Path` and `FileStat` objects are only created on demand, as views of one row.
+
+Requirements:
+* Python 3.6 or higher
+"""
+
+import os
+from array import array
+from pathlib import Path
+
+DIGEST_SIZE = 32  # bytes per group key; sha256, blake2b and xxh3 digests fit
+
+
+class FileStat:
+    """
+    The fields of `os.stat_result` the scripts use, for one file of a `FileIndex`.
+    Accepted wherever a stat result is expected, e.g. by `HashCache`.
+    """
+
+    __slots__ = ("st_size", "st_mtime", "st_mtime_ns", "st_ino")
+
+    def __init__(self, st_size: int, st_mtime: float, st_mtime_ns: int, st_ino: int):
+        self.st_size = st_size
+        self.st_mtime = st_mtime
+        self.st_mtime_ns = st_mtime_ns
+        self.st_ino = st_ino
+
+
+class FileIndex:
+    """
+    Files and groups of files, see the module description.
+
+    Usage:
+        index = FileIndex()
+        file_id = index.add(path, path.stat())
+        index.set_groups([("size:123", [file_id])])
+        for key, file_ids in index.groups():
+            paths = [index.path(i) for i in file_ids]
+    """
+
+    __slots__ = ("directories", "directory_ids", "directory", "names", "size", "mtime", "mtime_ns",
+                 "inode", "group_starts", "group_files", "group_prefixes", "group_digests",
+                 "other_keys", "prefixes", "prefix_ids")
+
+    def __init__(self):
+        self.directories = []  # directory id -> directory
+        self.directory_ids = {}  # directory -> directory id
+        self.directory = array("I")
+        self.names = []
+        self.size = array("q")
+        self.mtime = array("d")  # st_mtime exactly as stat() returns it, for comparisons
+        self.mtime_ns = array("q")
+        self.inode = array("Q")
+
+        self.group_starts = array("I", [0])  # group i holds group_files[starts[i]:starts[i + 1]]
+        self.group_files = array("I")
+        self.group_prefixes = array("H")  # prefix id per group
+        self.group_digests = bytearray()  # DIGEST_SIZE bytes per group
+        self.other_keys = {}  # group -> key that can't be packed
+        self.prefixes = []  # prefix id -> (prefix, form)
+        self.prefix_ids = {}
+
+    # --- files
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, path, stat_result) -> int:
+        """
+        Returns:
+            int: The id of the new file; ids count up from 0 in the order files are added.
+        """
+        directory, name = os.path.split(os.fspath(path))
+        directory_id = self.directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = self.directory_ids[directory] = len(self.directories)
+            self.directories.append(directory)
+        self.directory.append(directory_id)
+        self.names.append(name)
+        self.size.append(stat_result.st_size)
+        self.mtime.append(stat_result.st_mtime)
+        self.mtime_ns.append(stat_result.st_mtime_ns)
+        self.inode.append(stat_result.st_ino)
+        return len(self.names) - 1
+
+    def path(self, file_id: int) -> Path:
+        return Path(self.directories[self.directory[file_id]], self.names[file_id])
+
+    def extension(self, file_id: int) -> str:
+        """
+        Returns:
+            str: The lower case extension without the dot, like `Path.suffix[1:].lower()`.
+        """
+        return Path(self.names[file_id]).suffix[1:].lower()
+
+    def stat(self, file_id: int) -> FileStat:
+        return FileStat(self.size[file_id], self.mtime[file_id], self.mtime_ns[file_id], self.inode[file_id])
+
+    # --- groups
+
+    def _pack_key(self, key: str) -> tuple[int, bytes]:
+        prefix, _, rest = key.rpartition(":")
+        prefix += ":" if prefix else ""
+        if rest.isdigit() and str(int(rest)) == rest and int(rest) < 1 << (8 * DIGEST_SIZE):
+            form, digest = "int", int(rest).to_bytes(DIGEST_SIZE, "big")
+        else:
+            try:
+                digest = bytes.fromhex(rest)
+            except ValueError:
+                return None, None
+            if digest.hex() != rest or len(digest) > DIGEST_SIZE:
+                return None, None
+            form = len(digest)
+            digest = digest.ljust(DIGEST_SIZE, b"\0")
+        prefix_id = self.prefix_ids.get((prefix, form))
+        if prefix_id is None:
+            prefix_id = self.prefix_ids[(prefix, form)] = len(self.prefixes)
+            self.prefixes.append((prefix, form))
+        return prefix_id, digest
+
+    def _unpack_key(self, group: int) -> str:
+        if group in self.other_keys:
+            return self.other_keys[group]
+        prefix, form = self.prefixes[self.group_prefixes[group]]
+        digest = self.group_digests[group * DIGEST_SIZE:(group + 1) * DIGEST_SIZE]
+        if form == "int":
+            return f"{prefix}{int.from_bytes(digest, 'big')}"
+        return f"{prefix}{digest[:form].hex()}"
+
+    def set_groups(self, groups) -> None:
+        """
+        Replaces the groups.
+
+        Args:
+            groups (iterable): (key, file ids) per group, in the order `groups()` returns them.
+        """
+        self.group_starts = array("I", [0])
+        self.group_files = array("I")
+        self.group_prefixes = array("H")
+        self.group_digests = bytearray()
+        self.other_keys = {}
+        for group, (key, file_ids) in enumerate(groups):
+            prefix_id, digest = self._pack_key(key)
+            if prefix_id is None:
+                self.other_keys[group] = key
+                prefix_id, digest = 0, bytes(DIGEST_SIZE)
+            self.group_prefixes.append(prefix_id)
+            self.group_digests += digest
+            self.group_files.extend(file_ids)
+            self.group_starts.append(len(self.group_files))
+
+    def group_count(self) -> int:
+        return len(self.group_starts) - 1
+
+    def groups(self):
+        """
+        Yields:
+            tuple: (key, list of file ids) per group.
+        """
+        starts = self.group_starts
+        for group in range(len(starts) - 1):
+            yield self._unpack_key(group), self.group_files[starts[group]:starts[group + 1]].tolist()
@@ -0,0 +1,260 @@
+"""
+Description:
+Reports files that are created, changed or deleted in a directory tree.
+
+On Linux the kernel's inotify interface is used (through ctypes, no extra package), so a file is
+reported about a second after it was closed or moved into the tree. Elsewhere, or when inotify
+runs out of watches, the tree is scanned with fileWalker every `interval` seconds instead; a file
+is only reported once its size and mtime didn't change between two scans, so files still being
+copied are not picked up half written.
+
+Usage:
+    python fileWatcher.py [DIRECTORY] [--poll]
+        Prints the events of a directory tree until Ctrl+C.
+
+Requirements:
+* Python 3.9 or higher
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import argparse
+from pathlib import Path
+
+import fileWalker
+
+SETTLE_TIME = 1.0  # seconds without new events before a batch is reported
+POLL_INTERVAL = 5.0  # seconds between scans without inotify
+
+# From linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class Watcher:
+    """
+    Watches `directory` for files with one of `extensions`.
+
+    Create the watcher before the initial scan of the directory, so nothing written during that
+    scan is missed; files reported twice are harmless for the caller.
+
+    Usage:
+        watcher = Watcher(path, extensions={"jpg"})
+        for changed, deleted in watcher.events():
+            ...
+    """
+
+    def __init__(self, directory, recursive: bool = True, extensions: set = None,
+                 exclude: list = (), interval: float = POLL_INTERVAL, poll: bool = False):
+        self.directory = Path(directory)
+        self.recursive = recursive
+        self.extensions = extensions
+        self.exclude = [os.path.abspath(path) for path in exclude]
+        self.interval = interval
+        self.fd = None
+        self.watches = {}  # watch descriptor -> directory
+        if not poll and sys.platform.startswith("linux"):
+            try:
+                self._start_inotify()
+            except OSError as e:
+                print(f"[WARNING] inotify not available ({e}), scanning every {interval:g} s instead")
+                self.close()
+        if self.fd is None:
+            self.snapshot = self._scan()
+
+    @property
+    def method(self) -> str:
+        return "inotify" if self.fd is not None else f"polling every {self.interval:g} s"
+
+    def is_excluded(self, path) -> bool:
+        path = os.path.abspath(path)
+        return any(path == excluded or path.startswith(excluded + os.sep) for excluded in self.exclude)
+
+    def _matches(self, path: Path) -> bool:
+        if self.is_excluded(path):
+            return False
+        return self.extensions is None or fileWalker.get_extension(path.name) in self.extensions
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    # --- inotify
+
+    def _start_inotify(self) -> None:
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            self.fd = None
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._add_watches(self.directory)
+
+    def _add_watch(self, directory: Path) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOSPC, errno.ENOMEM):
+                raise OSError(error, "too many directories for inotify, "
+                                     "see /proc/sys/fs/inotify/max_user_watches")
+            print(f"[WARNING] Can't watch directory {directory}: {os.strerror(error)}")
+            return
+        self.watches[wd] = directory
+
+    def _add_watches(self, directory: Path) -> None:
+        if self.is_excluded(directory):
+            return
+        self._add_watch(directory)
+        if not self.recursive:
+            return
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False) and not self.is_excluded(entry.path):
+                            self._add_watch(Path(entry.path))
+                            pending.append(entry.path)
+            except OSError as e:
+                print(f"[WARNING] Can't read directory {current}: {e}")
+
+    def _read_inotify(self, changed: dict, deleted: dict) -> bool:
+        """
+        Reads the queued events into `changed` and `deleted` (path -> None, kept in order).
+
+        Returns:
+            bool: False if the kernel queue overflowed and events were lost.
+        """
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        complete = True
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                complete = False
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or not name:
+                continue
+            path = self.watches[wd] / os.fsdecode(name)
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.recursive:
+                    # Files can land in a new directory before its watch exists
+                    self._add_watches(path)
+                    for file, _ in fileWalker.walk(path, extensions=self.extensions):
+                        if self._matches(file):
+                            changed[file] = None
+                elif mask & (IN_DELETE | IN_MOVED_FROM) and not self.is_excluded(path):
+                    deleted[path] = None
+                continue
+            if not self._matches(path):
+                continue
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changed[path] = None
+                deleted.pop(path, None)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                deleted[path] = None
+                changed.pop(path, None)
+        return complete
+
+    def _inotify_events(self):
+        while True:
+            changed, deleted = {}, {}
+            complete = True
+            select.select([self.fd], [], [])
+            # Wait until the events stop for SETTLE_TIME, so a batch of files is reported at once
+            while select.select([self.fd], [], [], SETTLE_TIME)[0]:
+                complete = self._read_inotify(changed, deleted) and complete
+            if not complete:
+                print("[WARNING] inotify lost events, scanning the whole directory")
+                changed.update((file, None) for file, _ in fileWalker.walk(
+                    self.directory, self.recursive, self.extensions) if self._matches(file))
+            if changed or deleted:
+                yield list(changed), list(deleted)
+
+    # --- polling
+
+    def _scan(self) -> dict:
+        return {file: (stat_result.st_size, stat_result.st_mtime_ns)
+                for file, stat_result in fileWalker.walk(self.directory, self.recursive,
+                                                         self.extensions, stat=True)
+                if not self.is_excluded(file)}
+
+    def _polling_events(self):
+        unsettled = {}  # file -> (size, mtime) of files changed in the last scan
+        while True:
+            time.sleep(self.interval)
+            snapshot = self._scan()
+            changed = []
+            for file, state in snapshot.items():
+                if state == self.snapshot.get(file):
+                    if unsettled.pop(file, None) == state:
+                        changed.append(file)
+                else:
+                    unsettled[file] = state
+            deleted = [file for file in self.snapshot if file not in snapshot]
+            for file in deleted:
+                unsettled.pop(file, None)
+            self.snapshot = snapshot
+            if changed or deleted:
+                yield changed, deleted
+
+    def events(self):
+        """
+        Yields:
+            tuple: (changed, deleted), lists of the files created or changed and of the files
+                   deleted or moved away since the last batch. With inotify, `deleted` also
+                   contains directories that were removed or moved away, with everything below.
+        """
+        if self.fd is not None:
+            return self._inotify_events()
+        return self._polling_events()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print file events of a directory tree.")
+    parser.add_argument("directory", nargs="?", type=Path, default=Path.cwd())
+    parser.add_argument("--poll", action="store_true", help="Scan periodically instead of using inotify")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="Seconds between scans")
+    args = parser.parse_args()
+
+    watcher = Watcher(args.directory, interval=args.interval, poll=args.poll)
+    print(f"[INFO] Watching {args.directory.resolve()} ({watcher.method})")
+    try:
+        for changed, deleted in watcher.events():
+            for file in changed:
+                print(f"changed: {file}")
+            for file in deleted:
+                print(f"deleted: {file}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,221 @@
+# This script renames image files whose extension doesn't match their content,
+# e.g. a PNG named 'IMG_0001.jpg' becomes 'IMG_0001.png'.
+# The file type is recognized in-process from the first 32 bytes of the file (JPEG, PNG, GIF,
+# WebP, HEIC/AVIF and TIFF based RAWs; the brand list of HEIF files if it is longer), the
+# files are read on a thread pool.
+# All renames are planned first; a rename that would overwrite a file or another renamed file
+# is skipped.
+# Usage:
+#   python fixMIMEType.py [PATH] [--recursive] [--dry-run] [-j JOBS]
+
 import os
-import re
-import subprocess
+import sys
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import fileWalker
+import metrics
+
+SNIFF_SIZE = 32  # bytes read from the start of every file
+MAX_FTYP_SIZE = 4096  # a longer 'ftyp' box (brand list) of HEIF/AVIF files is not read in full
+DEFAULT_JOBS = 16  # threads reading files; the work is waiting for I/O
 
-extensionsToMimetype = {
-    'jpg': 'jpeg',
-    'jpeg': 'jpeg',
-    'png': 'png'
+# File type -> extensions that are right for it, the first one is used for renaming.
+# The names are the FileType of exiftool in lower case.
+typeToExtensions = {
+    'jpeg': ['jpg', 'jpeg', 'jpe'],
+    'png': ['png'],
+    'gif': ['gif'],
+    'webp': ['webp'],
+    'heic': ['heic', 'heif', 'hif'],
+    'avif': ['avif'],
+    'cr3': ['cr3'],
+    'cr2': ['cr2'],
+    'orf': ['orf'],
+    'rw2': ['rw2'],
+    # DNG, NEF, ARW, ... are TIFF files that can't be told apart by their first bytes;
+    # such a file is never renamed to '.tif', only reported if it has a non-TIFF extension
+    'tiff': ['tif', 'tiff', 'dng', 'nef', 'nrw', 'arw', 'sr2', 'srf', 'pef', 'srw', 'raf', 'erf',
+             'mos', 'iiq', '3fr', 'kdc', 'dcr', 'mef', 'rwl', 'cr2', 'orf', 'rw2'],
 }
+ambiguousTypes = {'tiff'}
 
-mimetypeToExtension = {
-    'jpeg': 'jpg',
-    'png': 'png'
+extensions = {extension for typeExtensions in typeToExtensions.values() for extension in typeExtensions}
+
+# ISO base media file brands (major brand at bytes 8-12 of 'ftyp') -> file type
+heifBrands = {
+    b'heic': 'heic', b'heix': 'heic', b'heim': 'heic', b'heis': 'heic', b'hevc': 'heic',
+    b'hevx': 'heic',
+    b'avif': 'avif', b'avis': 'avif',
+    b'crx ': 'cr3',
 }
+# Generic HEIF brands, the major brand of HEIC as well as of many AVIF files;
+# the compatible brands of the 'ftyp' box decide
+genericHeifBrands = {b'mif1', b'msf1'}
+
+
+def ftypSize(header):
+    """
+    Returns:
+        int: The size of the 'ftyp' box the header starts with, 0 if it doesn't start with one.
+    """
+    if header[4:8] != b'ftyp':
+        return 0
+    return int.from_bytes(header[:4], 'big')
+
+
+def sniffFtyp(header):
+    major = header[8:12]
+    if major not in genericHeifBrands:
+        return heifBrands.get(major)
+    # Compatible brands follow the major brand and the minor version
+    end = min(ftypSize(header), len(header))
+    types = {heifBrands.get(header[i:i + 4]) for i in range(16, end - 3, 4)} & {'heic', 'avif'}
+    return types.pop() if len(types) == 1 else None
+
+
+def sniffFileType(header):
+    """
+    Returns:
+        str: The file type of the first bytes of a file (a key of `typeToExtensions`),
+             None if it isn't recognized. For HEIF/AVIF files these are the whole 'ftyp' box.
+    """
+    if header[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if header[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    if header[4:8] == b'ftyp':
+        return sniffFtyp(header)
+    if header[:4] in (b'IIRO', b'IIRS'):
+        return 'orf'
+    if header[:4] == b'IIU\x00':
+        return 'rw2'
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        if header[8:11] == b'CR\x02':
+            return 'cr2'
+        return 'tiff'
+    return None
+
 
 def getMIMEType(filepath):
     try:
-        result = subprocess.run(
-            ["exiftool", "-FileType", "-MIMEType", "-s", "-s", "-s", filepath],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=True
-        )
-
-        mimeType = result.stdout.split()[0].lower()
-        return(mimeType)
-
-    except subprocess.CalledProcessError as e:
-        print(f"[ExifTool error] {e.stderr.strip()}")
+        with open(filepath, 'rb') as file:
+            header = file.read(SNIFF_SIZE)
+            if ftypSize(header) > len(header):
+                header += file.read(min(ftypSize(header), MAX_FTYP_SIZE) - len(header))
+            return sniffFileType(header)
+    except OSError as e:
+        print(f"[Error] Can't read '{filepath}': {e}")
         return None
 
-def checkAndFixMIMEType(filepath):
+
+def checkMIMEType(filepath):
+    """
+    Returns:
+        str: The path the file should be renamed to, None if its extension is right or its type
+             unknown.
+    """
     mimeType = getMIMEType(filepath)
     if not mimeType:
-        return
+        return None
 
     base, current_ext = os.path.splitext(filepath)
-    current_ext = current_ext[1:].lower()
-    if mimeType != extensionsToMimetype[current_ext]:
-        oldpath = f"{base}.{current_ext}"
-        newpath = f"{base}.{mimetypeToExtension[mimeType]}"
-        print(f"mimetype vs extension mismatch found\n\told filepath: {oldpath}\n\tnew filepath: {oldpath}")
-        os.rename(oldpath, newpath)
-
-def process_directory(path="."):
-    for filename in os.listdir(path):
-        if not filename.lower().endswith((".jpg", ".jpeg", ".png")):
+    if current_ext[1:].lower() in typeToExtensions[mimeType]:
+        return None
+    if mimeType in ambiguousTypes:
+        print(f"[Skip] '{filepath}' is a TIFF based file (TIFF or RAW), not renamed")
+        return None
+    return f"{base}.{typeToExtensions[mimeType][0]}"
+
+
+def planRenames(filepaths, jobs=DEFAULT_JOBS):
+    """
+    Checks all files on `jobs` threads.
+
+    Returns:
+        list: (old path, new path) of the files to rename; renames that would overwrite an
+              existing file or collide with each other are left out.
+    """
+    with metrics.timer("stage.sniff"):
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            newpaths = list(executor.map(checkMIMEType, filepaths))
+    metrics.count("files", len(filepaths))
+
+    # Normalized new path -> old paths, also catches 'a.JPG' and 'a.jpg' on Windows
+    claims = {}
+    for oldpath, newpath in zip(filepaths, newpaths):
+        if newpath is not None:
+            claims.setdefault(os.path.normcase(os.path.abspath(newpath)), []).append(oldpath)
+
+    renames = []
+    for oldpath, newpath in zip(filepaths, newpaths):
+        if newpath is None:
             continue
+        others = [other for other in claims[os.path.normcase(os.path.abspath(newpath))] if other != oldpath]
+        if others:
+            print(f"[Skip] Can't rename '{oldpath}', '{others[0]}' would be renamed to '{newpath}' as well")
+        elif os.path.lexists(newpath):
+            print(f"[Skip] Can't rename '{oldpath}', '{newpath}' already exists")
+        else:
+            renames.append((oldpath, newpath))
+    return renames
+
+
+def renameFiles(renames, jobs=DEFAULT_JOBS):
+    """
+    Returns:
+        int: The number of files that couldn't be renamed.
+    """
+    lock = threading.Lock()
+    failed = [0]
+
+    def rename(item):
+        oldpath, newpath = item
+        try:
+            with metrics.timer("rename"):
+                os.rename(oldpath, newpath)
+            # One write, lines of print() from several threads interleave
+            sys.stdout.write(f"mimetype vs extension mismatch found\n\told filepath: {oldpath}\n\tnew filepath: {newpath}\n")
+        except OSError as e:
+            print(f"[Error] Can't rename '{oldpath}' to '{newpath}': {e}")
+            with lock:
+                failed[0] += 1
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(rename, renames))
+    return failed[0]
+
+
+def process_directory(path=".", recursive=False, dry_run=False, jobs=DEFAULT_JOBS):
+    with metrics.timer("stage.walk"):
+        filepaths = [str(file) for file in fileWalker.get_files(path, recursive=recursive, extensions=extensions)]
+    renames = planRenames(filepaths, jobs)
+    if dry_run:
+        for oldpath, newpath in renames:
+            print(f"[Dry run] '{oldpath}' -> '{newpath}'")
+        failed = 0
+    else:
+        failed = renameFiles(renames, jobs)
+    print(f"Checked {len(filepaths)} files, {len(renames) - failed} of {len(renames)} mismatches "
+          f"{'found' if dry_run else 'renamed'}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rename image files whose extension doesn't match their content.")
+    parser.add_argument("path", nargs="?", default=".", help="Directory to check (default: the current directory)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Search directories recursively")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the renames")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_JOBS,
+                        help=f"Number of threads reading and renaming files (default: {DEFAULT_JOBS})")
+    metrics.add_arguments(parser)
+    return parser.parse_args()
 
-        filepath = os.path.join(path, filename)
-        checkAndFixMIMEType(filepath)
 
 if __name__ == "__main__":
-    process_directory(".")
\ No newline at end of file
+    args = parse_args()
+    with metrics.session(args, "fixMIMEType"):
+        process_directory(args.path, args.recursive, args.dry_run, max(1, args.jobs))
@@ -1,16 +1,33 @@
 import os
+import sys
+import json
 from pathlib import Path
+from datetime import datetime
 from collections import defaultdict, Counter
 import argparse
 
 current_dir = Path(__file__).resolve().parent
 sys.path.insert(0, str(current_dir))
 # from getFiles import get_files
+import fileWalker
+from fileCensus import FileCensus
+
+def get_cache_directory():
+    """
+    Returns the per-user cache directory of the scripts: %LOCALAPPDATA%\\photo-scripts on
+    Windows, $XDG_CACHE_HOME/photo-scripts or ~/.cache/photo-scripts elsewhere.
+    """
+    if sys.platform == "win32" and os.environ.get("LOCALAPPDATA"):
+        base = Path(os.environ["LOCALAPPDATA"])
+    else:
+        base = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    return base / "photo-scripts"
+
+DEFAULT_CENSUS_FILE = get_cache_directory() / "getFiles_census.sqlite"
 
 def get_files(directory, recursive=True):
     # directory = Path(directory)
-    pattern = "**/*" if recursive else "*"
-    return [f for f in directory.glob(pattern) if f.is_file()]
+    return fileWalker.get_files(directory, recursive=recursive)
 
 def summarize_files(files, allowed_exts=None):
     ext_counter = Counter()
@@ -32,6 +49,58 @@ def print_summary(ext_counter, filtered_files, allowed_exts):
 
     print(f"\nFiltered files: {len(filtered_files)} ({', '.join(allowed_exts)})")
 
+def format_size(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(size) < 1000:
+            break
+        size /= 1000
+    else:
+        unit = "TB"
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
+def census_to_json(counts):
+    return {ext: {"files": files, "bytes": size}
+            for ext, (files, size) in sorted(counts.items(), key=lambda x: -x[1][0])}
+
+def print_census(census, directory, recursive, totals, allowed_exts, as_json):
+    filtered = sum(totals[ext][0] for ext in allowed_exts if ext in totals)
+    if as_json:
+        print(json.dumps({
+            "directory": str(directory),
+            "recursive": recursive,
+            "files": sum(files for files, _ in totals.values()),
+            "bytes": sum(size for _, size in totals.values()),
+            "extensions": census_to_json(totals),
+            "filtered_files": filtered,
+            "directories": {"scanned": census.scanned, "skipped": census.skipped, "removed": census.removed},
+        }, indent=2))
+        return
+
+    print(f"\nFound {sum(files for files, _ in totals.values())} files "
+          f"({format_size(sum(size for _, size in totals.values()))}), "
+          f"{census.scanned} directories scanned, {census.skipped} unchanged:")
+    for ext, (files, size) in sorted(totals.items(), key=lambda x: -x[1][0]):
+        print(f"{ext}: {files} ({format_size(size)})")
+
+    print(f"\nFiltered files: {filtered} ({', '.join(allowed_exts)})")
+
+def print_changes(directory, since, changes, as_json):
+    if as_json:
+        print(json.dumps({
+            "directory": str(directory),
+            "since": since,
+            "files": sum(files for files, _ in changes.values()),
+            "bytes": sum(size for _, size in changes.values()),
+            "extensions": census_to_json(changes),
+        }, indent=2))
+        return
+
+    print(f"\nChanges since {since}:")
+    if not changes:
+        print("none")
+    for ext, (files, size) in sorted(changes.items(), key=lambda x: -abs(x[1][0])):
+        print(f"{ext}: {files:+d} ({'+' if size >= 0 else '-'}{format_size(abs(size))})")
+
 def main():
     parser = argparse.ArgumentParser(
       description = "Get and summarize files in a directory."
@@ -49,7 +118,41 @@ def main():
       default = False
     )
 
+    parser.add_argument(
+      "--census",
+      nargs = "?",
+      const = DEFAULT_CENSUS_FILE,
+      help = "Keep file counts and sizes per directory in this SQLite file and only rescan directories "
+             f"that changed since the last run (default file: {DEFAULT_CENSUS_FILE})"
+    )
+    parser.add_argument(
+      "--since",
+      nargs = "?",
+      const = "last",
+      help = "Only report what changed since the last census run, or since a date like '2026-10-01' "
+             "or '2026-10-01 12:00' (implies --census)"
+    )
+    parser.add_argument(
+      "--json",
+      action = "store_true",
+      help = "Print the census as JSON (implies --census)"
+    )
+    parser.add_argument(
+      "--rebuild-census",
+      action = "store_true",
+      help = "Rescan every directory instead of skipping unchanged ones"
+    )
+
     args = parser.parse_args()
+    if (args.since or args.json or args.rebuild_census) and not args.census:
+      args.census = DEFAULT_CENSUS_FILE
+    since = None
+    if args.since and args.since != "last":
+      try:
+        since = datetime.fromisoformat(args.since)
+      except ValueError:
+        print(f"Error: '{args.since}' is not a date like '2026-10-01' or '2026-10-01 12:00'.")
+        return
 
     directory = Path.cwd()
     if args.dir:
@@ -58,10 +161,26 @@ def main():
         print(f"Error: {directory} is not a valid directory.")
         return
 
-    print(f"Searching in directory: {directory}")
+    if not args.json:
+      print(f"Searching in directory: {directory}")
 
     allowed_exts = {"arw", "cr2", "jpg", "jpeg", "dng"}
 
+    if args.census:
+      census_file = Path(args.census)
+      census_file.parent.mkdir(parents=True, exist_ok=True)
+      census = FileCensus(census_file, rebuild=args.rebuild_census)
+      try:
+        totals = census.update(directory, recursive=args.recursive)
+        if args.since:
+          changes = census.changes(since=census.last_run if since is None else since, root=directory)
+          print_changes(directory, "the last run" if since is None else args.since, changes, args.json)
+        else:
+          print_census(census, directory, args.recursive, totals, allowed_exts, args.json)
+      finally:
+        census.close()
+      return
+
     files = get_files(directory=directory, recursive=args.recursive)
     ext_counter, filtered_files = summarize_files(files, allowed_exts)
     print_summary(ext_counter, filtered_files, allowed_exts)
@@ -0,0 +1,117 @@
+"""
+Description:
+Persistent single-file cache for per-file hashes and EXIF data, backed by SQLite.
+
+An entry is only valid as long as size, modification time and inode of the file are unchanged.
+A stale entry is dropped as soon as it is looked up, so the cache never has to be cleared by hand.
+
+Requirements:
+* Python 3.6 or higher (sqlite3 is part of the standard library)
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+
+COLUMNS = ("sample_hash", "content_hash", "image_hash", "exif_tags", "dhash", "phash",
+           "image_info", "draft_hash", "raw_hash")
+COMMIT_INTERVAL = 1000  # writes between two commits
+
+
+class HashCache:
+    """
+    Cache of values per file, keyed by (path, size, mtime, inode).
+
+    Usage:
+        cache = HashCache(Path("hashes.sqlite"))
+        value = cache.get(path, path.stat(), "content_hash")
+        cache.set(path, path.stat(), "content_hash", "...")
+        cache.close()
+    """
+
+    def __init__(self, db_path: Path, rebuild: bool = False):
+        self.db_path = Path(db_path)
+        self.connection = sqlite3.connect(str(self.db_path))
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        if rebuild:
+            self.connection.execute("DROP TABLE IF EXISTS files")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " inode INTEGER NOT NULL,"
+            + ", ".join(f"{column} TEXT" for column in COLUMNS)
+            + ")"
+        )
+        # Caches written by older versions lack the newer columns
+        existing = {row[1] for row in self.connection.execute("PRAGMA table_info(files)")}
+        for column in COLUMNS:
+            if column not in existing:
+                self.connection.execute(f"ALTER TABLE files ADD COLUMN {column} TEXT")
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+        self.pending_writes = 0
+
+    @staticmethod
+    def _key(filepath) -> str:
+        return os.path.abspath(filepath)
+
+    def get(self, filepath, stat_result: os.stat_result, column: str):
+        """
+        Returns the cached value of `column` for the file, or None.
+        A row whose size, mtime or inode differ from `stat_result` is deleted.
+        """
+        if column not in COLUMNS:
+            raise ValueError(f"Unknown cache column: {column}")
+        row = self.connection.execute(
+            f"SELECT size, mtime_ns, inode, {column} FROM files WHERE path = ?",
+            (self._key(filepath),)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        if row[:3] != (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino):
+            self.connection.execute("DELETE FROM files WHERE path = ?", (self._key(filepath),))
+            self._written()
+            self.misses += 1
+            return None
+        if row[3] is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return row[3]
+
+    def set(self, filepath, stat_result: os.stat_result, column: str, value: str) -> None:
+        """
+        Stores `value` in `column` for the file.
+        Other columns are kept if the file is unchanged and cleared otherwise.
+        """
+        if column not in COLUMNS:
+            raise ValueError(f"Unknown cache column: {column}")
+        key = (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+        self.connection.execute(
+            "INSERT INTO files (path, size, mtime_ns, inode) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET "
+            + ", ".join(
+                f"{c} = CASE WHEN (size, mtime_ns, inode) = (excluded.size, excluded.mtime_ns, excluded.inode) "
+                f"THEN {c} ELSE NULL END" for c in COLUMNS)
+            + ", size = excluded.size, mtime_ns = excluded.mtime_ns, inode = excluded.inode",
+            (self._key(filepath), *key)
+        )
+        self.connection.execute(
+            f"UPDATE files SET {column} = ? WHERE path = ?", (value, self._key(filepath))
+        )
+        self._written()
+
+    def _written(self) -> None:
+        self.pending_writes += 1
+        if self.pending_writes >= COMMIT_INTERVAL:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
@@ -10,29 +10,65 @@ Requirements:
 
 ToDo:
 [ ] Implement detailed comparison of EXIF dates for duplicates.
-[ ] Pillow only works with JPG and PNG reliably. We need to use something like rawpy to compare RAW files.
-[ ] Write resutls to a (json) file.
+[x] Pillow only works with JPG and PNG reliably. We need to use something like rawpy to compare RAW files.
+    TIFF based RAW files are compared by their image data instead, see rawHash.
+[x] Write resutls to a (json) file.
+    See --plan and --apply.
 """
 
 import os
 import sys
+import json
 import hashlib
 import argparse
-import subprocess
-import shutil
+import queue
+import threading
+import time
+import uuid
+from array import array
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from functools import partial
 from pathlib import Path
 from PIL import Image
 from PIL.ExifTags import TAGS
 from datetime import datetime
+from hashCache import HashCache
+import exiftoolPool
+import exifReader
+import fileHash
+import fileWalker
+import fileWatcher
+import metrics
+import rawHash
+import perceptualHash
+from transfer import TransferEngine, MODES as LINK_MODES
+from exiftoolPool import ExifToolError
+from fileIndex import FileIndex
 
 args = None
+cache = None  # HashCache, set in main() when --cache is given
 default_extensions = {'jpg', 'png'}
-
-
-def parse_args():
+SAMPLE_SIZE = 64 * 1024  # bytes read from head and tail of a file in the sample stage
+CHUNK_SIZE = 16  # files per task submitted to a worker process
+QUEUE_SIZE = 1024  # scanned files waiting for the hashing stages
+PROGRESS_INTERVAL = 10  # seconds between progress reports of the streaming stages
+STRIP_ROWS = 256  # image rows converted and hashed at once by get_image_hash
+PLAN_VERSION = 2  # format of the --plan file; 2 added the plan id
+# Timer names of the HashPool functions in --metrics; the image functions mostly decode
+METRIC_NAMES = {"get_sample_hash": "hash.sample", "get_file_hash": "hash.content", "get_raw_hash": "hash.raw",
+                "get_image_info": "decode.header", "get_draft_hash": "decode.draft",
+                "get_image_hash": "decode.pixels", "dhash": "decode.dhash", "phash": "decode.phash"}
+SCORE_TAGS = ["FocalLength", "Aperture", "ShutterSpeed", "ISO", "CameraModelName", "LensModel"]
+
+
+def parse_args(argv: list[str] = None):
     """
     Parses command line arguments for the script.
+
+    Args:
+        argv (list): Arguments to parse instead of `sys.argv[1:]`, e.g. for benchmark.py.
+
     Returns:
         argparse.Namespace: The parsed arguments.
     """
@@ -74,6 +110,20 @@ Requirements:
         type=Path,
         help="Copy unique files to output dir (default: _output)\nWarning: If the output directory already exists, files will be copied into it, potentially overwriting existing files."
     )
+    parser.add_argument(
+        "--link-mode",
+        choices=LINK_MODES,
+        default="copy",
+        help="How --copy puts files into the output directory (default: copy). "
+             "'hardlink' and 'reflink' don't duplicate any data on the same filesystem, "
+             "'move' renames the files."
+    )
+    parser.add_argument(
+        "--transfer-jobs",
+        type=int,
+        default=4,
+        help="Number of threads copying and deleting files (default: 4)"
+    )
     parser.add_argument(
         '--delete',
         nargs="?",
@@ -87,6 +137,87 @@ Requirements:
         metavar="EXTENSIONS",
         help=f"Define file extensions to search for (default: {default_extensions})"
     )
+    parser.add_argument(
+        "--compare",
+        choices=["pixels", "bytes"],
+        default="pixels",
+        help="How files are compared (default: pixels). "
+             "'pixels' decodes the images, so re-encoded copies are found too. "
+             "'bytes' only finds byte-identical files but never decodes an image."
+    )
+    parser.add_argument(
+        "--hash",
+        choices=fileHash.ALGORITHMS,
+        default="sha256",
+        help="Hash algorithm used to compare file content (default: sha256). "
+             "xxh3 (needs `pip install xxhash`) is the fastest, see `python fileHash.py`."
+    )
+    parser.add_argument(
+        "--draft",
+        action="store_true",
+        help="Tell JPEGs apart by a 1/8 scale decode before decoding them completely. "
+             "Much faster; assumes JPEGs with identical pixels have identical DCT coefficients."
+    )
+    parser.add_argument(
+        "--similar",
+        type=int,
+        metavar="THRESHOLD",
+        help="Also group near-duplicates (re-saved or resized copies) whose perceptual hashes "
+             "differ in at most THRESHOLD of 64 bits, e.g. 6"
+    )
+    parser.add_argument(
+        "--similar-hash",
+        choices=["dhash", "phash"],
+        default="dhash",
+        help="Perceptual hash used by --similar (default: dhash)"
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes used for hashing (default: 1). 0 uses all CPU cores."
+    )
+    parser.add_argument(
+        "--cache",
+        type=Path,
+        metavar="CACHE_FILE",
+        help="SQLite file to cache hashes and EXIF data in. "
+             "Entries are reused as long as size, mtime and inode of a file are unchanged."
+    )
+    parser.add_argument(
+        "--rebuild-cache",
+        action="store_true",
+        help="Discard all entries of the --cache file before searching"
+    )
+    parser.add_argument(
+        "--plan",
+        type=Path,
+        metavar="PLAN_FILE",
+        help="Don't copy or delete anything, write what --copy and --delete would do to a "
+             "JSON lines file instead: every group with winner, losers and the reasons"
+    )
+    parser.add_argument(
+        "--apply",
+        type=Path,
+        metavar="PLAN_FILE",
+        help="Carry out the copies and deletions of a --plan file without searching again. "
+             "Resumes where an interrupted run stopped. --path and --copy override the "
+             "directories stored in the plan."
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and handle new files as soon as they arrive (inotify on Linux, "
+             "periodic scans elsewhere). Use with --cache, so a restart doesn't hash everything again."
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=fileWatcher.POLL_INTERVAL,
+        metavar="SECONDS",
+        help=f"Seconds between scans of --watch without inotify (default: {fileWatcher.POLL_INTERVAL:g})"
+    )
+    metrics.add_arguments(parser)
     parser.add_argument(
         "--rename",
         nargs=1,
@@ -95,10 +226,40 @@ Requirements:
              "Use {hash} for the file hash, {datetime} for the EXIF DateTimeOriginal, "
              "and {filename} for the original filename."
     )
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     print("args:", args)
 
+    # --plan / --apply
+    if args.plan and args.apply:
+        print(f"[ERROR] --plan and --apply can't be used together. Aborting.")
+        sys.exit(1)
+    if args.apply:
+        if not args.apply.is_file():
+            print(f"[ERROR] The plan '{args.apply}' doesn't exist. Aborting.")
+            sys.exit(1)
+        if args.transfer_jobs < 1:
+            print(f"[ERROR] --transfer-jobs must be at least 1. Aborting.")
+            sys.exit(1)
+        print(f"[INFO] Applying plan: {args.apply.resolve()}")
+        return args
+    if args.plan:
+        print(f"[INFO] Writing plan to: {args.plan.resolve()}")
+        print()
+
+    # --watch
+    if args.watch and (args.plan or args.similar is not None):
+        print(f"[ERROR] --watch can't be used together with --plan or --similar. Aborting.")
+        sys.exit(1)
+    if args.watch and args.poll_interval <= 0:
+        print(f"[ERROR] --poll-interval must be positive. Aborting.")
+        sys.exit(1)
+    if args.watch and args.metrics:
+        print(f"[INFO] --metrics are written when --watch is stopped")
+    if args.watch and not args.cache:
+        print(f"[WARNING] --watch without --cache hashes all files again at every start")
+        print()
+
     # --path
     if args.path is None:
         args.path = Path.cwd()
@@ -126,6 +287,31 @@ Requirements:
         args.rename = args.rename[0].strip()
         print(f"[INFO] Renaming files. Renaming expression: {args.rename}")
 
+    # --similar
+    if args.similar is not None:
+        if not 0 <= args.similar <= 64:
+            print(f"[ERROR] --similar must be between 0 and 64. Aborting.")
+            sys.exit(1)
+        print(f"[INFO] Grouping near-duplicates: {args.similar_hash} distance <= {args.similar}")
+        print()
+
+    # --jobs
+    if args.jobs < 0:
+        print(f"[ERROR] --jobs must not be negative. Aborting.")
+        sys.exit(1)
+    if args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+    print(f"[INFO] Hashing processes: {args.jobs}")
+    print()
+
+    # --cache
+    if args.rebuild_cache and args.cache is None:
+        print(f"[ERROR] --cache argument must be given when rebuilding the cache. Aborting.")
+        sys.exit(1)
+    if args.cache:
+        print(f"[INFO] Using cache: {args.cache.resolve()}" + (" (rebuilding)" if args.rebuild_cache else ""))
+        print()
+
     # --copy
     if args.copy == Path("-1"):
         args.copy = args.path / "_output"
@@ -133,7 +319,9 @@ Requirements:
     
     if args.copy:
         print(f"[INFO] Copying unique files to: {args.copy.resolve()}")
-        if not args.copy.exists():
+        if not args.copy.exists() and args.plan:
+            print(f"[INFO] The output directory is created by --apply")
+        elif not args.copy.exists():
             print(f"[INFO] Creating output directory: {args.copy.resolve()}")
             args.copy.mkdir(parents=True, exist_ok=True)
         else:
@@ -141,8 +329,16 @@ Requirements:
                 f"[INFO] Output directory already exists: {args.copy.resolve()}")
         print()
 
+    # --link-mode
+    if args.copy:
+        print(f"[INFO] Link mode: {args.link_mode}")
+        print()
+    if args.transfer_jobs < 1:
+        print(f"[ERROR] --transfer-jobs must be at least 1. Aborting.")
+        sys.exit(1)
+
     # --delete
-    if args.delete == "ask":
+    if args.delete == "ask" and not args.plan:
         if not confirm_deletion():
             print("[ERROR] Aborting.")
             sys.exit(1)
@@ -180,38 +376,80 @@ def get_image_hash(filepath: Path) -> str:
 
     A JPG and PNG of the same image will be considered duplicates.
 
+    The decoded image is converted and hashed in strips of STRIP_ROWS rows, so neither a
+    converted copy nor the full `tobytes()` of the image is ever held in memory.
+    The result is the same as hashing `img.convert("RGB").tobytes()` at once.
+
     Args:
         filepath (Path): The path to the file.
 
     Returns:
         str: The SHA256 hash of the image content.
     """
+    hasher = hashlib.sha256()
     with Image.open(filepath) as img:
-        img = img.convert("RGB")  # Normalize format
-        data = img.tobytes()
-        return hashlib.sha256(data).hexdigest()
+        width, height = img.size
+        for top in range(0, height, STRIP_ROWS):
+            strip = img.crop((0, top, width, min(top + STRIP_ROWS, height)))
+            hasher.update(strip.convert("RGB").tobytes())  # Normalize format
+    return hasher.hexdigest()
 
 
-def get_file_hash(filepath: Path) -> str:
+def get_image_info(filepath: Path) -> str:
     """
-    Creates the SHA256 hash of the file using hashlib and return it.
+    Returns format and dimensions of an image, read from its header without decoding it.
+    Images with different dimensions can't have the same pixel content.
 
     Args:
         filepath (Path): The path to the file.
 
     Returns:
-        str: The SHA256 hash of the file.
+        str: e.g. "JPEG 4080x3072"
     """
-    hasher = hashlib.sha256()
-    with open(filepath, 'rb') as f:
-        hasher.update(f.read())
-    return hasher.hexdigest()
+    with Image.open(filepath) as img:
+        return f"{img.format} {img.width}x{img.height}"
+
+
+def get_draft_hash(filepath: Path) -> str:
+    """
+    Creates the SHA256 hash of a JPEG decoded at 1/8 scale with `Image.draft()`.
+    libjpeg then only computes the DC coefficient of every 8x8 block, which is a lot faster
+    and needs 1/64 of the memory of a full decode.
+
+    Only used to tell JPEGs apart: JPEGs with the same pixel content share the same DCT
+    coefficients and therefore the same draft hash.
+
+    Args:
+        filepath (Path): The path to the JPEG.
+
+    Returns:
+        str: The SHA256 hash of the reduced image.
+    """
+    with Image.open(filepath) as img:
+        img.draft("RGB", (max(1, img.width // 8), max(1, img.height // 8)))
+        return hashlib.sha256(img.convert("RGB").tobytes()).hexdigest()
+
+
+def get_file_hash(filepath: Path, algorithm: str = "sha256") -> str:
+    """
+    Creates the hash of the file and returns it.
+    The file is streamed through a small buffer (or memory mapped), see fileHash.
+
+    Args:
+        filepath (Path): The path to the file.
+        algorithm (str): One of fileHash.ALGORITHMS.
+
+    Returns:
+        str: The hash of the file (prefixed with the algorithm unless it is sha256).
+    """
+    return fileHash.hash_file(filepath, algorithm)
 
 
 def get_exif_datetime(filepath) -> str:
     """
     Returns the EXIF 'DateTimeOriginal' if available.
     If the EXIF data is not available, returns None.
+    JPEG and TIFF based RAW files are read in-process, other formats with exiftool.
 
     Args:
         filepath (Path): The path to the file.
@@ -220,70 +458,615 @@ def get_exif_datetime(filepath) -> str:
         str: EXIF data of the file.
     """
     try:
-        result = subprocess.run(
-            ["exiftool", "-s", "-s", "-s", "-DateTimeOriginal", str(filepath)],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True,
-            text=True
-        )
-        output = result.stdout.strip()
-        return output if output else None
-    except subprocess.CalledProcessError:
+        return exifReader.get_tags(filepath, ["DateTimeOriginal"]).get("DateTimeOriginal") or None
+    except ExifToolError:
         return None
 
 
+def hash_chunk(func, tasks: list[tuple]) -> tuple[list[tuple], float]:
+    """
+    Calls `func(*task)` for every task of a chunk.
+    Runs inside the worker processes of `HashPool`, so errors are returned instead of raised.
+
+    Returns:
+        tuple: (value, error) per task, where error is the message of the exception or None,
+               and the seconds the chunk took, for --metrics.
+    """
+    start = time.perf_counter()
+    results = []
+    for task in tasks:
+        try:
+            results.append((func(*task), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results, time.perf_counter() - start
+
+
+class HashPool:
+    """
+    Runs hash functions on a ProcessPoolExecutor, or in this process if jobs is 1.
+
+    Tasks are submitted in chunks and at most `2 * jobs` chunks are in flight at once,
+    so memory use doesn't grow with the number of files.
+
+    `map` hashes a known list of tasks. `submit` and `collect` take tasks one by one while
+    results come back, for the streaming stages of `get_content_groups`.
+    """
+
+    def __init__(self, jobs: int = 1, chunk_size: int = CHUNK_SIZE):
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+        self.executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        self.buffers = {}  # func -> tasks waiting to fill a chunk
+        self.pending = {}  # future -> (func, chunk)
+        self.ready = []  # results computed in this process (jobs == 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    @staticmethod
+    def _record(func, chunk_result: tuple) -> list[tuple]:
+        results, seconds = chunk_result
+        metrics.add_time(METRIC_NAMES.get(func.__name__, f"hash.{func.__name__}"), seconds, len(results))
+        return results
+
+    def map(self, func, items: list[tuple]):
+        """
+        Computes `func(*task)` for every (key, task) of `items`, where the key identifies the
+        task for the caller, e.g. a file id.
+        Yields (key, value, error) for every task. The order is not preserved.
+        """
+        if self.executor is None:
+            for key, task in items:
+                value, error = self._record(func, hash_chunk(func, [task]))[0]
+                yield key, value, error
+            return
+
+        pending = {}
+        for start in range(0, len(items), self.chunk_size):
+            if len(pending) >= 2 * self.jobs:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = pending.pop(future)
+                    for (key, _), (value, error) in zip(chunk, self._record(func, future.result())):
+                        yield key, value, error
+            chunk = items[start:start + self.chunk_size]
+            pending[self.executor.submit(hash_chunk, func, [task for _, task in chunk])] = chunk
+        for future in as_completed(pending):
+            for (key, _), (value, error) in zip(pending[future], self._record(func, future.result())):
+                yield key, value, error
+
+    def submit(self, func, key, task: tuple) -> None:
+        """
+        Queues `func(*task)`, its result is returned by `collect` together with `key`.
+        Tasks are sent to the workers once a chunk is full or on `flush`.
+        """
+        if self.executor is None:
+            value, error = self._record(func, hash_chunk(func, [task]))[0]
+            self.ready.append((func, key, task, value, error))
+            return
+        buffer = self.buffers.setdefault(func, [])
+        buffer.append((key, task))
+        if len(buffer) >= self.chunk_size:
+            self._send(func)
+
+    def _send(self, func) -> None:
+        chunk = self.buffers.pop(func)
+        self.pending[self.executor.submit(hash_chunk, func, [task for _, task in chunk])] = (func, chunk)
+
+    def flush(self) -> None:
+        """
+        Sends the incomplete chunks, too.
+        """
+        for func in list(self.buffers):
+            self._send(func)
+
+    @property
+    def busy(self) -> bool:
+        """
+        True if enough chunks are in flight; callers should collect before submitting more.
+        """
+        return len(self.pending) >= 2 * self.jobs
+
+    @property
+    def idle(self) -> bool:
+        return not self.pending and not self.buffers and not self.ready
+
+    def collect(self, timeout: float = None) -> list[tuple]:
+        """
+        Returns (func, key, task, value, error) of the submitted tasks that finished, waiting up
+        to `timeout` seconds for the first one if none has finished yet.
+        """
+        results, self.ready = self.ready, []
+        if self.pending:
+            done, _ = wait(self.pending, timeout=0 if results else timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                func, chunk = self.pending.pop(future)
+                values = self._record(func, future.result())
+                results.extend((func, key, task, value, error) for (key, task), (value, error) in zip(chunk, values))
+        return results
+
+
+def get_cached(path: Path, stat_result: os.stat_result, column: str, algorithm: str = None) -> str | None:
+    """
+    Returns the cached value of a file, None if there is none (or no cache).
+    With `algorithm`, a hash made with another algorithm (an earlier run with another --hash)
+    counts as missing as well.
+    """
+    value = cache.get(path, stat_result, column) if cache is not None else None
+    if value is not None and algorithm is not None and fileHash.digest_algorithm(value) != algorithm:
+        return None
+    return value
+
+
+def get_hashes(pool: HashPool, func, tasks: list[tuple], column: str, index: FileIndex,
+               algorithm: str = None) -> dict[int, str]:
+    """
+    Computes `func(path, *arguments)` for every task (file id, *arguments).
+    Values found in the cache are used as they are, the rest is computed by the pool and cached.
+    Errors are printed per file; those files are missing from the result.
+
+    Args:
+        pool (HashPool): Pool to compute missing values with.
+        func (callable): Module level hash function, e.g. `get_file_hash`.
+        tasks (list): File id and further arguments for `func`.
+        column (str): Cache column of the value, one of hashCache.COLUMNS.
+        index (FileIndex): The files, their stat results validate cache entries.
+        algorithm (str): Hash algorithm of the values, cached values of another one are ignored.
+
+    Returns:
+        dict: file id -> value
+    """
+    hashes = {}
+    missing = []
+    for file, *arguments in tasks:
+        path = index.path(file)
+        value = get_cached(path, index.stat(file), column, algorithm)
+        if value is None:
+            missing.append((file, (path, *arguments)))
+        else:
+            hashes[file] = value
+
+    for file, value, error in pool.map(func, missing):
+        if error is not None:
+            print(f"Error processing {index.path(file)}: {error}")
+            continue
+        hashes[file] = value
+        if cache is not None:
+            cache.set(index.path(file), index.stat(file), column, value)
+    return hashes
+
+
+def get_sample_hash(filepath: Path, size: int, sample_size: int = SAMPLE_SIZE,
+                    algorithm: str = "sha256") -> str:
+    """
+    Creates the hash of the first and last `sample_size` bytes of the file.
+    Files not larger than two samples are hashed completely, so the result equals `get_file_hash`.
+
+    Args:
+        filepath (Path): The path to the file.
+        size (int): The size of the file in bytes.
+        sample_size (int): Number of bytes read from the head and from the tail.
+        algorithm (str): One of fileHash.ALGORITHMS.
+
+    Returns:
+        str: The hash of the sampled bytes.
+    """
+    hasher = fileHash.new_hasher(algorithm)
+    with open(filepath, 'rb') as f:
+        if size <= 2 * sample_size:
+            fileHash.update_from_file(hasher, f)
+        else:
+            hasher.update(f.read(sample_size))
+            f.seek(-sample_size, os.SEEK_END)
+            hasher.update(f.read(sample_size))
+    return fileHash.digest(hasher, algorithm)
+
+
+def print_stage(name: str, candidates: int, remaining: int) -> None:
+    print(f"[INFO] Stage '{name}': {candidates} candidates, "
+          f"{candidates - remaining} removed, {remaining} remaining")
+
+
+def start_scan(entries, maxsize: int = QUEUE_SIZE) -> queue.Queue:
+    """
+    Runs the iterable `entries` (e.g. `fileWalker.walk`) on a thread and returns the queue its
+    items are put into, followed by None. The queue is bounded, so the scan pauses while the
+    hashing stages are behind.
+    """
+    scan = queue.Queue(maxsize)
+
+    def produce():
+        try:
+            for entry in entries:
+                scan.put(entry)
+        finally:
+            scan.put(None)
+
+    threading.Thread(target=produce, name="scan", daemon=True).start()
+    return scan
+
+
+def get_content_groups(entries, index: FileIndex, pool: HashPool,
+                       algorithm: str = "sha256", infos: dict[int, str] = None) -> list[tuple[str, list[int]]]:
+    """
+    Groups files with byte-identical content using increasingly expensive stages:
+    1) file size, 2) hash of a head/tail sample, 3) hash of the full content.
+    Each stage only reads the files the previous stage couldn't tell apart,
+    so a file with a unique size is never opened.
+
+    The stages run as a pipeline while the directory is still being scanned: as soon as a
+    second file of a size shows up, both are sampled, and as soon as two samples match, both
+    files are hashed completely. Which files are unique is only known at the end of the scan,
+    the groups are built then, in scan order.
+
+    Args:
+        entries (iterable): (path, stat result) of the files, e.g. from `fileWalker.walk`.
+        index (FileIndex): All files are added to it, in scan order.
+        pool (HashPool): Pool the hashes are computed with.
+        algorithm (str): Hash algorithm for the sample and content stages.
+        infos (dict): If given, filled with `get_image_info` of every non-RAW file while the
+                      scan is running (None where it failed), for `get_pixel_groups`.
+
+    Returns:
+        list: (key, file ids) tuples. The key is the full content hash where it was computed,
+              otherwise a key of the stage that already proved the file unique.
+    """
+    first_of_size = {}  # size -> first file id; most sizes never get a second file
+    by_size = {}  # size -> file ids, for sizes with more than one file
+    sample_hashes = {}
+    by_sample = defaultdict(list)
+    content_hashes = {}
+
+    def request(func, file, arguments, column):
+        path = index.path(file)
+        value = get_cached(path, index.stat(file), column, algorithm if func is not get_image_info else None)
+        if value is None:
+            pool.submit(func, file, (path, *arguments))
+        else:
+            handle(func, file, value)
+
+    def handle(func, file, value):
+        if func is get_sample_hash:
+            sample_hashes[file] = value
+            size = index.size[file]
+            bucket = by_sample[(size, value)]
+            bucket.append(file)
+            if size > 2 * SAMPLE_SIZE:
+                if len(bucket) == 2:
+                    request(get_file_hash, bucket[0], (algorithm,), "content_hash")
+                if len(bucket) >= 2:
+                    request(get_file_hash, file, (algorithm,), "content_hash")
+        elif func is get_file_hash:
+            content_hashes[file] = value
+        elif func is get_image_info:
+            infos[file] = value
+
+    def add_file(path, stat_result):
+        file = index.add(path, stat_result)
+        size = stat_result.st_size
+        first = first_of_size.setdefault(size, file)
+        if first != file:
+            bucket = by_size.get(size)
+            if bucket is None:
+                bucket = by_size[size] = [first]
+                request(get_sample_hash, first, (size, SAMPLE_SIZE, algorithm), "sample_hash")
+            bucket.append(file)
+            request(get_sample_hash, file, (size, SAMPLE_SIZE, algorithm), "sample_hash")
+        if infos is not None and index.extension(file) not in rawHash.RAW_EXTENSIONS:
+            request(get_image_info, file, (), "image_info")
+
+    columns = {get_sample_hash: "sample_hash", get_file_hash: "content_hash", get_image_info: "image_info"}
+    scan = start_scan(entries)
+    scan_done = False
+    last_progress = time.monotonic()
+    while not scan_done or not pool.idle:
+        # Read new files while the workers have room, then hand out what was requested
+        input_waiting = False
+        while not scan_done and not pool.busy:
+            try:
+                entry = scan.get(timeout=PROGRESS_INTERVAL if pool.idle else 0)
+            except queue.Empty:
+                break
+            if entry is None:
+                scan_done = True
+            else:
+                add_file(*entry)
+                input_waiting = True
+                if len(index) % QUEUE_SIZE == 0:
+                    break
+        if not input_waiting or scan_done:
+            pool.flush()
+
+        timeout = 0 if input_waiting and not pool.busy else PROGRESS_INTERVAL
+        for func, file, task, value, error in pool.collect(timeout):
+            if error is not None:
+                print(f"Error processing {task[0]}: {error}")
+                if func is get_image_info:
+                    infos[file] = None
+                continue
+            if cache is not None:
+                cache.set(task[0], index.stat(file), columns[func], value)
+            handle(func, file, value)
+
+        if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+            last_progress = time.monotonic()
+            print(f"[INFO] Progress: {len(index)} files scanned{'' if scan_done else ' (scanning)'}, "
+                  f"{len(sample_hashes)} sampled, {len(content_hashes)} hashed"
+                  + (f", {len(infos)} headers read" if infos is not None else ""))
+
+    groups = []
+
+    # Stage 1: file size
+    for size, file in first_of_size.items():
+        if size not in by_size:
+            groups.append((f"size:{size}", [file]))
+    del first_of_size
+    remaining = sum(len(files) for files in by_size.values())
+    print_stage("size", len(index), remaining)
+
+    # Stage 2: head/tail sample
+    by_sample = defaultdict(list)
+    for size, files in by_size.items():
+        for file in files:
+            if file in sample_hashes:
+                by_sample[(size, sample_hashes[file])].append(file)
+
+    number_of_candidates = remaining
+    candidates = []
+    for (size, sample_hash), files in by_sample.items():
+        if len(files) == 1:
+            groups.append((f"sample:{sample_hash}", files))
+        elif size <= 2 * SAMPLE_SIZE:
+            # The sample already covered the whole file
+            groups.append((sample_hash, files))
+        else:
+            candidates.append(files)
+    remaining = sum(len(files) for files in candidates)
+    print_stage("sample", number_of_candidates, remaining)
+
+    # Stage 3: full content
+    # Files of different size can't share a hash, so one map for all sizes is fine.
+    by_hash = defaultdict(list)
+    for files in candidates:
+        for file in files:
+            if file in content_hashes:
+                by_hash[content_hashes[file]].append(file)
+
+    groups.extend(by_hash.items())
+    print_stage("content", remaining, sum(len(files) for files in by_hash.values() if len(files) > 1))
+
+    return groups
+
+
+def get_pixel_groups(content_groups: list[tuple[str, list[int]]], index: FileIndex,
+                     pool: HashPool, draft: bool = False, algorithm: str = "sha256",
+                     infos: dict[int, str] = None) -> defaultdict:
+    """
+    Merges groups of byte-identical files whose images have the same pixels.
+    Only one file per group is looked at.
+
+    RAW files can't be decoded by Pillow; they are compared by the hash of their image data
+    (see rawHash), so copies with edited metadata are still found. RAW files without
+    readable image data keep their content group.
+
+    Other images are only decoded completely if cheaper stages can't tell them apart from all
+    other groups:
+    4a) format and dimensions from the image header,
+    4b) with `draft`, a 1/8 scale decode, for buckets consisting of JPEGs only,
+    4c) the full decode of `get_image_hash`.
+
+    Args:
+        content_groups (list): (key, file ids) as returned by `get_content_groups`.
+        index (FileIndex): The files.
+        pool (HashPool): Pool the hashes are computed with.
+        draft (bool): Use stage 4b.
+        algorithm (str): Hash algorithm for RAW image data.
+        infos (dict): `get_image_info` results already known, e.g. from `get_content_groups`.
+
+    Returns:
+        defaultdict: hash -> file ids. Groups proven unique before the full decode keep their key.
+    """
+    hash_map = defaultdict(list)
+    groups = {files[0]: (key, files) for key, files in content_groups}
+
+    # RAW image data
+    raw_files = [file for file in groups if index.extension(file) in rawHash.RAW_EXTENSIONS]
+    if raw_files:
+        raw_hashes = get_hashes(pool, rawHash.get_raw_hash, [(file, algorithm) for file in raw_files],
+                                "raw_hash", index, algorithm)
+        for file in raw_files:
+            key, paths = groups.pop(file)
+            hash_map[raw_hashes.get(file, key)].extend(paths)
+        print_stage("raw", len(raw_files), sum(len(paths) for paths in hash_map.values() if len(paths) > 1))
+
+    # Stage 4a: image header
+    known = infos if infos is not None else {}
+    computed = get_hashes(pool, get_image_info, [(file,) for file in groups if file not in known],
+                          "image_info", index)
+    infos = {file: known.get(file) or computed.get(file) for file in groups}
+    infos = {file: info for file, info in infos.items() if info is not None}
+    by_dimensions = defaultdict(list)
+    for file, info in infos.items():
+        by_dimensions[info.split()[-1]].append(file)
+    candidates = []
+    for files in by_dimensions.values():
+        if len(files) == 1:
+            key, paths = groups[files[0]]
+            hash_map[key].extend(paths)
+        else:
+            candidates.append(files)
+    remaining = sum(len(files) for files in candidates)
+    print_stage("dimensions", len(groups), remaining)
+
+    # Stage 4b: reduced JPEG decode; other formats can only be compared after a full decode
+    if draft:
+        jpeg_only = [files for files in candidates if all(infos[f].startswith("JPEG ") for f in files)]
+        draft_hashes = get_hashes(pool, get_draft_hash, [(f,) for files in jpeg_only for f in files],
+                                  "draft_hash", index)
+        number_of_candidates = remaining
+        candidates = [files for files in candidates if files not in jpeg_only]
+        for files in jpeg_only:
+            by_draft = defaultdict(list)
+            for file in files:
+                if file in draft_hashes:
+                    by_draft[draft_hashes[file]].append(file)
+            for same_draft in by_draft.values():
+                if len(same_draft) == 1:
+                    key, paths = groups[same_draft[0]]
+                    hash_map[key].extend(paths)
+                else:
+                    candidates.append(same_draft)
+        remaining = sum(len(files) for files in candidates)
+        print_stage("draft", number_of_candidates, remaining)
+
+    # Stage 4c: full decode
+    image_hashes = get_hashes(pool, get_image_hash, [(f,) for files in candidates for f in files],
+                              "image_hash", index)
+    by_hash = defaultdict(list)
+    for files in candidates:
+        for file in files:
+            if file in image_hashes:
+                by_hash[image_hashes[file]].append(file)
+    print_stage("pixels", remaining, sum(len(files) for files in by_hash.values() if len(files) > 1))
+    for hash_value, files in by_hash.items():
+        for file in files:
+            hash_map[hash_value].extend(groups[file][1])
+    return hash_map
+
+
+def merge_similar_groups(hash_map: dict, index: FileIndex, pool: HashPool,
+                         threshold: int, similar_hash: str = "dhash") -> defaultdict:
+    """
+    Merges groups whose images look alike.
+    One image per group is hashed with a perceptual hash, the hashes are clustered with a
+    multi-index hamming search (see perceptualHash.MultiIndex), and all groups of a cluster end
+    up under the key of the first one.
+    Groups whose image can't be decoded stay as they are.
+
+    Args:
+        hash_map (dict): hash -> file ids, as built by `get_pixel_groups`.
+        index (FileIndex): The files.
+        pool (HashPool): Pool the perceptual hashes are computed with.
+        threshold (int): Maximum hamming distance of two near-duplicates.
+        similar_hash (str): "dhash" or "phash".
+
+    Returns:
+        defaultdict: hash -> file ids with near-duplicates in the same group.
+    """
+    func = perceptualHash.phash if similar_hash == "phash" else perceptualHash.dhash
+    representatives = {files[0]: key for key, files in hash_map.items()}
+    print(f"[INFO] Stage 'similar': computing {similar_hash} of {len(representatives)} images")
+    perceptual_hashes = get_hashes(pool, func, [(file,) for file in representatives], similar_hash, index)
+
+    merged = defaultdict(list)
+    for cluster in perceptualHash.cluster(perceptual_hashes, threshold):
+        key = representatives[cluster[0]]
+        for file in cluster:
+            merged[key].extend(hash_map[representatives[file]])
+    for key, files in hash_map.items():
+        if files[0] not in perceptual_hashes:
+            merged[key].extend(files)
+
+    print_stage("similar", len(hash_map), len(merged))
+    return merged
+
+
 def get_file_hashmap(directory: Path,
                      recursive=True,
-                     extensions={'jpg', 'jpeg', 'png', 'cr2', 'arw', 'dng'}) -> defaultdict:
+                     extensions={'jpg', 'jpeg', 'png', 'cr2', 'arw', 'dng'},
+                     compare="pixels",
+                     jobs=1,
+                     draft=False,
+                     similar=None,
+                     similar_hash="dhash",
+                     algorithm="sha256") -> FileIndex:
     """
-    Returns a hashmap with all found files where the key is a SHA256 hash and the value is the file path.
+    Returns an index of all found files, grouped by hash: files with the same key are duplicates.
+
+    Byte-identical files are found first by `get_content_groups`, which starts hashing while
+    the directory is still being scanned.
+    With compare="pixels" one file of every content group is decoded with Pillow and groups
+    with the same image hash are merged, so re-encoded copies of an image are found as well.
+    With compare="bytes" no image is decoded at all.
+    With `similar` set, groups are merged further by `merge_similar_groups`.
 
     Args:
         directory (Path): The path to the directory where the search is started.
         recursive (bool): Recursive search.
         extensions (set): File extensions being used when searching for files.
+        compare (str): "pixels" or "bytes".
+        jobs (int): Number of processes used for hashing.
+        draft (bool): Tell JPEGs apart by a reduced decode first, see `get_pixel_groups`.
+        similar (int): Maximum perceptual hash distance of near-duplicates, None to skip.
+        similar_hash (str): "dhash" or "phash".
+        algorithm (str): Hash algorithm for comparing file content, one of fileHash.ALGORITHMS.
 
     Returns:
-        defaultdict: Hashmap of the files found.
+        FileIndex: The files found and their groups.
     """
-    hash_map = defaultdict(list)
-
-    pattern = "**/*" if recursive else "*"
-    files = [
-        f for f in directory.glob(pattern)
-        if f.is_file() and f.suffix[1:].lower() in extensions
-    ]
+    index = FileIndex()
+    infos = {} if compare == "pixels" else None
+    with HashPool(jobs) as pool:
+        entries = fileWalker.walk(directory, recursive=recursive, extensions=extensions, stat=True)
+        with metrics.timer("stage.content"):
+            content_groups = get_content_groups(entries, index, pool, algorithm, infos)
+
+        if compare == "bytes":
+            hash_map = defaultdict(list)
+            for key, files in content_groups:
+                hash_map[key].extend(files)
+        else:
+            with metrics.timer("stage.pixels"):
+                hash_map = get_pixel_groups(content_groups, index, pool, draft=draft, algorithm=algorithm,
+                                            infos=infos)
+        del content_groups, infos
 
-    for file in files:
-        try:
-            hash_value = get_image_hash(file)
-            # hash_value = get_file_hash(file)
-            hash_map[hash_value].append(file)
+        if similar is not None:
+            with metrics.timer("stage.similar"):
+                hash_map = merge_similar_groups(hash_map, index, pool, similar, similar_hash)
 
-        except Exception as e:
-            print(f"Error processing {file}: {e}")
+    metrics.count("files", len(index))
+    if cache is not None:
+        print(f"[INFO] Cache: {cache.hits} hits, {cache.misses} misses")
+        metrics.count("cache.hits", cache.hits)
+        metrics.count("cache.misses", cache.misses)
 
-    return hash_map
+    # Keep the scan order, determine_winner depends on it for ties; file ids are in scan order
+    groups = sorted(hash_map.items(), key=lambda item: min(item[1]))
+    del hash_map
+    index.set_groups((key, sorted(files)) for key, files in groups)
+    return index
 
 
 def get_exif_tags(filepath: Path) -> dict:
-    import subprocess
-    import json
     try:
-        result = subprocess.run(
-            ["exiftool", "-j", str(filepath)],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True,
-            text=True
-        )
-        data = json.loads(result.stdout)
+        data = json.loads(exiftoolPool.execute("-j", str(filepath)))
         return data[0] if data else {}
     except Exception:
         return {}
 
 
+def get_cached_exif_tags(filepath: Path, stat_result: os.stat_result) -> dict:
+    """
+    Same as `get_exif_tags`, but uses the cache if there is one.
+    Empty results (e.g. exiftool failed) are not cached.
+    """
+    if cache is None:
+        return get_exif_tags(filepath)
+    value = cache.get(filepath, stat_result, "exif_tags")
+    if value is not None:
+        return json.loads(value)
+    tags = get_exif_tags(filepath)
+    if tags:
+        cache.set(filepath, stat_result, "exif_tags", json.dumps(tags))
+    return tags
+
+
 def parse_exif_date(tags: dict) -> datetime | None:
     date_str = tags.get("DateTimeOriginal")
     if not date_str:
@@ -296,50 +1079,110 @@ def parse_exif_date(tags: dict) -> datetime | None:
 
 def get_value_score(tags: dict) -> int:
     """Score based on presence of valuable EXIF tags."""
-    score_tags = [
-        "FocalLength", "Aperture", "ShutterSpeed", "ISO", "CameraModelName", "LensModel"
-    ]
-    return sum(1 for tag in score_tags if tag in tags)
+    return sum(1 for tag in SCORE_TAGS if tag in tags)
 
 
-def determine_winner(paths: list[Path]) -> tuple[Path, list[Path]]:
+def prefetch_exif_tags(paths: list[Path]) -> dict[Path, dict]:
+    """
+    Reads the tags `determine_winner` needs for all paths at once.
+    Cached tags are reused, the rest is read with a few bulk exiftool requests and cached.
+
+    Args:
+        paths (list): Files to read.
+
+    Returns:
+        dict: path -> tags. Files exiftool couldn't read are missing.
+    """
+    tags_by_path = {}
+    missing = []
+    stats = {}
+    for path in paths:
+        try:
+            stats[path] = path.stat()
+        except OSError as e:
+            print(f"Error processing {path}: {e}")
+            continue
+        value = cache.get(path, stats[path], "exif_tags") if cache is not None else None
+        if value is None:
+            missing.append(path)
+        else:
+            tags_by_path[path] = json.loads(value)
+
+    try:
+        read = exiftoolPool.read_tags(missing, ["DateTimeOriginal", *SCORE_TAGS])
+    except Exception as e:
+        print(f"[WARNING] Failed to read EXIF tags: {e}")
+        read = {}
+    for path, tags in read.items():
+        tags_by_path[path] = tags
+        if cache is not None:
+            cache.set(path, stats[path], "exif_tags", json.dumps(tags))
+    return tags_by_path
+
+
+def get_candidate(path: Path, tags_by_path: dict[Path, dict] = None) -> dict:
+    """
+    Collects what `determine_winner` compares for one file: EXIF date, modification time
+    and the number of valuable EXIF tags.
+    """
+    stat_result = path.stat()
+    if tags_by_path is not None and path in tags_by_path:
+        tags = tags_by_path[path]
+    else:
+        tags = get_cached_exif_tags(path, stat_result)
+    return {
+        "path": path,
+        "date": parse_exif_date(tags),
+        "mtime": stat_result.st_mtime,
+        "score": get_value_score(tags),
+        "stat": stat_result,
+    }
+
+
+def compare_candidates(candidate: dict, current_best: dict) -> str | None:
+    """
+    Returns:
+        str: Why `candidate` is better than `current_best`, or None if it isn't.
+    """
+    # 1) Has EXIF date, and earlier
+    if candidate["date"] and not current_best["date"]:
+        return "has EXIF date"
+    elif candidate["date"] and current_best["date"]:
+        return "earlier EXIF date" if candidate["date"] < current_best["date"] else None
+
+    # 2) Fallback to file modification date
+    elif not candidate["date"] and candidate["mtime"] < current_best["mtime"]:
+        return "earlier modification time"
+
+    # 3) Tiebreaker: more useful tags
+    elif candidate["score"] > current_best["score"]:
+        return "more EXIF tags"
+    return None
+
+
+def determine_winner(paths: list[Path], tags_by_path: dict[Path, dict] = None) -> tuple[Path, list[Path]]:
+    """
+    Picks the file to keep out of a group of duplicates.
+
+    Args:
+        paths (list): The duplicates.
+        tags_by_path (dict): Prefetched tags (see `prefetch_exif_tags`).
+            Paths missing from it are read one by one.
+
+    Returns:
+        tuple: The winner and the list of losers.
+    """
     current_best = None
     losers = []
 
     for path in paths:
-        tags = get_exif_tags(path)
-        exif_date = parse_exif_date(tags)
-        modify_time = path.stat().st_mtime
-        score = get_value_score(tags)
-
-        candidate = {
-            "path": path,
-            "date": exif_date,
-            "mtime": modify_time,
-            "score": score,
-        }
+        candidate = get_candidate(path, tags_by_path)
 
         if current_best is None:
             current_best = candidate
             continue
 
-        # --- Compare logic:
-        better = False
-        # 1) Has EXIF date, and earlier
-        if candidate["date"] and not current_best["date"]:
-            better = True
-        elif candidate["date"] and current_best["date"]:
-            better = candidate["date"] < current_best["date"]
-
-        # 2) Fallback to file modification date
-        elif not candidate["date"] and candidate["mtime"] < current_best["mtime"]:
-            better = True
-
-        # 3) Tiebreaker: more useful tags
-        elif candidate["score"] > current_best["score"]:
-            better = True
-
-        if better:
+        if compare_candidates(candidate, current_best):
             losers.append(current_best["path"])
             current_best = candidate
         else:
@@ -348,87 +1191,559 @@ def determine_winner(paths: list[Path]) -> tuple[Path, list[Path]]:
     return current_best["path"], losers
 
 
-def delete_file(path: Path) -> None:
+class WinnerTable:
     """
-    Deletes the file at the given path.
-    Handles exceptions for file not found and permission errors.
+    The values `determine_winner` compares, for many files at once, in flat arrays instead of one
+    dict per file. Groups are consecutive ranges of rows, a row refers to a file of a `FileIndex`.
+    Dates are stored as seconds since 0001-01-01, so comparing them compares the datetimes.
     """
-    try:
-        path.unlink()
-        print(f"[INFO] Deleted: {path}")
-    except FileNotFoundError:
-        print(f"[WARNING] Failed to delete {path}. File not found.")
-    except PermissionError:
-        print(f"[WARNING] Failed to delete {path}. Permission denied.")
-    except Exception as e:
-        print(f"[WARNING] Failed to delete {path}: {e}")
 
-def find_duplicates(hash_map: defaultdict) -> None:
+    __slots__ = ("files", "starts", "has_date", "date", "mtime", "score")
+
+    def __init__(self):
+        self.files = array("I")
+        self.starts = array("q")  # first row of every group, plus the end of the last one
+        self.has_date = array("b")
+        self.date = array("q")
+        self.mtime = array("d")
+        self.score = array("i")
+
+    def add_group(self, index: FileIndex, files: list[int], tags_by_path: dict[Path, dict]) -> None:
+        """
+        Appends one group. The modification times are taken from `index`, tags missing from
+        `tags_by_path` are read. Raises OSError if that fails; the table is unchanged then.
+        """
+        rows = []
+        for file in files:
+            tags = tags_by_path.get(index.path(file))
+            if tags is None:
+                tags = get_cached_exif_tags(index.path(file), index.stat(file))
+            exif_date = parse_exif_date(tags)
+            seconds = 0 if exif_date is None else (
+                exif_date.toordinal() * 86400 + exif_date.hour * 3600 + exif_date.minute * 60 + exif_date.second)
+            rows.append((file, exif_date is not None, seconds, index.mtime[file], get_value_score(tags)))
+
+        if not self.starts:
+            self.starts.append(0)
+        for file, has_date, date, mtime, score in rows:
+            self.files.append(file)
+            self.has_date.append(has_date)
+            self.date.append(date)
+            self.mtime.append(mtime)
+            self.score.append(score)
+        self.starts.append(len(self.files))
+
+
+def determine_winners(index: FileIndex, tags_by_path: dict[Path, dict] = None) -> dict[int, tuple[Path, list[Path]]]:
+    """
+    Same as `determine_winner` for every group of `index` with more than one file, in one pass
+    over a `WinnerTable`. The modification times are taken from the index instead of calling
+    stat() again for every file.
+
+    The rules of `compare_candidates` are not a total order (a file without EXIF date beats one
+    with a date if it was modified earlier), so the winner can't be found by sorting; every group
+    is folded from left to right like `determine_winner` does.
+
+    Returns:
+        dict: group number (the position in `index.groups()`) -> (winner, losers)
+    """
+    table = WinnerTable()
+    numbers = []
+    for number, (hash_value, files) in enumerate(index.groups()):
+        if len(files) > 1:
+            try:
+                table.add_group(index, files, tags_by_path or {})
+                numbers.append(number)
+            except OSError as e:
+                print(f"Error processing group {hash_value}: {e}")
+
+    files, has_date, date, mtime, score = table.files, table.has_date, table.date, table.mtime, table.score
+    winners = {}
+    for number, start, end in zip(numbers, table.starts, table.starts[1:]):
+        best = start
+        losers = []
+        for row in range(start + 1, end):
+            if has_date[row]:
+                better = not has_date[best] or date[row] < date[best]
+            else:
+                better = mtime[row] < mtime[best] or score[row] > score[best]
+            if better:
+                losers.append(index.path(files[best]))
+                best = row
+            else:
+                losers.append(index.path(files[row]))
+        winners[number] = (index.path(files[best]), losers)
+    return winners
+
+
+def process_group(engine: TransferEngine, hash_value: str, paths: list[Path],
+                  tags_by_path: dict[Path, dict] = None, winner: tuple[Path, list[Path]] = None) -> None:
+    """
+    Copies the winner (or the single file) of one group and deletes the losers,
+    as requested by --copy and --delete.
+    `winner` is the result of `determine_winner` if it is already known.
+    """
+    if len(paths) > 1:
+        print(f"\n[INFO] Hash: {hash_value} ({len(paths)} entries)")
+        winning_path, all_but_winner = winner or determine_winner(paths, tags_by_path)
+        if args.verbose:
+            print(f"[VERBOSE] Winner: {winning_path}")
+            print("[VERBOSE] Loosers:")
+            for path in all_but_winner:
+                print(f"\t- {path}")
+
+        if args.copy:
+            print(f"[INFO] Copying winner to: {args.copy.resolve()}")
+            engine.transfer(winning_path, args.copy / winning_path.name, delete_source=bool(args.delete))
+
+        if args.delete:
+            for path in all_but_winner:
+                engine.delete(path)
+
+    elif len(paths) == 1:
+        if args.copy:
+            print(f"\n[INFO] Copying single file to: {args.copy.resolve()})")
+            engine.transfer(paths[0], args.copy / paths[0].name, delete_source=bool(args.delete))
+
+
+def get_duplicate_paths(index: FileIndex) -> list[Path]:
+    """
+    Returns:
+        list: The paths of all files in groups with more than one file.
+    """
+    return [index.path(file) for _, files in index.groups() if len(files) > 1 for file in files]
+
+
+def find_duplicates(index: FileIndex, record_moves: bool = False) -> TransferEngine:
+    """
+    Handles every group of `index` with `process_group` and prints a summary.
+    The winners of all groups are determined up front by `determine_winners`.
+
+    Returns:
+        TransferEngine: The engine that did the work, with its statistics and, with
+                        `record_moves`, the files moved away (see TransferEngine).
+    """
     print("\n=== find_duplicates ===")
-    number_of_files = 0
-    number_of_copied_files = 0
-    for hash_value, paths in hash_map.items():
-        number_of_files += len(paths)
-        if len(paths) > 1:
-            print(f"\n[INFO] Hash: {hash_value} ({len(paths)} entries)")
-            winning_path, all_but_winner = determine_winner(paths)
-            if args.verbose:
-                print(f"[VERBOSE] Winner: {winning_path}")
-                print("[VERBOSE] Loosers:")
-                for path in all_but_winner:
-                    print(f"\t- {path}")
-
-            if args.copy:
-                new_path = args.copy / winning_path.name
-                print(f"[INFO] Copying winner to: {args.copy.resolve()}")
-                try:
-                    shutil.copy2(winning_path, new_path)
-                    print(f"[INFO] Copied {winning_path} to {new_path}")
-                    number_of_copied_files += 1
-
-                    if args.delete:
-                        delete_file(winning_path)
-
-                except FileNotFoundError:
-                    print(f"[WARNING] Failed to copy {winning_path}. File not found.")
-                except Exception as e:
-                    print(f"[WARNING] Failed to copy {winning_path}: {e}")
-
-            if args.delete:
-                for path in all_but_winner:
-                    delete_file(path)
-
-
-        elif len(paths) == 1:
-            if args.copy:
-                new_path = args.copy / paths[0].name
-                print(f"\n[INFO] Copying single file to: {args.copy.resolve()})")
-                try:
-                    shutil.copy2(paths[0], new_path)
-                    print(f"[INFO] Copied {paths[0]} to {new_path}")
-                    number_of_copied_files += 1
-
-                    if args.delete:
-                        delete_file(paths[0])
-                        
-                except FileNotFoundError:
-                    print(f"[WARNING] Failed to copy {paths[0]}. File not found.")
-                except Exception as e:
-                    print(f"[WARNING] Failed to copy {paths[0]}: {e}")
-
-    print(f"\n[INFO] Found {len(hash_map)} unique hashes in {number_of_files} files.")
-    if number_of_copied_files > 0:
-        print(f"[INFO] Copied {number_of_copied_files} unique files to {args.copy.resolve()}")
+    with metrics.timer("stage.exif"):
+        tags_by_path = prefetch_exif_tags(get_duplicate_paths(index))
+    with metrics.timer("stage.winners"):
+        winners = determine_winners(index, tags_by_path)
+    with metrics.timer("stage.transfer"), TransferEngine(mode=args.link_mode, jobs=args.transfer_jobs,
+                                                         record_moves=record_moves) as engine:
+        for number, (hash_value, files) in enumerate(index.groups()):
+            paths = [index.path(file) for file in files]
+            process_group(engine, hash_value, paths, tags_by_path, winners.get(number))
+    metrics.count("groups", index.group_count())
+
+    print(f"\n[INFO] Found {index.group_count()} unique hashes in {len(index)} files.")
+    if engine.transferred > 0:
+        print(f"[INFO] Copied {engine.transferred} unique files to {args.copy.resolve()}")
+    if args.copy or args.delete:
+        engine.print_summary()
+
+    print()
+    return engine
+
+
+def get_watch_keys(index: FileIndex, pool: HashPool,
+                   compare: str = "pixels", algorithm: str = "sha256") -> dict[int, str]:
+    """
+    Computes the key `watch_duplicates` indexes a file by: the image data hash for RAW files,
+    the pixel hash for other images (with compare="pixels") and the content hash otherwise or
+    if the others fail. Unlike the stages of `get_file_hashmap`, the key of a file doesn't
+    depend on the other files, so new files can be added one at a time.
+
+    Returns:
+        dict: file id -> key for the files of `index`, in their order. Files that can't be read
+              are missing.
+    """
+    files = range(len(index))
+    raw_files = [file for file in files if index.extension(file) in rawHash.RAW_EXTENSIONS]
+    keys = get_hashes(pool, rawHash.get_raw_hash, [(file, algorithm) for file in raw_files], "raw_hash", index,
+                      algorithm)
+    if compare == "pixels":
+        images = [file for file in files if file not in keys and file not in raw_files]
+        keys.update(get_hashes(pool, get_image_hash, [(file,) for file in images], "image_hash", index))
+    missing = [file for file in files if file not in keys]
+    keys.update(get_hashes(pool, get_file_hash, [(file, algorithm) for file in missing], "content_hash", index,
+                            algorithm))
+    return {file: keys[file] for file in files if file in keys}
+
+
+def watch_duplicates() -> None:
+    """
+    Keeps an index of all files (key -> paths, see `get_watch_keys`) and updates it as files
+    arrive, change or disappear, using `fileWatcher`. Existing duplicates are handled once at
+    the start like without --watch; after that, every group a new file joins is handled again
+    by `process_group` as soon as the file is complete.
+
+    The keys are stored in the --cache file, so a restart only needs to stat the files.
+    Files moved into --copy (with --delete) stay in the index under their new path.
+    """
+    print("\n=== watch_duplicates ===")
+    watcher = fileWatcher.Watcher(args.path, recursive=args.recursive, extensions=args.extensions,
+                                  exclude=[args.copy] if args.copy else [], interval=args.poll_interval)
+    index = defaultdict(list)
+    keys = {}
+
+    def add(path, key):
+        keys[path] = key
+        index[key].append(path)
+
+    def remove(path):
+        key = keys.pop(path, None)
+        if key is not None:
+            index[key].remove(path)
+            if not index[key]:
+                del index[key]
+
+    try:
+        with HashPool(args.jobs) as pool:
+            scanned = FileIndex()
+            for file, stat_result in fileWalker.walk(args.path, recursive=args.recursive,
+                                                     extensions=args.extensions, stat=True):
+                if not watcher.is_excluded(file):
+                    scanned.add(file, stat_result)
+            groups = defaultdict(list)
+            for file, key in get_watch_keys(scanned, pool, args.compare, args.hash).items():
+                add(scanned.path(file), key)
+                groups[key].append(file)
+            scanned.set_groups(groups.items())
+            del groups
+            if cache is not None:
+                print(f"[INFO] Cache: {cache.hits} hits, {cache.misses} misses")
+            engine = find_duplicates(scanned, record_moves=True)
+            del scanned
+            update_watch_index(index, engine.moved, add, remove)
+
+            print(f"[INFO] Watching {args.path.resolve()} ({watcher.method}), {len(keys)} files indexed. "
+                  f"Stop with Ctrl+C.")
+            for changed, deleted in watcher.events():
+                number_of_files = len(keys)
+                for path in deleted:
+                    for indexed in [indexed for indexed in keys if indexed == path or path in indexed.parents]:
+                        remove(indexed)
+                removed = number_of_files - len(keys)
+                for path in changed:
+                    remove(path)
+
+                batch = FileIndex()
+                for path in changed:
+                    try:
+                        batch.add(path, path.stat())
+                    except OSError:
+                        pass  # gone again
+                new_keys = get_watch_keys(batch, pool, args.compare, args.hash)
+                affected = {}
+                for file, key in new_keys.items():
+                    path = batch.path(file)
+                    add(path, key)
+                    affected[key] = index[key]
+                    if len(index[key]) > 1:
+                        print(f"[INFO] Duplicate: {path} matches {index[key][0]}")
+
+                if affected:
+                    duplicates = [path for paths in affected.values() if len(paths) > 1 for path in paths]
+                    tags_by_path = prefetch_exif_tags(duplicates) if duplicates else {}
+                    with TransferEngine(mode=args.link_mode, jobs=args.transfer_jobs, record_moves=True) as engine:
+                        for key, paths in affected.items():
+                            process_group(engine, key, paths, tags_by_path)
+                    update_watch_index(affected, engine.moved, add, remove)
+                if new_keys or removed:
+                    print(f"[INFO] {len(new_keys)} new or changed, {removed} deleted, "
+                          f"{len(keys)} files indexed in {len(index)} groups")
+    except KeyboardInterrupt:
+        print("\n[INFO] Stopped watching.")
+    finally:
+        watcher.close()
+
+
+def update_watch_index(groups: dict, moved: list[tuple[Path, Path]], add, remove) -> None:
+    """
+    Brings the index of `watch_duplicates` in line with what `process_group` did to `groups`:
+    deleted files are removed, files moved into --copy are indexed under their new path.
+    """
+    destinations = dict(moved)
+    for key, paths in list(groups.items()):
+        for path in list(paths):
+            if path.exists():
+                continue
+            remove(path)
+            if path in destinations:
+                add(destinations[path], key)
+
+
+def get_plan_record(hash_value: str, paths: list[Path], tags_by_path: dict[Path, dict],
+                    root: Path, next_id: int) -> dict:
+    """
+    Decides one group of duplicates (or a single file) without touching any file.
+
+    Paths are stored relative to `root` and the copy target only by name, so the plan can be
+    applied on another machine that mounts the files somewhere else.
+    Size and mtime of every file are recorded, `apply_plan` skips files changed since then.
+
+    Returns:
+        dict: The group as written to the plan file, see `write_plan`.
+    """
+    def relative(path):
+        return path.relative_to(root).as_posix()
+
+    candidates = {path: get_candidate(path, tags_by_path) for path in paths}
+    if len(paths) > 1:
+        winning_path, all_but_winner = determine_winner(paths, tags_by_path)
+    else:
+        winning_path, all_but_winner = paths[0], []
+    winner = candidates[winning_path]
+
+    actions = []
+    if args.copy:
+        actions.append({"id": next_id, "op": "copy", "source": relative(winning_path),
+                        "name": winning_path.name, "delete_source": bool(args.delete)})
+    if args.delete:
+        for path in all_but_winner:
+            actions.append({"id": next_id + len(actions), "op": "delete", "path": relative(path)})
+
+    return {
+        "type": "group",
+        "hash": hash_value,
+        "winner": relative(winning_path),
+        "losers": [relative(path) for path in all_but_winner],
+        "reasons": {relative(path): compare_candidates(winner, candidates[path]) or "not better than the winner"
+                    for path in all_but_winner},
+        "files": {
+            relative(path): {
+                "size": candidate["stat"].st_size,
+                "mtime_ns": candidate["stat"].st_mtime_ns,
+                "date": candidate["date"].isoformat() if candidate["date"] else None,
+                "score": candidate["score"],
+            }
+            for path, candidate in candidates.items()
+        },
+        "actions": actions,
+    }
+
+
+def write_plan(index: FileIndex, plan_file: Path) -> None:
+    """
+    Writes the decisions of `find_duplicates` to a JSON lines file instead of acting on them.
+
+    The first line is a header with a unique plan id, the search root, the copy directory and
+    the options used, followed by one "group" line per hash (see `get_plan_record`), written as soon as the group
+    is decided, and a final "end" line. A plan without the "end" line is incomplete and
+    `apply_plan` refuses it.
+    A journal of an earlier plan written to the same file is deleted.
+    """
+    print("\n=== write_plan ===")
+    root = args.path
+    tags_by_path = prefetch_exif_tags(get_duplicate_paths(index))
+    groups = duplicates = files = 0
+    next_id = 0
+    plan_file.with_name(plan_file.name + ".done").unlink(missing_ok=True)
+    with open(plan_file, "w", encoding="utf-8") as f:
+        header = {
+            "type": "header",
+            "version": PLAN_VERSION,
+            "id": uuid.uuid4().hex,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "root": str(root.resolve()),
+            "copy": str(args.copy.resolve()) if args.copy else None,
+            "delete": bool(args.delete),
+            "compare": args.compare,
+            "hash": args.hash,
+            "similar": args.similar,
+        }
+        f.write(json.dumps(header) + "\n")
+        for hash_value, file_ids in index.groups():
+            paths = [index.path(file) for file in file_ids]
+            try:
+                record = get_plan_record(hash_value, paths, tags_by_path, root, next_id)
+            except OSError as e:
+                print(f"[WARNING] Skipping group {hash_value}: {e}")
+                continue
+            next_id += len(record["actions"])
+            groups += 1
+            files += len(paths)
+            duplicates += len(record["losers"])
+            if args.verbose and record["losers"]:
+                print(f"[VERBOSE] Hash: {hash_value}: keeping {record['winner']}, "
+                      f"{len(record['losers'])} duplicates")
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+        f.write(json.dumps({"type": "end", "groups": groups, "files": files, "actions": next_id}) + "\n")
+
+    print(f"[INFO] Found {groups} unique hashes in {files} files, {duplicates} duplicates.")
+    print(f"[INFO] Wrote plan with {next_id} actions to {plan_file.resolve()}")
+    print()
+
+
+def read_plan(plan_file: Path) -> tuple[dict, list[dict]]:
+    """
+    Returns:
+        tuple: The header and the list of group records of a plan file.
+
+    Raises:
+        ValueError: If the file isn't a complete plan.
+    """
+    header, groups, end = None, [], None
+    with open(plan_file, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"line {number}: {e}") from None
+            if record.get("type") == "header":
+                header = record
+            elif record.get("type") == "group":
+                groups.append(record)
+            elif record.get("type") == "end":
+                end = record
+    if header is None or header.get("version") != PLAN_VERSION:
+        raise ValueError(f"no header of plan version {PLAN_VERSION}")
+    if end is None or end["groups"] != len(groups):
+        raise ValueError("the plan is incomplete, its analysis didn't finish")
+    return header, groups
+
+
+def is_unchanged(path: Path, info: dict) -> bool:
+    """
+    Returns:
+        bool: True if size and mtime of `path` still match the plan.
+    """
+    stat_result = path.stat()
+    return stat_result.st_size == info["size"] and stat_result.st_mtime_ns == info["mtime_ns"]
 
+
+def apply_plan(plan_file: Path) -> None:
+    """
+    Carries out the copies and deletions of a plan written by `write_plan`.
+
+    Finished actions are appended to a journal next to the plan ("PLAN_FILE.done"), so after a
+    crash the same command resumes where it stopped. The journal starts with the id of its plan;
+    a journal of another plan is ignored and replaced. Actions whose result is already there
+    (source gone but copied, file already deleted) count as done, too, in case the journal
+    missed them. Files changed since the plan was written are skipped.
+    `--path` and `--copy` override the directories stored in the plan.
+    """
+    print("\n=== apply_plan ===")
+    try:
+        header, groups = read_plan(plan_file)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] Can't read plan {plan_file}: {e}. Aborting.")
+        sys.exit(1)
+
+    root = args.path if args.path is not None else Path(header["root"])
+    if args.copy == Path("-1"):
+        copy = root / "_output"
+    else:
+        copy = args.copy if args.copy is not None else (Path(header["copy"]) if header["copy"] else None)
+    print(f"[INFO] Plan created {header['created']} for {header['root']}")
+    print(f"[INFO] Files in: {root.resolve()}")
+    if not root.is_dir():
+        print(f"[ERROR] The path '{root}' is not a valid directory. Aborting.")
+        sys.exit(1)
+
+    actions = [(action, group) for group in groups for action in group["actions"]]
+    if any(action["op"] == "copy" for action, _ in actions):
+        print(f"[INFO] Copying unique files to: {copy.resolve()} (link mode: {args.link_mode})")
+        copy.mkdir(parents=True, exist_ok=True)
+    if header["delete"] and args.delete != "Y":
+        if not confirm_deletion():
+            print("[ERROR] Aborting.")
+            sys.exit(1)
+
+    journal_file = plan_file.with_name(plan_file.name + ".done")
+    journal_header = f"plan {header['id']}\n"
+    done = None
+    if journal_file.exists():
+        with open(journal_file, encoding="utf-8") as f:
+            if f.readline() == journal_header:
+                done = {int(line) for line in f if line.strip()}
+        if done is None:
+            print(f"[WARNING] Ignoring {journal_file}, it belongs to another plan")
+        else:
+            print(f"[INFO] Resuming: {len(done & {action['id'] for action, _ in actions})} "
+                  f"of {len(actions)} actions already done")
+    print()
+
+    journal_lock = threading.Lock()
+    skipped = 0
+    with open(journal_file, "a" if done is not None else "w", encoding="utf-8") as journal:
+        if done is None:
+            done = set()
+            journal.write(journal_header)
+            journal.flush()
+        def mark_done(action_id):
+            with journal_lock:
+                journal.write(f"{action_id}\n")
+                journal.flush()
+
+        with TransferEngine(mode=args.link_mode, jobs=args.transfer_jobs) as engine:
+            for action, group in actions:
+                if action["id"] in done:
+                    continue
+                callback = partial(mark_done, action["id"])
+                if action["op"] == "copy":
+                    source, destination = root / action["source"], copy / action["name"]
+                    if not source.exists():
+                        if destination.exists():
+                            print(f"[INFO] Already copied: {source}")
+                            callback()
+                        else:
+                            print(f"[WARNING] Failed to copy {source}. File not found.")
+                            skipped += 1
+                        continue
+                    if not is_unchanged(source, group["files"][action["source"]]):
+                        print(f"[WARNING] Not copying {source}: changed since the plan was written")
+                        skipped += 1
+                        continue
+                    engine.transfer(source, destination, delete_source=action["delete_source"],
+                                    callback=callback)
+                elif action["op"] == "delete":
+                    path = root / action["path"]
+                    if not path.exists():
+                        print(f"[INFO] Already deleted: {path}")
+                        callback()
+                        continue
+                    if not is_unchanged(path, group["files"][action["path"]]):
+                        print(f"[WARNING] Not deleting {path}: changed since the plan was written")
+                        skipped += 1
+                        continue
+                    engine.delete(path, callback=callback)
+
+    engine.print_summary()
+    if skipped:
+        print(f"[INFO] Skipped {skipped} actions, run the analysis again to include them.")
     print()
 
 
 def main() -> None:
-    global args
+    global args, cache
     args = parse_args()
 
-    hash_map = get_file_hashmap(args.path, recursive=args.recursive, extensions=args.extensions)
-    find_duplicates(hash_map)
+    with metrics.session(args, "imageDuplicatesFinder"):
+        if args.apply:
+            apply_plan(args.apply)
+            return
+
+        if args.cache:
+            cache = HashCache(args.cache, rebuild=args.rebuild_cache)
+        try:
+            if args.watch:
+                watch_duplicates()
+                return
+            index = get_file_hashmap(args.path, recursive=args.recursive,
+                                     extensions=args.extensions, compare=args.compare,
+                                     jobs=args.jobs, draft=args.draft, similar=args.similar,
+                                     similar_hash=args.similar_hash, algorithm=args.hash)
+            if args.plan:
+                write_plan(index, args.plan)
+            else:
+                find_duplicates(index)
+        finally:
+            if cache is not None:
+                cache.close()
 
 
 if __name__ == "__main__":
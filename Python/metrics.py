@@ -0,0 +1,271 @@
+"""
+Description:
+Lightweight timers and counters shared by the scripts, and the --metrics and --profile options.
+
+The building blocks (fileWalker, exiftoolPool, transfer, the hash pool of imageDuplicatesFinder)
+record where time goes: directory listings and stat calls, decoding and hashing, exiftool
+requests, copies and deletions. Nothing is recorded until a script calls `enable()`, so the
+timers cost a single check otherwise. Work done in worker processes is measured there and
+added with `add_time`.
+
+At the end of a run the totals, the wall time and the peak RSS (of the script and, separately,
+of its largest child process) are written as JSON or in the Prometheus textfile format, which
+the node_exporter textfile collector picks up. The file is replaced atomically.
+
+Usage:
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    with metrics.session(args, "imageDuplicatesFinder"):
+        with metrics.timer("stage.content"):
+            ...
+        metrics.count("files", len(files))
+
+Requirements:
+* Python 3.6 or higher
+* resource module (Unix) for the peak RSS, it is reported as null elsewhere
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import functools
+import contextlib
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+FORMATS = ["json", "prometheus-textfile"]
+PROFILE_LINES = 30  # functions printed from the cProfile statistics
+TRACEMALLOC_LINES = 10  # allocation sites printed from tracemalloc
+TRACEMALLOC_FRAMES = 5
+
+enabled = False
+_lock = threading.Lock()
+_timers = {}  # name -> [count, seconds]
+_counters = {}  # name -> value
+_start = time.perf_counter()
+
+
+def enable() -> None:
+    global enabled, _start
+    enabled = True
+    _start = time.perf_counter()
+
+
+def add_time(name: str, seconds: float, count: int = 1) -> None:
+    if not enabled:
+        return
+    with _lock:
+        timer = _timers.setdefault(name, [0, 0.0])
+        timer[0] += count
+        timer[1] += seconds
+
+
+def count(name: str, value: float = 1) -> None:
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+@contextlib.contextmanager
+def timer(name: str):
+    """
+    Adds the time spent in the `with` block to the timer `name`, also if it raises.
+    """
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    """
+    Decorator, adds the time spent in every call of the function to the timer `name`.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def get_peak_rss() -> tuple[int | None, int | None]:
+    """
+    Returns:
+        tuple: Peak resident set size in bytes of this process and of its largest child process
+               that has finished, None where unknown.
+    """
+    if resource is None:
+        return None, None
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return own, children or None
+
+
+def snapshot(script: str) -> dict:
+    """
+    Returns:
+        dict: All timers and counters, the wall time and the peak RSS.
+    """
+    own, children = get_peak_rss()
+    with _lock:
+        timers = {name: {"count": count, "seconds": round(seconds, 6)}
+                  for name, (count, seconds) in sorted(_timers.items())}
+        counters = dict(sorted(_counters.items()))
+    return {
+        "script": script,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "wall_seconds": round(time.perf_counter() - _start, 6),
+        "peak_rss_bytes": own,
+        "peak_rss_children_bytes": children,
+        "timers": timers,
+        "counters": counters,
+    }
+
+
+def _metric_name(name: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def format_prometheus(data: dict) -> str:
+    """
+    Returns:
+        str: `data` of `snapshot` in the Prometheus text format.
+    """
+    script = data["script"]
+    lines = [
+        "# HELP photo_script_wall_seconds Duration of the last run.",
+        "# TYPE photo_script_wall_seconds gauge",
+        f'photo_script_wall_seconds{{script="{script}"}} {data["wall_seconds"]}',
+        "# HELP photo_script_last_run_timestamp_seconds End of the last run.",
+        "# TYPE photo_script_last_run_timestamp_seconds gauge",
+        f'photo_script_last_run_timestamp_seconds{{script="{script}"}} {time.time():.0f}',
+    ]
+    for key, help_text in [("peak_rss_bytes", "Peak resident set size of the script."),
+                           ("peak_rss_children_bytes", "Peak resident set size of its largest child process.")]:
+        if data[key] is not None:
+            lines += [f"# HELP photo_script_{key} {help_text}", f"# TYPE photo_script_{key} gauge",
+                      f'photo_script_{key}{{script="{script}"}} {data[key]}']
+    if data["timers"]:
+        lines += ["# HELP photo_script_operation_seconds Time spent in an operation during the last run.",
+                  "# TYPE photo_script_operation_seconds gauge"]
+        lines += [f'photo_script_operation_seconds{{script="{script}",operation="{name}"}} {timer["seconds"]}'
+                  for name, timer in data["timers"].items()]
+        lines += ["# HELP photo_script_operations Number of times an operation ran during the last run.",
+                  "# TYPE photo_script_operations gauge"]
+        lines += [f'photo_script_operations{{script="{script}",operation="{name}"}} {timer["count"]}'
+                  for name, timer in data["timers"].items()]
+    for name, value in data["counters"].items():
+        metric = f"photo_script_{_metric_name(name)}"
+        lines += [f"# TYPE {metric} gauge", f'{metric}{{script="{script}"}} {value}']
+    return "\n".join(lines) + "\n"
+
+
+def write(script: str, metrics_format: str, metrics_file: Path) -> None:
+    """
+    Writes the `snapshot` to `metrics_file`, replacing it atomically, or to stdout for "-".
+    """
+    data = snapshot(script)
+    text = format_prometheus(data) if metrics_format == "prometheus-textfile" else json.dumps(data, indent=2) + "\n"
+    if str(metrics_file) == "-":
+        sys.stdout.write(text)
+        return
+    temporary = metrics_file.with_name(f".{metrics_file.name}.{os.getpid()}.tmp")
+    temporary.write_text(text, encoding="utf-8")
+    os.replace(temporary, metrics_file)
+    print(f"[INFO] Metrics written to {metrics_file.resolve()}")
+
+
+def add_arguments(parser) -> None:
+    """
+    Adds --metrics, --metrics-file and --profile to an `argparse.ArgumentParser`.
+    """
+    parser.add_argument(
+        "--metrics",
+        choices=FORMATS,
+        help="Record timers and counters of scanning, stat, decoding, hashing, exiftool, copies and "
+             "deletions, and the peak RSS, and write them at the end of the run"
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=Path,
+        help="File the --metrics are written to, '-' for stdout "
+             "(default: <script>.json or <script>.prom in the current directory)"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Run under cProfile and tracemalloc and write <script>.prof and a summary of both "
+             "(the main process only; slows the run down considerably)"
+    )
+
+
+@contextlib.contextmanager
+def session(args, script: str):
+    """
+    Handles --metrics and --profile of `add_arguments` around the `with` block. The results are
+    written when the block ends, also after an error or Ctrl+C.
+    """
+    if args.metrics:
+        enable()
+    profiler = None
+    if args.profile:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            write_profile(profiler, script)
+        if args.metrics:
+            metrics_file = args.metrics_file or Path(
+                f"{script}.{'prom' if args.metrics == 'prometheus-textfile' else 'json'}")
+            write(script, args.metrics, metrics_file)
+
+
+def write_profile(profiler: cProfile.Profile, script: str) -> None:
+    """
+    Dumps the cProfile statistics to <script>.prof (for snakeviz, `python -m pstats`, ...) and
+    writes the top functions and the largest allocation sites to <script>.profile.txt.
+    """
+    profile_file = Path(f"{script}.prof")
+    profiler.dump_stats(profile_file)
+
+    output = io.StringIO()
+    output.write(f"=== cProfile, top {PROFILE_LINES} by cumulative time ===\n")
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_LINES)
+    current, peak = tracemalloc.get_traced_memory()
+    output.write(f"=== tracemalloc: {current / 1e6:.1f} MB allocated at the end, peak {peak / 1e6:.1f} MB ===\n")
+    for stat in tracemalloc.take_snapshot().statistics("traceback")[:TRACEMALLOC_LINES]:
+        output.write(f"{stat.size / 1e6:.1f} MB in {stat.count} blocks\n")
+        output.write("".join(f"    {line}\n" for line in stat.traceback.format()))
+    tracemalloc.stop()
+
+    summary_file = Path(f"{script}.profile.txt")
+    summary_file.write_text(output.getvalue(), encoding="utf-8")
+    print(f"[INFO] Profile written to {profile_file.resolve()} and {summary_file.resolve()}")
@@ -4,7 +4,7 @@ import sys
 import os
 import re
 import math
-from pathlib import Path
+import fileWalker
 from datetime import datetime
 
 fileCount = 0
@@ -47,8 +47,10 @@ def main():
     # jpg = list(Path(path).rglob("*.[jJ][pP][gG]"))
     # arw = list(Path(path).rglob("*.[aA][rR][wW]"))
     # non-recursive glob
-    jpg = list(Path(path).glob("*.[jJ][pP][gG]"))
-    arw = list(Path(path).glob("*.[aA][rR][wW]"))
+    # non-recursive scan, one directory listing for all extensions
+    files = fileWalker.get_files(path, recursive=False, extensions={"jpg", "arw"})
+    jpg = [f for f in files if fileWalker.get_extension(f.name) == "jpg"]
+    arw = [f for f in files if fileWalker.get_extension(f.name) == "arw"]
     fileCount = len(jpg) + len(arw)
 
     print("{} JPGs and {} ARWs have been found".format(len(jpg), len(arw)))
@@ -9,7 +9,7 @@ import sys
 import os
 import re
 import math
-from pathlib import Path
+import fileWalker
 from datetime import datetime
 import exifread
 # from memory_profiler import profile
@@ -90,13 +90,15 @@ def main():
     # jpg = list(Path(path).rglob("*.[jJ][pP][gG]"))
     # arw = list(Path(path).rglob("*.[aA][rR][wW]"))
     # non-recursive glob
-    jpg = list(Path(path).glob("*.[jJ][pP][gG]"))
     # jpg = list(Path(path).glob("*.[pP][nN][gG]"))
     # arw = list(Path(path).glob("*.[aA][rR][wW]"))
     # arw = list(Path(path).glob("*.[cC][rR][2]"))
     # arw = list(Path(path).glob("*.[oO][rR][fF]"))
-    arw = list(Path(path).glob("*.[dD][nN][gG]"))
-    xmp = list(Path(path).glob("*.[xX][mM][pP]"))
+    # non-recursive scan, one directory listing for all extensions
+    files = fileWalker.get_files(path, recursive=False, extensions={"jpg", "dng", "xmp"})
+    jpg = [f for f in files if fileWalker.get_extension(f.name) == "jpg"]
+    arw = [f for f in files if fileWalker.get_extension(f.name) == "dng"]
+    xmp = [f for f in files if fileWalker.get_extension(f.name) == "xmp"]
 
     for file in xmp:
         matches = filename_regex.match(str(file))
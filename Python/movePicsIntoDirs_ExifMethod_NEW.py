@@ -11,14 +11,20 @@ import sys
 import os
 import re
 import math
+import json
+import argparse
+import threading
 from pathlib import Path
+import fileWalker
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import exifread
-import subprocess
-import json
-# from memory_profiler import profile
+import exifReader
+from exiftoolPool import ExifToolError
+import metrics
 
 xmps = {}
+exif_dates = {}
 fileCount = 0
 filesProcessed = 0
 args = None
@@ -29,26 +35,146 @@ regex_pattern = re.compile(r'(\d+):(\d+):(\d+)')
 
 filename_regex = re.compile(r'(\w+)')
 
+DEFAULT_JOBS = 8  # threads renaming files in --batch mode; the work is waiting for I/O
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Move JPG and DNG files of the current directory into _processed/YYYY-MM-DD "
+                    "by their EXIF DateTimeOriginal.")
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Plan all moves first, create every date directory once and rename the files on a thread pool"
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"Threads renaming files in --batch mode (default: {DEFAULT_JOBS})"
+    )
+    parser.add_argument(
+        "--dry-run",
+        nargs="?",
+        const="-",
+        metavar="PLAN_FILE",
+        help="Don't move anything, write the planned moves as JSON lines to PLAN_FILE "
+             "(default: the console)"
+    )
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    if args.jobs < 1:
+        print("[ERROR] --jobs must be at least 1. Aborting.")
+        sys.exit(1)
+    return args
+
+def get_target_directory(exif_value_as_string):
+    """
+    Returns:
+        str: '_processed/YYYY-MM-DD' for a DateTimeOriginal value, None if it can't be parsed.
+    """
+    matches = regex_pattern.match(exif_value_as_string)
+    if not matches:
+        return None
+    year, month, day = matches.group(1), matches.group(2), matches.group(3)
+    return f"_processed/{year}-{month}-{day}"
+
+def plan_moves(files):
+    """
+    Decides where every file goes, without touching any file. The XMP sidecar of a file
+    (same name up to the first non-word character) goes along with it.
+
+    Returns:
+        list: {"source", "destination", "sidecar", "sidecar_destination"} per file with a usable
+              date, in the order of `files`. Files without one are reported and left out.
+    """
+    moves = []
+    sidecars = dict(xmps)
+    for file in files:
+        if file in exif_dates:
+            exif_value_as_string = exif_dates[file].get("DateTimeOriginal")
+        else:
+            exif_value_as_string = get_exif_date(file)
+        if not exif_value_as_string:
+            print(f"[Skip] No 'DateTimeOriginal' EXIF tag found for '{file}'.")
+            continue
+        dir = get_target_directory(exif_value_as_string)
+        if dir is None:
+            print(f"Failed to parse EXIF date: '{exif_value_as_string}' in file '{file}'")
+            continue
+
+        sidecar = sidecars.pop(filename_regex.match(str(file)).group(1), None)
+        moves.append({
+            "source": str(file),
+            "destination": f"{dir}/{file}",
+            "sidecar": str(sidecar) if sidecar else None,
+            "sidecar_destination": f"{dir}/{sidecar}" if sidecar else None,
+        })
+    return moves
+
+def write_plan(moves, plan_file):
+    lines = "".join(json.dumps(move) + "\n" for move in moves)
+    if plan_file == "-":
+        print(lines, end="")
+    else:
+        with open(plan_file, "w", encoding="utf-8") as f:
+            f.write(lines)
+        print(f"Wrote {len(moves)} planned moves to '{Path(plan_file).resolve()}'")
+
+def move_batch(moves, jobs):
+    """
+    Creates every target directory once, then renames the files (and sidecars) on `jobs` threads.
+
+    Returns:
+        tuple: (number of files moved, number of failures)
+    """
+    with metrics.timer("stage.mkdir"):
+        for dir in dict.fromkeys(os.path.dirname(move["destination"]) for move in moves):
+            try:
+                os.makedirs(dir, exist_ok=True)
+            except Exception as e:
+                print(f"Couldn't create directory '{dir}': {e}")
+
+    lock = threading.Lock()
+    done = [0, 0]  # moved, failed
+
+    def move_file(move):
+        try:
+            with metrics.timer("move"):
+                os.rename(move["source"], move["destination"])
+                if move["sidecar"]:
+                    os.rename(move["sidecar"], move["sidecar_destination"])
+            failed = 0
+        except Exception as exception:
+            print(f"Can't move file '{move['source']}': {repr(exception)}")
+            failed = 1
+        with lock:
+            done[0] += 1 - failed
+            done[1] += failed
+            progress = (done[0] + done[1]) / len(moves)
+            print(math.ceil(progress * 10 - 0.5) * "*" + f"  {progress * 100:.2f}%", end="\r")
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # list() to see exceptions of move_file itself
+        list(executor.map(move_file, moves))
+    return done[0], done[1]
+
 def get_exif_date(filepath):
     try:
-        result = subprocess.run(
-            ["exiftool", "-j", "-DateTimeOriginal", filepath],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True,
-            text=True
-        )
-        metadata = json.loads(result.stdout)
-        if metadata and "DateTimeOriginal" in metadata[0]:
-            return metadata[0]["DateTimeOriginal"]
-    except subprocess.CalledProcessError as e:
+        # JPEG and TIFF based RAWs are read in-process, everything else by exiftool
+        metadata = exifReader.get_tags(filepath, ["DateTimeOriginal"])
+        if "DateTimeOriginal" in metadata:
+            return metadata["DateTimeOriginal"]
+    except ExifToolError as e:
         print(f"[ExifTool error] {e.stderr.strip()}")
     return None
 
 def checkFile(file):
     global fileCount, filesProcessed, xmps
 
-    exif_value_as_string = get_exif_date(file)
+    if file in exif_dates:
+        exif_value_as_string = exif_dates[file].get("DateTimeOriginal")
+    else:
+        exif_value_as_string = get_exif_date(file)
     if exif_value_as_string:
         matches = regex_pattern.match(exif_value_as_string)
         if not matches:
@@ -67,7 +193,8 @@ def checkFile(file):
             return
 
         try:
-            os.rename(file, filepath_new)
+            with metrics.timer("move"):
+                os.rename(file, filepath_new)
             reg_group = filename_regex.match(str(file)).group(1)
             if reg_group in xmps:
                 xmp_old_filename = xmps[reg_group]
@@ -83,9 +210,20 @@ def checkFile(file):
     output = math.ceil(progress * 10 - 0.5) * "*" + f"  {progress * 100:.2f}%"
     print(output, end="\r")
 
-# @profile
 def main():
-    global fileCount, xmps
+    global args
+    args = parse_args()
+    with metrics.session(args, "movePicsIntoDirs_ExifMethod_NEW"):
+        process_directory()
+
+    print("\n\nDone! Hit enter to quit the program!")
+    while True:
+        inp = input()   # Get the input
+        if inp == "":       # If it is a blank line...
+            break
+
+def process_directory():
+    global fileCount, xmps, exif_dates
 
     path = "./"
     print("Working directory: {}".format(path))
@@ -94,14 +232,17 @@ def main():
     # jpg = list(Path(path).rglob("*.[jJ][pP][gG]"))
     # arw = list(Path(path).rglob("*.[aA][rR][wW]"))
     # non-recursive glob
-    jpg = list(Path(path).glob("*.[jJ][pP][gG]"))
     # jpg = list(Path(path).glob("*.[jJ][pP][eE][gG]"))
     # jpg = list(Path(path).glob("*.[pP][nN][gG]"))
     # arw = list(Path(path).glob("*.[aA][rR][wW]"))
     # arw = list(Path(path).glob("*.[cC][rR][2]"))
     # arw = list(Path(path).glob("*.[oO][rR][fF]"))
-    arw = list(Path(path).glob("*.[dD][nN][gG]"))
-    xmp = list(Path(path).glob("*.[xX][mM][pP]"))
+    # non-recursive scan, one directory listing for all extensions
+    with metrics.timer("stage.scan"):
+        files = fileWalker.get_files(path, recursive=False, extensions={"jpg", "dng", "xmp"})
+    jpg = [f for f in files if fileWalker.get_extension(f.name) == "jpg"]
+    arw = [f for f in files if fileWalker.get_extension(f.name) == "dng"]
+    xmp = [f for f in files if fileWalker.get_extension(f.name) == "xmp"]
 
     for file in xmp:
         matches = filename_regex.match(str(file))
@@ -119,6 +260,22 @@ def main():
 
     print("Processing {} files...".format(fileCount))
 
+    # Read all dates up front; only files exifReader can't parse go to exiftool, in bulk
+    try:
+        with metrics.timer("stage.exif"):
+            exif_dates = exifReader.get_tags_bulk(jpg + arw, ["DateTimeOriginal"])
+    except Exception as e:
+        print(f"[ExifTool error] Bulk read failed, reading files one by one: {e}")
+    metrics.count("files", fileCount)
+
+    if args.batch or args.dry_run:
+        with metrics.timer("stage.plan"):
+            moves = plan_moves(jpg + arw)
+        if args.dry_run:
+            write_plan(moves, args.dry_run)
+            print(f"Dry run: {len(moves)} of {fileCount} files would be moved, nothing was changed.")
+            return
+
     try:
         os.mkdir("_processed")
         print("Created directory ./_processed")
@@ -126,17 +283,18 @@ def main():
         # print("Directory ./_processed already exist")
         pass
 
-    for file in jpg:
-        checkFile(file)
+    if args.batch:
+        with metrics.timer("stage.move"):
+            moved, failed = move_batch(moves, args.jobs)
+        print(f"\nMoved {moved} files, {failed} failed, {fileCount - len(moves)} skipped.")
+        return
 
-    for file in arw:
-        checkFile(file)
+    with metrics.timer("stage.move"):
+        for file in jpg:
+            checkFile(file)
 
-    print("\n\nDone! Hit enter to quit the program!")
-    while True:
-        inp = input()   # Get the input
-        if inp == "":       # If it is a blank line...
-            break
+        for file in arw:
+            checkFile(file)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,197 @@
+"""
+Description:
+Perceptual hashes (dHash, pHash) and a multi-index hamming structure to find near-duplicate images.
+
+A perceptual hash is a 64 bit fingerprint of a heavily downscaled grayscale version of the image.
+Re-saved, recompressed or resized copies of an image get hashes which differ in only a few bits,
+so near-duplicates are pairs with a small hamming distance.
+
+JPEGs are decoded with `Image.draft()`, which lets libjpeg decode at 1/2, 1/4 or 1/8 scale,
+so a 24 MP photo never has to be decoded at full resolution.
+
+Neighbours are searched with multi-index hashing over the distinct hashes: only hashes sharing a
+(nearly) identical block with the query are compared, instead of all pairs.
+A BK-tree was tried first, but with 64 bit hashes and typical thresholds it visits most of the tree.
+
+Requirements:
+* Python 3.10 or higher
+* Pillow library for image processing (`pip install pillow`)
+"""
+
+import math
+from collections import defaultdict
+from PIL import Image
+
+HASH_SIZE = 8  # 8x8 = 64 bit hashes
+PHASH_SIZE = 32  # pHash works on a 32x32 image and keeps the 8x8 low frequencies
+
+
+def _load_gray(filepath, size: tuple[int, int]) -> Image.Image:
+    """
+    Opens the image as grayscale, scaled down to `size`.
+    Uses JPEG draft mode, so the decoder only produces a fraction of the pixels.
+    """
+    with Image.open(filepath) as img:
+        # draft() picks the smallest scale that is still at least as large as requested
+        img.draft("L", (size[0] * 4, size[1] * 4))
+        return img.convert("L").resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+
+def dhash(filepath) -> str:
+    """
+    Difference hash: compares every pixel with its right neighbour in a 9x8 grayscale image.
+
+    Args:
+        filepath (Path): The path to the image.
+
+    Returns:
+        str: The 64 bit hash as 16 hex digits.
+    """
+    img = _load_gray(filepath, (HASH_SIZE + 1, HASH_SIZE))
+    pixels = list(img.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for column in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return f"{value:016x}"
+
+
+def _dct_matrix(n: int, keep: int) -> list[list[float]]:
+    return [[math.cos(math.pi * k * (2 * i + 1) / (2 * n)) for i in range(n)] for k in range(keep)]
+
+
+_DCT = _dct_matrix(PHASH_SIZE, HASH_SIZE)
+
+
+def phash(filepath) -> str:
+    """
+    Perceptual hash: the signs of the 8x8 lowest DCT frequencies of a 32x32 grayscale image,
+    compared against their median. More robust against resizing and contrast changes than dHash.
+
+    Args:
+        filepath (Path): The path to the image.
+
+    Returns:
+        str: The 64 bit hash as 16 hex digits.
+    """
+    img = _load_gray(filepath, (PHASH_SIZE, PHASH_SIZE))
+    pixels = list(img.getdata())
+    rows = [pixels[i * PHASH_SIZE:(i + 1) * PHASH_SIZE] for i in range(PHASH_SIZE)]
+
+    # Separable 2D DCT, only the low frequencies are computed
+    partial = [[sum(c * v for c, v in zip(basis, row)) for basis in _DCT] for row in rows]
+    coefficients = [
+        sum(_DCT[u][i] * partial[i][v] for i in range(PHASH_SIZE))
+        for u in range(HASH_SIZE) for v in range(HASH_SIZE)
+    ]
+    median = sorted(coefficients[1:])[len(coefficients) // 2 - 1]  # without the DC term
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (coefficient > median)
+    return f"{value:016x}"
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _flips(bits: int, radius: int) -> list[int]:
+    """
+    Returns all masks of `bits` bits with at most `radius` bits set.
+    """
+    masks = {0}
+    for _ in range(radius):
+        masks |= {mask | (1 << bit) for mask in masks for bit in range(bits)}
+    return sorted(masks)
+
+
+class MultiIndex:
+    """
+    Multi-index hashing over 64 bit hashes with the hamming distance as metric.
+
+    The hashes are split into `m` blocks with one dict per block (block value -> hashes).
+    If two hashes differ in at most `threshold` bits, at least one of their blocks differs in at
+    most `threshold // m` bits (pigeonhole principle). A search therefore only looks up the
+    blocks of the query with up to `threshold // m` flipped bits and verifies those candidates,
+    instead of comparing against every stored hash.
+    `m` is chosen from the number of hashes to balance bucket size against lookups.
+    Only `m` with at most 2 flipped bits per block are considered; for thresholds no such `m`
+    can handle (48 and more with 64 bit hashes) every stored hash is compared instead.
+    """
+
+    __slots__ = ("threshold", "blocks", "tables", "masks", "values")
+
+    def __init__(self, hashes: list[int], threshold: int, bits: int = HASH_SIZE * HASH_SIZE):
+        self.threshold = threshold
+        count = max(1, len(hashes))
+
+        def cost(m):
+            width = bits // m
+            return m * len(_flips(width, threshold // m)) * max(1.0, count / 2 ** width)
+
+        feasible = [m for m in range(1, min(threshold + 1, 16) + 1) if threshold // m <= 2]
+        self.values = None if feasible else list(hashes)
+        m = min(feasible, key=cost) if feasible else 0
+        bounds = [bits * i // m for i in range(m + 1)] if m else []
+        self.blocks = [(start, end - start) for start, end in zip(bounds, bounds[1:])]
+        self.masks = [_flips(width, threshold // m) for _, width in self.blocks]
+        self.tables = [defaultdict(list) for _ in self.blocks]
+        for value in hashes:
+            for table, (start, width) in zip(self.tables, self.blocks):
+                table[(value >> start) & ((1 << width) - 1)].append(value)
+
+    def search(self, value: int) -> set[int]:
+        """
+        Returns:
+            set: All stored hashes within `threshold` of `value`, including `value` itself.
+        """
+        if self.values is not None:
+            return {candidate for candidate in self.values if hamming(value, candidate) <= self.threshold}
+        found = set()
+        for table, masks, (start, width) in zip(self.tables, self.masks, self.blocks):
+            block = (value >> start) & ((1 << width) - 1)
+            for mask in masks:
+                for candidate in table.get(block ^ mask, ()):
+                    if candidate not in found and hamming(value, candidate) <= self.threshold:
+                        found.add(candidate)
+        return found
+
+
+def cluster(hashes: dict, threshold: int) -> list[list]:
+    """
+    Groups items whose hashes are within `threshold` bits, transitively (single linkage).
+
+    Args:
+        hashes (dict): item -> hash as hex string.
+        threshold (int): Maximum hamming distance of two neighbours.
+
+    Returns:
+        list: Clusters as lists of items, in the order of `hashes`. Items without neighbours
+              form clusters of their own.
+    """
+    items_by_hash = defaultdict(list)
+    for item, value in hashes.items():
+        items_by_hash[int(value, 16)].append(item)
+
+    index = MultiIndex(list(items_by_hash), threshold)
+
+    # Union-find over the distinct hashes
+    parent = {value: value for value in items_by_hash}
+
+    def find(value):
+        while parent[value] != value:
+            parent[value] = parent[parent[value]]
+            value = parent[value]
+        return value
+
+    for value in items_by_hash:
+        for neighbour in index.search(value):
+            root_a, root_b = find(value), find(neighbour)
+            if root_a != root_b:
+                parent[root_b] = root_a
+
+    clusters = defaultdict(list)
+    for item, value in hashes.items():
+        clusters[find(int(value, 16))].append(item)
+    return list(clusters.values())
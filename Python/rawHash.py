@@ -0,0 +1,153 @@
+"""
+Description:
+Content hash of TIFF based RAW files (CR2, ARW, DNG, NEF, ORF, RW2, PEF) without decoding them.
+
+Pillow can't read RAW files, and hashing the whole file treats a copy with edited metadata
+(new date, rating, keywords) as a different file. Instead, the IFD chain of the file, including
+SubIFDs, is walked to find the largest image data block: the strips or tiles of the sensor data,
+or the embedded full-size JPEG where that is larger. Only these byte ranges are hashed, together
+with the dimensions of that image, so I/O is proportional to the image data and metadata changes
+don't matter.
+
+Requirements:
+* Python 3.6 or higher
+"""
+
+import mmap
+import struct
+
+import fileHash
+
+RAW_EXTENSIONS = {"cr2", "arw", "dng", "nef", "orf", "rw2", "pef", "srw", "nrw", "sr2"}
+
+# TIFF magic numbers: standard TIFF, Olympus ORF ("RO", "RS"), Panasonic RW2
+MAGIC_NUMBERS = {42, 0x4F52, 0x5352, 0x55}
+MAX_IFDS = 64
+
+TAG_WIDTH = 0x0100
+TAG_HEIGHT = 0x0101
+TAG_STRIP_OFFSETS = 0x0111
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_TILE_OFFSETS = 0x0144
+TAG_TILE_BYTE_COUNTS = 0x0145
+TAG_JPEG_OFFSET = 0x0201
+TAG_JPEG_LENGTH = 0x0202
+WANTED_TAGS = {TAG_WIDTH, TAG_HEIGHT, TAG_STRIP_OFFSETS, TAG_STRIP_BYTE_COUNTS, TAG_SUB_IFDS,
+               TAG_TILE_OFFSETS, TAG_TILE_BYTE_COUNTS, TAG_JPEG_OFFSET, TAG_JPEG_LENGTH}
+
+# TIFF field type -> (struct format, size in bytes) of the integer types
+INTEGER_TYPES = {3: ("H", 2), 4: ("L", 4), 13: ("L", 4)}
+
+
+def _read_integers(data, byte_order: str, entry: int) -> list[int]:
+    field_type, count = struct.unpack(byte_order + "HL", data[entry + 2:entry + 8])
+    if field_type not in INTEGER_TYPES:
+        return []
+    fmt, size = INTEGER_TYPES[field_type]
+    total = size * count
+    if total <= 4:
+        start = entry + 8
+    else:
+        start = struct.unpack(byte_order + "L", data[entry + 8:entry + 12])[0]
+    if start + total > len(data):
+        raise ValueError("IFD value outside of file")
+    return list(struct.unpack(f"{byte_order}{count}{fmt}", data[start:start + total]))
+
+
+def _read_ifds(data) -> list[dict]:
+    """
+    Returns the wanted tags of every IFD reachable from the header, following the
+    next-IFD links and SubIFDs.
+    """
+    byte_order = {b"II": "<", b"MM": ">"}.get(bytes(data[:2]))
+    if byte_order is None or struct.unpack(byte_order + "H", data[2:4])[0] not in MAGIC_NUMBERS:
+        raise ValueError("not a TIFF based RAW file")
+
+    ifds = []
+    pending = [struct.unpack(byte_order + "L", data[4:8])[0]]
+    visited = set()
+    while pending and len(visited) < MAX_IFDS:
+        offset = pending.pop(0)
+        if offset == 0 or offset in visited or offset + 2 > len(data):
+            continue
+        visited.add(offset)
+        count = struct.unpack(byte_order + "H", data[offset:offset + 2])[0]
+        end = offset + 2 + 12 * count
+        if end + 4 > len(data):
+            continue
+
+        tags = {}
+        for index in range(count):
+            entry = offset + 2 + 12 * index
+            tag = struct.unpack(byte_order + "H", data[entry:entry + 2])[0]
+            if tag in WANTED_TAGS:
+                tags[tag] = _read_integers(data, byte_order, entry)
+        ifds.append(tags)
+        pending.extend(tags.get(TAG_SUB_IFDS, []))
+        pending.append(struct.unpack(byte_order + "L", data[end:end + 4])[0])
+    return ifds
+
+
+def _data_ranges(tags: dict) -> list[tuple[int, int]]:
+    """
+    Returns (offset, length) of the image data of one IFD.
+    """
+    for offsets_tag, counts_tag in ((TAG_STRIP_OFFSETS, TAG_STRIP_BYTE_COUNTS),
+                                    (TAG_TILE_OFFSETS, TAG_TILE_BYTE_COUNTS),
+                                    (TAG_JPEG_OFFSET, TAG_JPEG_LENGTH)):
+        offsets, counts = tags.get(offsets_tag), tags.get(counts_tag)
+        if offsets and counts and len(offsets) == len(counts):
+            return list(zip(offsets, counts))
+    return []
+
+
+def get_image_data_ranges(data) -> tuple[str, list[tuple[int, int]]]:
+    """
+    Finds the largest image data block of a RAW file.
+
+    Returns:
+        tuple: ("WIDTHxHEIGHT", [(offset, length), ...])
+
+    Raises:
+        ValueError: If the file isn't TIFF based or contains no image data.
+    """
+    best_size, best = 0, None
+    for tags in _read_ifds(data):
+        ranges = _data_ranges(tags)
+        size = sum(length for _, length in ranges)
+        if size > best_size:
+            width = tags.get(TAG_WIDTH, [0])[0]
+            height = tags.get(TAG_HEIGHT, [0])[0]
+            best_size, best = size, (f"{width}x{height}", ranges)
+    if best is None:
+        raise ValueError("no image data found")
+    for offset, length in best[1]:
+        if offset + length > len(data):
+            raise ValueError("image data outside of file")
+    return best
+
+
+def get_raw_hash(filepath, algorithm: str = "sha256") -> str:
+    """
+    Hashes the largest image data block of a RAW file and its dimensions.
+
+    Args:
+        filepath (Path): The path to the RAW file.
+        algorithm (str): One of fileHash.ALGORITHMS.
+
+    Returns:
+        str: "raw:" followed by the digest.
+
+    Raises:
+        ValueError: If the file isn't TIFF based or contains no image data.
+    """
+    hasher = fileHash.new_hasher(algorithm)
+    with open(filepath, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            dimensions, ranges = get_image_data_ranges(data)
+            hasher.update(dimensions.encode())
+            with memoryview(data) as view:
+                for offset, length in ranges:
+                    hasher.update(view[offset:offset + length])
+    return f"raw:{fileHash.digest(hasher, algorithm)}"
@@ -0,0 +1,258 @@
+"""
+Description:
+Concurrent file transfer engine used to copy, link or move files into an output directory.
+
+Modes:
+* copy     - `shutil.copy2`, a full copy of data and metadata
+* hardlink - `os.link`, a second name for the same inode (same filesystem only)
+* reflink  - copy-on-write clone with the FICLONE ioctl (btrfs, XFS, ...), falling back to
+             `os.copy_file_range`, which the kernel can also turn into a clone or a server-side
+             copy, and finally to a normal copy
+* move     - `os.replace` on the same filesystem, `shutil.move` (copy and delete) otherwise
+
+Hardlink and reflink fall back to a copy when the target is on another filesystem or the
+filesystem doesn't support them. Transfers run on a thread pool, since they mostly wait for I/O.
+
+Requirements:
+* Python 3.8 or higher (os.copy_file_range: Linux, Python 3.8+)
+"""
+
+import os
+import sys
+import time
+import shutil
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+MODES = ["copy", "hardlink", "reflink", "move"]
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from linux/fs.h
+COPY_CHUNK = 64 * 1024 * 1024  # bytes per os.copy_file_range call
+
+if sys.platform.startswith("linux"):
+    import fcntl
+else:
+    fcntl = None
+
+
+def _print(message: str) -> None:
+    # One write per line, print() writes the newline separately and lines of threads interleave
+    sys.stdout.write(message + "\n")
+
+
+def delete_file(path: Path) -> bool:
+    """
+    Deletes the file at the given path.
+    Handles exceptions for file not found and permission errors.
+
+    Returns:
+        bool: True if the file was deleted.
+    """
+    try:
+        path.unlink()
+        _print(f"[INFO] Deleted: {path}")
+        return True
+    except FileNotFoundError:
+        _print(f"[WARNING] Failed to delete {path}. File not found.")
+    except PermissionError:
+        _print(f"[WARNING] Failed to delete {path}. Permission denied.")
+    except Exception as e:
+        _print(f"[WARNING] Failed to delete {path}: {e}")
+    return False
+
+
+def _temporary_name(destination: Path) -> Path:
+    return destination.with_name(f".{destination.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+
+
+def reflink(source: Path, destination: Path) -> str:
+    """
+    Clones `source` to `destination`.
+
+    Returns:
+        str: The method that worked: "reflink", "copy_file_range" or "copy".
+    """
+    if fcntl is not None:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                method = "reflink"
+            except OSError:
+                method = "copy_file_range"
+                try:
+                    remaining = os.fstat(src.fileno()).st_size
+                    while remaining > 0:
+                        copied = os.copy_file_range(src.fileno(), dst.fileno(), min(remaining, COPY_CHUNK))
+                        if copied == 0:
+                            break
+                        remaining -= copied
+                except (OSError, AttributeError):
+                    method = None
+        if method is not None:
+            shutil.copystat(source, destination)
+            return method
+    shutil.copy2(source, destination)
+    return "copy"
+
+
+def transfer_file(source: Path, destination: Path, mode: str = "copy") -> str:
+    """
+    Transfers one file. An existing destination is replaced, like `shutil.copy2` does.
+
+    Returns:
+        str: The method that was used in the end, e.g. "copy" after a failed hardlink.
+    """
+    if mode == "move":
+        try:
+            os.replace(source, destination)
+            return "rename"
+        except OSError:
+            shutil.move(source, destination)
+            return "move"
+
+    if mode == "copy":
+        shutil.copy2(source, destination)
+        return "copy"
+
+    # hardlink and reflink can't overwrite; create next to the destination and replace it
+    temporary = _temporary_name(destination)
+    try:
+        if mode == "hardlink":
+            try:
+                os.link(source, temporary)
+                method = "hardlink"
+            except OSError:
+                shutil.copy2(source, temporary)
+                method = "copy"
+        else:
+            method = reflink(source, temporary)
+        os.replace(temporary, destination)
+        return method
+    finally:
+        if temporary.exists():
+            temporary.unlink()
+
+
+class TransferEngine:
+    """
+    Runs transfers and deletions on a thread pool and keeps statistics.
+
+    Usage:
+        with TransferEngine(mode="reflink", jobs=8) as engine:
+            engine.transfer(source, destination, delete_source=False)
+            engine.delete(path)
+        engine.print_summary()
+    """
+
+    def __init__(self, mode: str = "copy", jobs: int = 4, record_moves: bool = False):
+        if mode not in MODES:
+            raise ValueError(f"Unknown transfer mode: {mode}")
+        self.mode = mode
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.slots = threading.BoundedSemaphore(jobs * 4)  # bounds queued tasks
+        self.lock = threading.Lock()
+        self.destinations = set()
+        self.transferred = 0
+        self.deleted = 0
+        self.failed = 0
+        self.bytes = 0
+        self.methods = {}
+        self.moved = [] if record_moves else None  # (source, destination) of files no longer at source
+        self.start = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.executor.shutdown(wait=True)
+        self.elapsed = time.perf_counter() - self.start
+
+    def _submit(self, func, *args) -> None:
+        self.slots.acquire()
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(lambda _: self.slots.release())
+
+    def transfer(self, source: Path, destination: Path, delete_source: bool = False,
+                 callback=None) -> None:
+        """
+        Queues the transfer of `source` to `destination`. With `delete_source` the source is
+        deleted after a successful copy (in move mode it is gone anyway).
+        Two transfers to the same destination in one run would overwrite each other; the
+        second one is skipped and its source is kept.
+        `callback()` is called from the worker thread once everything succeeded.
+        """
+        key = os.path.normcase(os.path.abspath(destination))
+        if os.path.normcase(os.path.abspath(source)) == key:
+            # Already in place, e.g. a file --watch moved into the output directory before
+            if callback is not None:
+                callback()
+            return
+        with self.lock:
+            if key in self.destinations:
+                _print(f"[WARNING] Not copying {source}: another file was already copied to {destination}")
+                self.failed += 1
+                return
+            self.destinations.add(key)
+        self._submit(self._transfer, source, destination, delete_source, callback)
+
+    def _transfer(self, source: Path, destination: Path, delete_source: bool, callback) -> None:
+        try:
+            start = time.perf_counter()
+            size = source.stat().st_size
+            method = transfer_file(source, destination, self.mode)
+            metrics.add_time(f"transfer.{method}", time.perf_counter() - start)
+            metrics.count("transfer.bytes", size)
+            _print(f"[INFO] Copied {source} to {destination} ({method})")
+        except FileNotFoundError:
+            _print(f"[WARNING] Failed to copy {source}. File not found.")
+            with self.lock:
+                self.failed += 1
+            return
+        except Exception as e:
+            _print(f"[WARNING] Failed to copy {source}: {e}")
+            with self.lock:
+                self.failed += 1
+            return
+
+        with self.lock:
+            self.transferred += 1
+            self.bytes += size
+            self.methods[method] = self.methods.get(method, 0) + 1
+        if delete_source and self.mode != "move" and not self.delete(source, wait=True):
+            return
+        if self.moved is not None and (delete_source or self.mode == "move"):
+            with self.lock:
+                self.moved.append((source, destination))
+        if callback is not None:
+            callback()
+
+    def delete(self, path: Path, wait: bool = False, callback=None) -> bool:
+        """
+        Queues the deletion of `path`, or deletes it right away with `wait`.
+        `callback()` is called after a successful deletion.
+
+        Returns:
+            bool: With `wait`, True if the file was deleted.
+        """
+        if not wait:
+            self._submit(self.delete, path, True, callback)
+            return False
+        with metrics.timer("delete"):
+            deleted = delete_file(path)
+        if not deleted:
+            return False
+        with self.lock:
+            self.deleted += 1
+        if callback is not None:
+            callback()
+        return True
+
+    def print_summary(self) -> None:
+        elapsed = getattr(self, "elapsed", time.perf_counter() - self.start)
+        methods = ", ".join(f"{count} {method}" for method, count in sorted(self.methods.items()))
+        _print(f"[INFO] Transferred {self.transferred} files ({methods or 'none'}), "
+              f"{self.bytes / 1e6:.1f} MB in {elapsed:.1f} s "
+              f"({self.bytes / 1e6 / elapsed if elapsed > 0 else 0:.1f} MB/s), "
+              f"deleted {self.deleted}, failed {self.failed}")
@@ -1,66 +1,68 @@
 import os
 import re
-import subprocess
+import exifWriter
+import fileWalker
 
 # Matches '20171206' in filenames like 'IMG-20171206-WA0008.jpg'
 filename_date_regex = re.compile(r'(\d{4})(\d{2})(\d{2})')
 
 
-def get_file_modify_time(filepath):
-    try:
-        result = subprocess.run(
-            ["exiftool", "-s", "-s", "-s", "-FileModifyDate", filepath],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True,
-            text=True
-        )
-        full_datetime = result.stdout.strip()
+def get_file_modify_time(filepath, modify_date=None):
+    """
+    Returns:
+        tuple: Date and time of the file modification date in local time, like
+               ("2017:12:06", "14:22:01"), or (None, None) if the file can't be stat'ed.
+               `modify_date` is the date from fileWalker.get_modify_dates, else the file is
+               stat'ed here.
+    """
+    if modify_date is None:
+        try:
+            modify_date = fileWalker.format_modify_date(os.stat(filepath))
+        except OSError as e:
+            print(f"[Error] Can't read the modification date of '{filepath}': {e}")
+            return None, None
+    return modify_date[:10], modify_date[11:19]
 
-        parts = full_datetime.split()
-        if len(parts) >= 2:
-            date_str = parts[0]
-            time_str = parts[1][:8]
-            return date_str, time_str
-    except subprocess.CalledProcessError as e:
-        print(f"[ExifTool error] {e.stderr.strip()}")
-        return None, None
 
-
-def extract_exif_modify_time(filename, filepath):
-    file_date_str, file_time_str = get_file_modify_time(filepath)
+def extract_exif_modify_time(filename, filepath, modify_date=None):
+    file_date_str, file_time_str = get_file_modify_time(filepath, modify_date)
+    if file_date_str is None:
+        return None
     return f"{file_date_str} {file_time_str}"
 
 
-def write_exif_date(filepath, exif_date):
-    try:
-        subprocess.run(
-            ["exiftool", "-P",
-                f"-DateTimeOriginal={exif_date}", "-overwrite_original", filepath],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        print(f"[OK] Wrote EXIF date '{exif_date}' to '{filepath}'")
-    except subprocess.CalledProcessError as e:
-        print(
-            f"[Error] Failed to write EXIF to '{filepath}': {e.stderr.strip()}")
+def write_exif_dates(dates):
+    """
+    Writes DateTimeOriginal to many files, in place where possible and otherwise with a few
+    bulk exiftool requests (see exifWriter), and prints the result per file.
+
+    Args:
+        dates (dict): filepath -> exif date
+    """
+    results = exifWriter.write_date_time_original(dates)
+    for filepath, error in results.items():
+        if error is None:
+            print(f"[OK] Wrote EXIF date '{dates[filepath]}' to '{filepath}'")
+        else:
+            print(
+                f"[Error] Failed to write EXIF to '{filepath}': {error}")
 
 
 def process_directory(path="."):
-    for filename in os.listdir(path):
-        if not filename.lower().endswith((".jpg", ".jpeg", ".dng")):
-            continue
-
-        filepath = os.path.join(path, filename)
-        exif_date = extract_exif_modify_time(filename, filepath)
+    dates = {}
+    # The modification dates of all files in one pass, with the directory listing
+    modify_dates = fileWalker.get_modify_dates(path, recursive=False, extensions={"jpg", "jpeg", "dng"})
+    for file, modify_date in modify_dates.items():
+        filepath = str(file)
+        filename = file.name
+        exif_date = extract_exif_modify_time(filename, filepath, modify_date)
         if exif_date:
-            write_exif_date(filepath, exif_date)
+            dates[filepath] = exif_date
             # print(filename + "  " + exif_date)
             pass
         else:
             print(f"[Skip] Could not extract valid date from '{filename}'")
+    write_exif_dates(dates)
 
 
 if __name__ == "__main__":
@@ -1,41 +1,75 @@
-# This script sets the EXIF DateTimeOriginal tag for all JPEG and DNG files in the current directory.
-# It uses the exiftool command-line utility to modify the EXIF data.
+# This script sets the EXIF DateTimeOriginal tag for all JPEG and DNG files in the given directories.
+# An existing DateTimeOriginal is overwritten in place (see exifWriter); files without one are
+# written with the exiftool command-line utility (through exiftoolPool), by a few bulk requests
+# spread over all CPU cores.
+# Usage:
+#   python writeSpecificDateTimeOriginal.py "2011:04:24 16:45:00" [PATH ...] [--recursive]
+#   PATH can be a file or a directory, the default is the current directory.
 # Requirements:
 # - exiftool must be installed and available in the system PATH.
 
-# TODO: Be able to pass date and time as arguments
+import sys
+import argparse
+from datetime import datetime
+from pathlib import Path
+import exifWriter
+import fileWalker
 
-import os
-import re
-import subprocess
+extensions = {"jpg", "jpeg", "dng"}
 
-date_time = '2011:04:24 16:45:00'
 
-
-def write_exif_date(filepath, exif_date):
+def parse_args():
+    parser = argparse.ArgumentParser(description="Set EXIF DateTimeOriginal of JPEG and DNG files to a fixed value.")
+    parser.add_argument("date_time", help="The new DateTimeOriginal, e.g. '2011:04:24 16:45:00'")
+    parser.add_argument("paths", nargs="*", type=Path, default=[Path(".")],
+                        help="Files and directories (default: the current directory)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Search directories recursively")
+    args = parser.parse_args()
     try:
-        subprocess.run(
-            ["exiftool", "-P",
-                f"-DateTimeOriginal={exif_date}", "-overwrite_original", filepath],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        print(f"[OK] Wrote EXIF date '{exif_date}' to '{filepath}'")
-    except subprocess.CalledProcessError as e:
-        print(
-            f"[Error] Failed to write EXIF to '{filepath}': {e.stderr.strip()}")
+        datetime.strptime(args.date_time, "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        print(f"[Error] '{args.date_time}' is not a date like '2011:04:24 16:45:00'")
+        sys.exit(1)
+    return args
+
+
+def write_exif_dates(dates):
+    """
+    Writes DateTimeOriginal to many files at once and prints the result per file.
+
+    Args:
+        dates (dict): filepath -> exif date
+
+    Returns:
+        int: The number of files that couldn't be written.
+    """
+    results = exifWriter.write_date_time_original(dates)
+    for filepath, error in results.items():
+        if error is None:
+            print(f"[OK] Wrote EXIF date '{dates[filepath]}' to '{filepath}'")
+        else:
+            print(f"[Error] Failed to write EXIF to '{filepath}': {error}")
+    return sum(error is not None for error in results.values())
+
 
+def get_files(paths, recursive=False):
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(fileWalker.get_files(path, recursive=recursive, extensions=extensions))
+        elif path.is_file():
+            files.append(path)
+        else:
+            print(f"[Skip] '{path}' doesn't exist")
+    return files
 
-def process_directory(path="."):
-    for filename in os.listdir(path):
-        if not filename.lower().endswith((".jpg", ".jpeg", ".dng")):
-            continue
 
-        filepath = os.path.join(path, filename)
-        write_exif_date(filepath, date_time)
+def main():
+    args = parse_args()
+    files = get_files(args.paths, args.recursive)
+    failed = write_exif_dates({str(file): args.date_time for file in files})
+    print(f"Wrote {len(files) - failed} of {len(files)} files")
 
 
 if __name__ == "__main__":
-    process_directory(".")
+    main()